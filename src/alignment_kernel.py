@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD = 0.3
+
+
+# count table rows grouped by (combination, ref value). Row arrays are ordered so that the rows of a group are
+# contiguous and keep their original order; groups are ordered by first appearance
+class Ref_Value_Groups:
+    # row level
+    combinations: np.ndarray
+    ref_values: np.ndarray
+    target_values: np.ndarray
+    counts: np.ndarray
+    row_groups: np.ndarray
+    # group level
+    starts: np.ndarray
+    group_combinations: np.ndarray
+    group_ref_values: np.ndarray
+    num_target_values: np.ndarray
+    max_counts: np.ndarray
+    max_target_values: np.ndarray
+    trows: np.ndarray
+
+    def __init__(
+            self,
+            combinations: np.ndarray,
+            ref_values: np.ndarray,
+            target_values: np.ndarray,
+            counts: np.ndarray,
+    ):
+        # ref values are codes < 2**31, so combination and ref value fit in one int64 key
+        keys = combinations.astype(np.int64) * (1 << 31) + ref_values
+        row_groups, _uniques = pd.factorize(keys)
+        order = np.argsort(row_groups, kind="stable")
+        self.combinations = combinations[order]
+        self.ref_values = ref_values[order]
+        self.target_values = target_values[order]
+        self.counts = counts[order]
+        self.row_groups = row_groups[order]
+        num_rows = len(self.counts)
+        self.starts = np.flatnonzero(
+            np.r_[True, self.row_groups[1:] != self.row_groups[:-1]]
+        ) if num_rows > 0 else np.zeros(0, dtype=np.int64)
+        self.group_combinations = self.combinations[self.starts]
+        self.group_ref_values = self.ref_values[self.starts]
+        self.num_target_values = np.diff(np.r_[self.starts, num_rows])
+        self.trows = self.group_sum(self.counts)
+        self.max_counts = self.group_max(self.counts)
+        # first target value (in original order) with the max count
+        is_max = self.counts == self.max_counts[self.row_groups]
+        first_max = self.group_min(np.where(is_max, np.arange(num_rows), num_rows))
+        self.max_target_values = self.target_values[first_max]
+
+    def num_groups(self) -> int:
+        return len(self.starts)
+
+    def group_sum(self, row_values: np.ndarray) -> np.ndarray:
+        if len(self.starts) == 0:
+            return np.zeros(0, dtype=row_values.dtype)
+        return np.add.reduceat(row_values, self.starts)
+
+    def group_max(self, row_values: np.ndarray) -> np.ndarray:
+        if len(self.starts) == 0:
+            return np.zeros(0, dtype=row_values.dtype)
+        return np.maximum.reduceat(row_values, self.starts)
+
+    def group_min(self, row_values: np.ndarray) -> np.ndarray:
+        if len(self.starts) == 0:
+            return np.zeros(0, dtype=row_values.dtype)
+        return np.minimum.reduceat(row_values, self.starts)
+
+
+class Alignment_Kernel:
+    def __init__(self):
+        return
+
+    @staticmethod
+    def combination_sum(
+            combinations: np.ndarray, values: np.ndarray, num_combinations: int
+    ) -> np.ndarray:
+        return np.bincount(combinations, weights=values, minlength=num_combinations)
+
+    @staticmethod
+    def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denominator > 0, numerator / denominator, 0.0)
+
+    @staticmethod
+    def alignment_sums(
+            groups: Ref_Value_Groups,
+            num_combinations: int,
+            target_mfvs: np.ndarray,
+            check_for_exact_matches: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        # per combination row and value counts - they add up over groups scored in separate calls, as long as
+        # all rows of a (combination, ref value) group are in the same call
+        gc = groups.group_combinations
+        # every target value of a ref value is counted twice towards tvals, so tvals == 1 never holds -
+        # kept to match the row by row formula
+        tvals = 2 * groups.num_target_values
+        trows = groups.trows
+        max_counts = groups.max_counts
+        # if the number of target values corresponding to this ref value < 1/threshold,
+        # the target value is not a sigle row and target value is not target field mfv,
+        # we have a match
+        matching_values = (
+                (tvals == 1)
+                | (groups.max_target_values == target_mfvs[gc])
+                | (max_counts > trows * ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD)
+        )
+        # if we do not have a unique value, adjust aligned row count
+        non_unique = trows > 1
+        exact_match_rows = check_for_exact_matches[groups.combinations] & (
+                groups.ref_values == groups.target_values
+        )
+
+        def csum(combinations, values):
+            return Alignment_Kernel.combination_sum(combinations, values, num_combinations)
+
+        return (
+            csum(gc, np.where(non_unique, max_counts, 0)),  # aligned rows
+            csum(gc, np.where(non_unique, trows, 0)),  # non unique rows
+            csum(groups.combinations, np.where(exact_match_rows, groups.counts, 0)),  # matching rows
+            csum(gc, trows),  # total rows
+            csum(gc, matching_values),  # matching values
+            csum(gc, groups.num_target_values),  # total values
+        )
+
+    @staticmethod
+    def alignment_ratios(
+            sums: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray),
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        # returns alignment, exact match strength and value match strength for every combination
+        aligned_rows, non_unique_rows, matching_rows, total_rows, matching_values, total_values = sums
+        return (
+            Alignment_Kernel.ratio(aligned_rows, non_unique_rows),
+            Alignment_Kernel.ratio(matching_rows, total_rows),
+            Alignment_Kernel.ratio(matching_values, total_values),
+        )
+
+    @staticmethod
+    def score_alignments(
+            groups: Ref_Value_Groups,
+            num_combinations: int,
+            target_mfvs: np.ndarray,
+            check_for_exact_matches: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        return Alignment_Kernel.alignment_ratios(
+            Alignment_Kernel.alignment_sums(
+                groups, num_combinations, target_mfvs, check_for_exact_matches
+            )
+        )
+
+    @staticmethod
+    def last_ref_values(groups: Ref_Value_Groups, num_combinations: int) -> np.ndarray:
+        # ref value of the last group of every combination, -1 for combinations without groups
+        last_groups = np.full(num_combinations, -1, dtype=np.int64)
+        np.maximum.at(last_groups, groups.group_combinations, np.arange(groups.num_groups()))
+        last_ref_values = np.full(num_combinations, -1, dtype=np.int64)
+        has_groups = last_groups >= 0
+        last_ref_values[has_groups] = groups.group_ref_values[last_groups[has_groups]]
+        return last_ref_values
+
+    @staticmethod
+    def sparse_alignment_sums(
+            groups: Ref_Value_Groups,
+            num_combinations: int,
+            ref_mfvs: np.ndarray,
+            target_mfvs: np.ndarray,
+            is_unique: np.ndarray,
+            check_for_exact_matches: np.ndarray,
+            last_ref_values: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        # per combination row and value counts - they add up over groups scored in separate calls, as long as
+        # all rows of a (combination, ref value) group are in the same call
+        rc = groups.combinations
+        gc = groups.group_combinations
+        ref_is_mfv = groups.ref_values == ref_mfvs[rc]
+        target_is_mfv = groups.target_values == target_mfvs[rc]
+        # skip the mfv to mfv matches - they are meaningless for sparse fields
+        # mfv to non-mfv matches are counted as mismatches
+        mfv_to_mfv = ref_is_mfv & target_is_mfv
+        mismatch = (ref_is_mfv | target_is_mfv) & ~mfv_to_mfv
+        non_mfv = ~(ref_is_mfv | target_is_mfv)
+        counts = groups.counts
+        trows = groups.trows - groups.group_sum(np.where(mfv_to_mfv, counts, 0))
+        max_counts = groups.group_max(np.where(non_mfv & ~is_unique[rc], counts, 0))
+        tvals = groups.num_target_values + groups.group_sum(non_mfv.astype(np.int64))
+        # if the number of target values corresponding to this ref value < 1/threshold, we have a match
+        matching_values = ~is_unique[gc] & (
+                (tvals == 1) | (max_counts > trows * ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD)
+        )
+        exact_match_rows = (
+                non_mfv & check_for_exact_matches[rc] & (groups.ref_values == groups.target_values)
+        )
+        # the row by row loop reset mismatches for every ref value, so only the mismatches of the last ref
+        # value (in first appearance order) count towards the non-mfv row alignment
+        group_mismatches = groups.group_sum(np.where(mismatch, counts, 0))
+        is_last = groups.group_ref_values == last_ref_values[gc]
+
+        def csum(combinations, values):
+            return Alignment_Kernel.combination_sum(combinations, values, num_combinations)
+
+        return (
+            csum(gc, max_counts),  # aligned rows
+            csum(rc, np.where(exact_match_rows, counts, 0)),  # matching rows
+            csum(gc, trows),  # total rows
+            csum(gc, matching_values),  # matching values
+            csum(gc, groups.num_target_values),  # total values
+            csum(gc, np.where(is_last, group_mismatches, 0)),  # mismatches
+        )
+
+    @staticmethod
+    def sparse_alignment_ratios(
+            sums: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray),
+    ) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        # returns alignment, exact match strength, value match strength and non-mfv row alignment for every
+        # combination
+        aligned_rows, matching_rows, total_rows, matching_values, total_values, mismatches = sums
+        scored = (total_rows > 0) & (total_values > 0)
+        return (
+            np.where(scored, Alignment_Kernel.ratio(aligned_rows, total_rows), 0.0),
+            np.where(scored, Alignment_Kernel.ratio(matching_rows, total_rows), 0.0),
+            np.where(scored, Alignment_Kernel.ratio(matching_values, total_values), 0.0),
+            np.where(scored, Alignment_Kernel.ratio(total_rows - mismatches, total_rows), 0.0),
+        )
+
+    @staticmethod
+    def score_sparse_alignments(
+            groups: Ref_Value_Groups,
+            num_combinations: int,
+            ref_mfvs: np.ndarray,
+            target_mfvs: np.ndarray,
+            is_unique: np.ndarray,
+            check_for_exact_matches: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        return Alignment_Kernel.sparse_alignment_ratios(
+            Alignment_Kernel.sparse_alignment_sums(
+                groups,
+                num_combinations,
+                ref_mfvs,
+                target_mfvs,
+                is_unique,
+                check_for_exact_matches,
+                Alignment_Kernel.last_ref_values(groups, num_combinations),
+            )
+        )
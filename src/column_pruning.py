@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import logging
+from typing import List, Set
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    Numeric,
+    SmallInteger,
+    String,
+    Table,
+    text,
+)
+from sqlalchemy.engine import Engine
+
+from faldisco_context import Faldisco_Context
+
+logger = logging.getLogger(__name__)
+
+# column types whose values can be profiled and compared - subclasses included, so String also covers VARCHAR,
+# CHAR and TEXT; blobs, JSON and other types are left out
+SUPPORTED_TYPES: Set[type] = {
+    String,
+    BigInteger,
+    Float,
+    Integer,
+    SmallInteger,
+    Numeric,
+    Date,
+    DateTime,
+}
+
+IGNORED_NAMES: Set[str] = {"ds", "shard"}
+
+# catalog statistics of a column: (fraction of NULLs, number of distinct values, fraction of the most frequent
+# value), None where the catalog does not have it
+NO_COLUMN_STATS = (None, None, None)
+
+
+# drops columns before the sample query is built: columns of unsupported types or ignored names, and columns
+# that the catalog statistics show to be all NULL or constant - they could only be classified as constant
+# after being fetched. Statistics are estimates, so only columns that are clearly constant - more than
+# FALDISCO_CATALOG_CONSTANT_THRESHOLD of their rows - are dropped
+class Column_Pruning:
+    def __init__(self):
+        return
+
+    @staticmethod
+    def is_supported(col: Column) -> bool:
+        return (
+                isinstance(col.type, tuple(SUPPORTED_TYPES))
+                and col.name not in IGNORED_NAMES
+                and "json" not in col.name
+        )
+
+    @staticmethod
+    def get_postgresql_stats(engine: Engine, schema_name: str, table_name: str) -> {str: (float, float, float)}:
+        query = text(
+            "select attname, null_frac, n_distinct, most_common_freqs from pg_stats"
+            + " where schemaname = :schema_name and tablename = :table_name"
+        )
+        stats = {}
+        with engine.connect() as connection:
+            for name, null_frac, n_distinct, most_common_freqs in connection.execute(
+                    query, {"schema_name": schema_name, "table_name": table_name}
+            ):
+                # negative n_distinct is a fraction of the rows - the column is not constant
+                distinct = n_distinct if n_distinct is not None and n_distinct >= 0 else None
+                mfv_fraction = max(most_common_freqs) if most_common_freqs else None
+                stats[name] = (null_frac, distinct, mfv_fraction)
+        return stats
+
+    @staticmethod
+    def get_mysql_stats(engine: Engine, schema_name: str, table_name: str) -> {str: (float, float, float)}:
+        params = {"schema_name": schema_name, "table_name": table_name}
+        stats = {}
+        with engine.connect() as connection:
+            # index cardinality - number of distinct values of the first column of every index
+            for name, cardinality in connection.execute(
+                    text(
+                        "select column_name, max(cardinality) from information_schema.statistics"
+                        + " where table_schema = :schema_name and table_name = :table_name and seq_in_index = 1"
+                        + " group by column_name"
+                    ),
+                    params,
+            ):
+                stats[name] = (None, cardinality, None)
+            # histograms (MySQL 8) have the fraction of NULLs and the frequencies of the values
+            for name, histogram in connection.execute(
+                    text(
+                        "select column_name, histogram from information_schema.column_statistics"
+                        + " where schema_name = :schema_name and table_name = :table_name"
+                    ),
+                    params,
+            ):
+                stats[name] = Column_Pruning.parse_mysql_histogram(
+                    json.loads(histogram) if isinstance(histogram, str) else histogram
+                )
+        return stats
+
+    @staticmethod
+    def parse_mysql_histogram(histogram: {}) -> (float, float, float):
+        null_fraction = histogram.get("null-values")
+        buckets = histogram.get("buckets", [])
+        if histogram.get("histogram-type") == "singleton":
+            # [value, cumulative frequency] per distinct value
+            cumulative = [b[1] for b in buckets]
+            frequencies = [c - p for c, p in zip(cumulative, [0.0] + cumulative[:-1])]
+            return null_fraction, len(buckets), max(frequencies) if frequencies else None
+        # equi-height: [lower, upper, cumulative frequency, number of distinct values] per bucket
+        return null_fraction, sum(b[3] for b in buckets) if buckets else None, None
+
+    @staticmethod
+    def get_column_stats(engine: Engine, schema_name: str, table_name: str) -> {str: (float, float, float)}:
+        # statistics are best effort - a dialect without them, or a catalog we can not read, prunes nothing
+        try:
+            if engine.dialect.name == "postgresql":
+                return Column_Pruning.get_postgresql_stats(engine, schema_name, table_name)
+            if engine.dialect.name == "mysql":
+                return Column_Pruning.get_mysql_stats(engine, schema_name, table_name)
+        except Exception as e:
+            logger.info(f"FALDISCO__DEBUG: no catalog statistics for {schema_name}.{table_name}: {e}")
+        return {}
+
+    @staticmethod
+    def is_constant(stats: (float, float, float), context: Faldisco_Context) -> bool:
+        null_fraction, distinct, mfv_fraction = stats
+        if null_fraction is not None and null_fraction > context.FALDISCO_CATALOG_CONSTANT_THRESHOLD:
+            # all or almost all NULL
+            return True
+        if mfv_fraction is not None and mfv_fraction > context.FALDISCO_CATALOG_CONSTANT_THRESHOLD:
+            return True
+        # one distinct value and no NULLs - 0 distinct values is an empty or not yet analyzed table
+        return distinct == 1 and null_fraction == 0
+
+    @staticmethod
+    def prune_columns(
+            engine: Engine,
+            schema_name: str,
+            table: Table,
+            keep_names: List[str] = (),
+            context: Faldisco_Context = None,
+    ) -> List[str]:
+        # names of the columns worth fetching; keep_names (the join keys) are never dropped
+        context = context if context is not None else Faldisco_Context()
+        stats = (
+            Column_Pruning.get_column_stats(engine, schema_name, table.name)
+            if context.FALDISCO_CATALOG_PRUNING
+            else {}
+        )
+        names = []
+        unsupported = []
+        constant = []
+        for col in table.c:
+            if col.name in keep_names:
+                names.append(col.name)
+            elif not Column_Pruning.is_supported(col):
+                unsupported.append(col.name)
+            else:
+                null_fraction, distinct, mfv_fraction = stats.get(col.name, NO_COLUMN_STATS)
+                if null_fraction is None and not col.nullable:
+                    null_fraction = 0.0
+                if Column_Pruning.is_constant((null_fraction, distinct, mfv_fraction), context):
+                    constant.append(col.name)
+                else:
+                    names.append(col.name)
+        logger.info(
+            f"FALDISCO__DEBUG: {schema_name}.{table.name}: fetching {len(names)} of {len(table.c)} columns; "
+            + f"unsupported or ignored: {unsupported}; constant or NULL by catalog statistics: {constant}"
+        )
+        return names
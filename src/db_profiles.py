@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import faldisco_globals as fg
+from field_profiles import Field_Profiles, Field_Profiles_Store, VALUE_KIND_TEXT
+
+logger = logging.getLogger(__name__)
+
+# what FALDISCO_DB_PROFILES profiles in the database. The rows of the sample query are not profiled in the
+# database: the query is an unordered join, so the database would run it once per profiling query and need not
+# profile the rows that are fetched
+DB_PROFILES_TABLE = "table"  # the whole tables
+
+# approximate distinct count of the dialects that have one - the others count distinct values exactly
+APPROX_DISTINCT_FUNCTIONS = {
+    "presto": "approx_distinct",
+    "trino": "approx_distinct",
+    "bigquery": "approx_count_distinct",
+    "snowflake": "approx_count_distinct",
+    "databricks": "approx_count_distinct",
+}
+# number of characters of a text - length is the number of bytes in MySQL
+LENGTH_FUNCTIONS = {"mysql": "char_length", "mssql": "len"}
+TEXT_TYPES = {"mysql": "char"}
+
+
+# field profiles computed by the database: one aggregate query per table for the row, NULL, empty and distinct
+# counts, the min/max values and the min/max lengths, and one top-1 frequency query per field for the most
+# frequent value. Only the aggregates come back, so profiles can cover whole tables and not only the sample.
+# NULLs and empty strings count as one value each, as in Field_Profiles_Store.profile_values; lengths are
+# those of the database's text of a value, which can differ from the value texts of fetched numbers. Min/max
+# values are in the order of the database's collation, so profiles are marked as database profiles and their
+# lengths and value ranges do not prune exact match candidates
+class Db_Profiles:
+    def __init__(self):
+        return
+
+    @staticmethod
+    def as_text(dialect_name: str, column: str) -> str:
+        return f"cast({column} as {TEXT_TYPES.get(dialect_name, 'varchar')})"
+
+    @staticmethod
+    def gen_distinct(dialect_name: str, column: str, approx_distinct: bool = True) -> str:
+        if approx_distinct and dialect_name in APPROX_DISTINCT_FUNCTIONS:
+            return f"{APPROX_DISTINCT_FUNCTIONS[dialect_name]}({column})"
+        return f"count(distinct {column})"
+
+    # source is a table name or a parenthesized query with an alias; columns are the source's columns
+    @staticmethod
+    def gen_aggregate_sql(
+            dialect_name: str, source: str, columns: [str], approx_distinct: bool = True
+    ) -> str:
+        length = LENGTH_FUNCTIONS.get(dialect_name, "length")
+        sql_statement = "select count(*) as num_rows"
+        for i, c in enumerate(columns):
+            c_text = Db_Profiles.as_text(dialect_name, c)
+            # NULLs, empty strings and FALDISCO fill ins do not count towards min/max values and lengths
+            c_valid = (
+                    f"{c_text} <> '' and substr({c_text}, 1, {fg.FALDISCO_SPECIAL_VALUE_PREFIX_LEN})"
+                    + f" <> '{fg.FALDISCO_SPECIAL_VALUE_PREFIX}'"
+            )
+            c_value = f"case when {c_valid} then {c} end"
+            c_value_text = f"case when {c_valid} then {c_text} end"
+            sql_statement = (
+                    sql_statement
+                    + f", count({c}) as n{i}"
+                    + f", {Db_Profiles.gen_distinct(dialect_name, c, approx_distinct)} as d{i}"
+                    + f", sum(case when {c_text} = '' then 1 else 0 end) as e{i}"
+                    + f", min({c_value}) as lo{i}, max({c_value}) as hi{i}"
+                    + f", min({length}({c_value_text})) as ll{i}, max({length}({c_value_text})) as hl{i}"
+            )
+        return sql_statement + f" from {source}"
+
+    # the most frequent value that is not NULL or empty - ties go to the smallest value
+    @staticmethod
+    def gen_top_value_sql(dialect_name: str, source: str, column: str) -> str:
+        return (
+                f"select {column} as v, count(*) as n from {source}"
+                + f" where {Db_Profiles.as_text(dialect_name, column)} <> ''"
+                + f" group by {column} order by count(*) desc, {column} LIMIT 1"
+        )
+
+    @staticmethod
+    def make_profile(
+            num_rows: int,
+            non_null: int,
+            distinct: int,
+            empty: int,
+            top: (object, int),
+            min_val: object,
+            max_val: object,
+            min_len: int,
+            max_len: int,
+    ) -> Field_Profiles:
+        num_nulls = num_rows - non_null
+        # the empty string is one of the distinct values the database counts
+        cardinality = distinct + (1 if num_nulls > 0 else 0)
+        mfv, mfv_count = top
+        for special, count in ((fg.FALDISCO_NULL, num_nulls), (fg.FALDISCO_EMPTY, empty)):
+            if count > mfv_count:
+                mfv, mfv_count = special, count
+        return Field_Profiles(
+            num_rows,
+            cardinality,
+            cardinality / num_rows if num_rows > 0 else 0.0,
+            mfv_count,
+            min_len if min_len is not None else -1,
+            max_len if max_len is not None else -1,
+            min_val,
+            max_val,
+            mfv,
+            VALUE_KIND_TEXT,
+            True,
+        )
+
+    @staticmethod
+    def check_mode(mode: str):
+        if mode != DB_PROFILES_TABLE:
+            raise ValueError(f"unknown FALDISCO_DB_PROFILES {mode}, only {DB_PROFILES_TABLE} is profiled in the database")
+
+    @staticmethod
+    def profile_fields(
+            engine: Engine, source: str, columns: {str: str}, approx_distinct: bool = True
+    ) -> {str: Field_Profiles}:
+        # profiles of fields (field name -> column of the source); value kinds are set from the fetched rows
+        # by set_value_kind. approx_distinct uses the dialect's approximate distinct count where it has one
+        dialect_name = engine.dialect.name
+        names = list(columns.keys())
+        profiles = {}
+        with engine.connect() as connection:
+            row = connection.execute(
+                text(
+                    Db_Profiles.gen_aggregate_sql(
+                        dialect_name, source, [columns[f] for f in names], approx_distinct
+                    )
+                )
+            ).one()
+            num_rows = int(row[0])
+            for i, f in enumerate(names):
+                non_null, distinct, empty, min_val, max_val, min_len, max_len = row[1 + 7 * i: 8 + 7 * i]
+                top = (None, 0)
+                if non_null:
+                    top_row = connection.execute(
+                        text(Db_Profiles.gen_top_value_sql(dialect_name, source, columns[f]))
+                    ).first()
+                    if top_row is not None:
+                        top = (top_row[0], int(top_row[1]))
+                profiles[f] = Db_Profiles.make_profile(
+                    num_rows,
+                    int(non_null or 0),
+                    int(distinct or 0),
+                    int(empty or 0),
+                    top,
+                    min_val,
+                    max_val,
+                    min_len,
+                    max_len,
+                )
+        logger.info(f"FALDISCO__DEBUG: profiled {len(names)} fields of {num_rows} rows in the database")
+        return profiles
+
+    @staticmethod
+    def set_value_kind(fp: Field_Profiles, value_kind: str) -> Field_Profiles:
+        # values of a field compared as text are profiled by their value texts
+        fp.set_field_value_kind(value_kind)
+        if value_kind == VALUE_KIND_TEXT:
+            for value, setter in (
+                    (fp.get_field_min_val(), fp.set_field_min_val),
+                    (fp.get_field_max_val(), fp.set_field_max_val),
+                    (fp.get_field_mfv(), fp.set_mfv),
+            ):
+                if value is not None:
+                    setter(Field_Profiles_Store.value_text(value))
+        return fp
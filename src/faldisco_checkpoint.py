@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+import os
+import pickle
+import shutil
+
+import faldisco_globals as fg
+
+logger = logging.getLogger(__name__)
+
+# stages of a run, in order - a checkpoint holds the state after the last completed stage
+CHECKPOINT_STAGE_NONE = 0
+CHECKPOINT_STAGE_SAMPLE = 1  # sample fetched
+CHECKPOINT_STAGE_COMBINATIONS = 2  # profiles and combinations created
+CHECKPOINT_STAGE_ALIGNMENTS = 3  # value matches of alignment combinations counted
+CHECKPOINT_STAGE_SPARSE_ALIGNMENTS = 4  # value matches of sparse alignment combinations counted
+CHECKPOINT_STAGE_EXACT_MATCHES = 5  # exact matches counted
+CHECKPOINT_STAGE_TRANSFORMS = 6  # transform matches found
+
+CHECKPOINT_FILE_NAME = "state.pickle"
+CHECKPOINT_DELTA_FILE_NAME = "delta_{}.pickle"
+
+
+# stage level checkpoints of one run, in a folder named by the run id. The state is pickled - numpy arrays and
+# data frames are stored as raw binary buffers - and replaced atomically, so a crash while saving keeps the
+# previous checkpoint. Within a stage, only what was added since the previous save is pickled, as a delta on top
+# of the state of the stage; the next stage level save drops the deltas. Spilled value matches of a checkpointed
+# run are kept in the same folder
+class Faldisco_Checkpoint:
+    run_id: str
+    folder: str
+
+    def __init__(self, run_id: str, root_folder: str = fg.FALDISCO_CHECKPOINT_FOLDER):
+        self.run_id = run_id
+        self.folder = os.path.join(root_folder, run_id)
+
+    def get_folder(self) -> str:
+        os.makedirs(self.folder, exist_ok=True)
+        return self.folder
+
+    def get_path(self) -> str:
+        return os.path.join(self.folder, CHECKPOINT_FILE_NAME)
+
+    def get_delta_path(self, delta: int) -> str:
+        return os.path.join(self.folder, CHECKPOINT_DELTA_FILE_NAME.format(delta))
+
+    def get_num_deltas(self) -> int:
+        num_deltas = 0
+        while os.path.exists(self.get_delta_path(num_deltas)):
+            num_deltas += 1
+        return num_deltas
+
+    @staticmethod
+    def dump(path: str, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def save(self, stage: int, state: {}):
+        self.get_folder()
+        Faldisco_Checkpoint.dump(self.get_path(), (stage, state))
+        # deltas of the previous stage are left out by load even if a crash keeps them
+        for delta in range(self.get_num_deltas() - 1, -1, -1):
+            os.remove(self.get_delta_path(delta))
+        logger.info(f"FALDISCO__DEBUG: run {self.run_id}: checkpoint of stage {stage} saved")
+
+    def save_delta(self, stage: int, delta: {}):
+        # what was added to the state of stage since the previous save
+        self.get_folder()
+        num_deltas = self.get_num_deltas()
+        Faldisco_Checkpoint.dump(self.get_delta_path(num_deltas), (stage, delta))
+        logger.info(f"FALDISCO__DEBUG: run {self.run_id}: delta {num_deltas} of stage {stage} saved")
+
+    def load(self) -> (int, {}, [{}]):
+        # the last completed stage, the state after it and the deltas saved since, in order
+        if not os.path.exists(self.get_path()):
+            return CHECKPOINT_STAGE_NONE, None, []
+        with open(self.get_path(), "rb") as f:
+            stage, state = pickle.load(f)
+        deltas = []
+        for delta in range(self.get_num_deltas()):
+            with open(self.get_delta_path(delta), "rb") as f:
+                delta_stage, delta_state = pickle.load(f)
+            if delta_stage == stage:
+                deltas.append(delta_state)
+        logger.info(f"FALDISCO__DEBUG: run {self.run_id}: resuming after stage {stage} and {len(deltas)} deltas")
+        return stage, state, deltas
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
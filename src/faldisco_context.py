@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import copy
+
+import faldisco_globals as fg
+
+# settings of faldisco_globals that a run reads - the others are constants, or settings of the process like
+# workers, the service and the sketch size that runs have to share
+RUN_SETTINGS = (
+    "SAMPLE_SIZE",
+    "FALDISCO_ARROW_SAMPLES",
+    "FALDISCO_ARROW_DICTIONARY_SELECTIVITY",
+    "FALDISCO_DB_CONCURRENCY",
+    "FALDISCO_PREFETCH",
+    "KEY_MIN_VALUE_COUNT",
+    "KEY_MAX_VALUE_COUNT",
+    "FALDISCO_CATALOG_PRUNING",
+    "FALDISCO_CATALOG_CONSTANT_THRESHOLD",
+    "FALDISCO_SLICE_COLUMNS",
+    "FALDISCO_DB_PROFILES",
+    "FALDISCO_DB_APPROX_DISTINCT",
+    "CONSTANT_VALUE_THRESHOLD",
+    "SPARSE_VALUE_THRESHOLD",
+    "UNIQUE_SELECTIVIY_THRESHOLD",
+    "FIELD_EXACT_MATCH_THRESHOLD",
+    "FIELD_ROW_ALIGNMENT_THRESHOLD",
+    "FIELD_VALUE_ALIGNMENT_THRESHOLD",
+    "FIELD_SPARSE_NON_MFV_ALIGNMENT_THRESHOLD",
+    "ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD",
+    "FALDISCO_SKETCH_PRUNING",
+    "FIELD_SKETCH_OVERLAP_SLACK",
+    "VALUE_MATCHES_HEAVY_HITTERS",
+    "VALUE_MATCHES_CHUNK_ROWS",
+    "VALUE_MATCHES_MEMORY_LIMIT",
+    "VALUE_MATCHES_SPILL_PARTITIONS",
+    "VALUE_MATCHES_SPILL_FOLDER",
+    "FALDISCO_TRANSFORMS",
+    "FIELD_TRANSFORM_HASHES",
+    "FIELD_TRANSFORM_AFFIX_LENGTHS",
+    "FIELD_TRANSFORM_SCALES",
+    "FALDISCO_CHECKPOINT_COMBINATIONS",
+    "FALDISCO_RESULTS_TOP_K",
+    "FALDISCO_RESULTS_TOP_K_PER_TYPE",
+    "FALDISCO_VALUE_ALIGNMENTS_COMPRESSION",
+    "FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION",
+    "TRACE_FIELDS_ANY",
+    "TRACE_FIELDS_ALL",
+    "TRACE_RECORDS_FOR_FIELDS_ANY",
+    "TRACE_RECORDS_FOR_FIELDS_ALL",
+)
+
+
+# settings of one run: a copy of the RUN_SETTINGS of faldisco_globals taken when the run is created, with the
+# given overrides. A run and everything it creates - results, value matches, profiles, writers - read their
+# settings from the run's context, so runs with different settings can share a process and changing
+# faldisco_globals does not change runs that already started
+class Faldisco_Context:
+    def __init__(self, **settings):
+        for name in RUN_SETTINGS:
+            setattr(self, name, copy.copy(getattr(fg, name)))
+        for name, value in settings.items():
+            if name not in RUN_SETTINGS:
+                raise ValueError(f"unknown run setting: {name}")
+            setattr(self, name, value)
+
+    def get_settings(self) -> {str: object}:
+        return {name: getattr(self, name) for name in RUN_SETTINGS}
+
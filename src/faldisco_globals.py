@@ -12,6 +12,33 @@ SAMPLE_SIZE = 2000
 KEY_MIN_VALUE_COUNT = 1
 KEY_MAX_VALUE_COUNT = 1
 
+# drop columns that catalog statistics show to be constant or all NULL before the sample query: more than this
+# fraction of their rows is NULL or one value. Statistics are estimates, so this is stricter than
+# CONSTANT_VALUE_THRESHOLD
+FALDISCO_CATALOG_PRUNING = True
+FALDISCO_CATALOG_CONSTANT_THRESHOLD = 0.999
+
+# partition columns of partitioned tables, e.g. ["ds"]: a table with them is read from its latest partition only,
+# unless the run names a partition (see Partition_Pruning)
+FALDISCO_PARTITION_COLUMNS = []
+# number of latest partitions a run over many partitions (faldisco.py --partitions) reads when it names no number
+FALDISCO_STABILITY_PARTITIONS = 14
+
+# fetch samples of tables with more columns than this in vertical slices of at most this many columns, one query
+# per slice over the same key sample; 0 fetches every column in one query. Slicing bounds the width of each query,
+# not the memory of the sample: the slices are assembled into one sample with every column, as counting needs them
+FALDISCO_SLICE_COLUMNS = 0
+
+# fetch samples into Arrow arrays when pyarrow is installed, instead of numpy backed columns; text columns with at
+# most this many distinct values per row are dictionary encoded
+FALDISCO_ARROW_SAMPLES = True
+FALDISCO_ARROW_DICTIONARY_SELECTIVITY = 0.5
+
+# compute field profiles with aggregate queries in the database: None profiles the fetched rows and "table" the
+# whole tables (see Db_Profiles)
+FALDISCO_DB_PROFILES = None
+FALDISCO_DB_APPROX_DISTINCT = True  # use the dialect's approximate distinct count where it has one
+
 # 1-selectivity threshold for constant fields
 CONSTANT_VALUE_THRESHOLD = 0.99
 SPARSE_VALUE_THRESHOLD = 0.95
@@ -29,6 +56,54 @@ FIELD_VALUE_ALIGNMENT_THRESHOLD = (
     0.6  # what percentage of values should align for us to keep processing
 )
 
+# value sketches used to drop exact match candidates before any row level work
+FALDISCO_SKETCH_PRUNING = True
+FIELD_SKETCH_SIZE = 128  # number of minhash values per field
+# the estimated exact match strength is an upper bound with sketch error - only drop candidates estimated below
+# FIELD_EXACT_MATCH_THRESHOLD - FIELD_SKETCH_OVERLAP_SLACK
+FIELD_SKETCH_OVERLAP_SLACK = 0.15
+
+# approximate value match counting: keep at most this many target value counters per ref value (see
+# Value_Matches for error bounds and memory use); 0 keeps exact counts
+VALUE_MATCHES_HEAVY_HITTERS = 0
+# rows counted at once per combination - bounds the memory of exact counting of a chunk
+VALUE_MATCHES_CHUNK_ROWS = 100000
+# spill exact value match counts to disk once they take more than this many bytes of memory; 0 never spills
+VALUE_MATCHES_MEMORY_LIMIT = 0
+VALUE_MATCHES_SPILL_PARTITIONS = 16  # number of ref value hash partitions of spilled counts
+VALUE_MATCHES_SPILL_FOLDER = None  # None uses the system temp folder
+
+# look for target = f(ref) matches for the deterministic functions in Value_Transforms
+FALDISCO_TRANSFORMS = True
+FIELD_TRANSFORM_HASHES = ["md5", "sha1", "sha256"]
+FIELD_TRANSFORM_AFFIX_LENGTHS = [2, 3, 4, 5, 6, 8, 10]  # prefix and suffix lengths
+FIELD_TRANSFORM_SCALES = [10, 100, 1000]  # numbers are multiplied and divided by these
+
+# worker processes evaluating batches of tables; 1 runs them in process
+FALDISCO_WORKERS = 4
+# batches fetch samples while earlier ones are evaluated: at most this many queries run on one database at a
+# time, and at most this many fetched samples wait for a worker
+FALDISCO_DB_CONCURRENCY = 2
+FALDISCO_PREFETCH = 2
+
+# stage level checkpoints of every command line run - they hold the fetched sample. Off, only runs with
+# --checkpoint, --run-id or --resume save checkpoints
+FALDISCO_CHECKPOINTS = False
+FALDISCO_CHECKPOINT_FOLDER = "../checkpoints/"
+# value match counting also saves a checkpoint after every this many combinations
+FALDISCO_CHECKPOINT_COMBINATIONS = 500
+
+# number of functions and allocating source lines per stage in the report of faldisco.py --profile
+FALDISCO_PROFILE_TOP_N = 25
+
+# discovery service (faldisco.py --serve)
+FALDISCO_SERVICE_PORT = 8765
+FALDISCO_SERVICE_JOBS = 2  # jobs running at the same time
+FALDISCO_SERVICE_MEMORY_LIMIT = 0  # bytes of estimated memory of running jobs; 0 is unlimited
+FALDISCO_SERVICE_BYTES_PER_VALUE = 100  # estimated memory per sampled value
+FALDISCO_SERVICE_COST_HALF_LIFE = 600  # seconds of waiting that halve the scheduling cost of a job
+FALDISCO_SERVICE_SAMPLE_TTL = 3600  # seconds a cached sample is reused
+
 FIELD_SPARSE_NON_MFV_ALIGNMENT_THRESHOLD = 0.9  # what percentage of non most frequent values are in the same rows in
 # ref and target
 
@@ -42,6 +117,13 @@ FIELD_ALIGNMENT_TABLE_FIELDS = [
     "alignment_type",
     "alignment_strength",
 ]
+# columns the field alignments of a run over many partitions add: the smallest and largest strength of the alignment
+# in a single partition - 0 in partitions that did not find it - and the number of partitions that found it
+FIELD_ALIGNMENT_STABILITY_FIELDS = [
+    "min_partition_strength",
+    "max_partition_strength",
+    "num_aligned_partitions",
+]
 FIELD_VALUE_ALIGNMENT_TABLE_FIELDS = [
     "reference_table_namespace",
     "reference_table_name",
@@ -73,8 +155,19 @@ ALIGNMENT_TYPE_ALIGNMENT = "alignment"
 ALIGNMENT_TYPE_SPARSE_EXACT_MATCH = "sparse exact match"
 ALIGNMENT_TYPE_SPARSE_ALIGNMENT = "sparse alignment"
 ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT = "sparse non-mvf alignment"
+ALIGNMENT_TYPE_TRANSFORM_MATCH = "transform match"
 
 ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD = 0.0
+# at most this many results per target field and alignment type; 0 keeps every ref field tied for the top
+FALDISCO_RESULTS_TOP_K = 0
+# limits of single alignment types that replace FALDISCO_RESULTS_TOP_K, e.g. {ALIGNMENT_TYPE_ALIGNMENT: 3}; the
+# limit of ALIGNMENT_TYPE_TRANSFORM_MATCH applies to every transform
+FALDISCO_RESULTS_TOP_K_PER_TYPE = {}
+# value alignments are streamed to the output file: None writes plain csv, or "gzip", "bz2" or "xz"
+FALDISCO_VALUE_ALIGNMENTS_COMPRESSION = None
+# at most this many value alignments per combination, those with the largest alignment counts, plus one
+# FALDISCO_OTHER row with the counts of the rest; 0 writes every value
+FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION = 0
 
 FIELD_PROFILES_TABLE_FIELDS = [
     "table_namespace",
@@ -107,6 +200,7 @@ FALDISCO_NAN = FALDISCO_SPECIAL_VALUE_PREFIX + "NAN"
 FALDISCO_NULL = FALDISCO_SPECIAL_VALUE_PREFIX + "NULL"
 FALDISCO_EMPTY = FALDISCO_SPECIAL_VALUE_PREFIX + "EMPTY"
 FALDISCO_OUTPUT_FOLDER = "../out/"
+FALDISCO_OTHER = FALDISCO_SPECIAL_VALUE_PREFIX + "OTHER"  # value of the row with the counts of capped values
 
 
 
@@ -115,6 +209,14 @@ def is_special_value(val: str) -> bool:
     return val[0:FALDISCO_SPECIAL_VALUE_PREFIX_LEN] == FALDISCO_SPECIAL_VALUE_PREFIX
 
 
+def make_transform_alignment_type(transform_name: str) -> str:
+    return f"{ALIGNMENT_TYPE_TRANSFORM_MATCH}: {transform_name}"
+
+
+def is_transform_alignment_type(alignment_type: str) -> bool:
+    return alignment_type.startswith(ALIGNMENT_TYPE_TRANSFORM_MATCH)
+
+
 def make_orig_field_name(f: str) -> str:
     # strip prefix - either r__ or t__
     return f[3:]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+
+# runs a batch of alignment jobs so that database I/O overlaps with computation: samples are fetched by threads
+# ahead of the job being computed, at most db_concurrency queries per database at a time and at most prefetch
+# fetched samples waiting for computation, and outputs are written by threads off the computation path.
+# A job is a (name, db url, query, payload) tuple, with the context of the run whose sample the query reads as an
+# optional fifth element; compute(payload, sample df) runs in the executor - a thread
+# when None - and returns (number of alignments, outputs for write). One orchestrator can be shared by batches
+# running at the same time - the database limits hold across all of them
+class Faldisco_Orchestrator:
+    db_concurrency: int
+    prefetch: int
+    engines: {str: Engine}
+    db_semaphores: {str: threading.Semaphore}
+    lock: threading.Lock
+
+    def __init__(
+            self,
+            db_concurrency: int = fg.FALDISCO_DB_CONCURRENCY,
+            prefetch: int = fg.FALDISCO_PREFETCH,
+    ):
+        self.db_concurrency = max(db_concurrency, 1)
+        self.prefetch = max(prefetch, 0)
+        self.engines = {}
+        self.db_semaphores = {}
+        self.lock = threading.Lock()
+
+    def get_engine(self, db_url: str) -> Engine:
+        # engines are thread safe - one per database is shared by all fetching threads
+        with self.lock:
+            if db_url not in self.engines:
+                self.engines[db_url] = create_engine(db_url)
+            return self.engines[db_url]
+
+    def get_db_semaphore(self, db_url: str) -> threading.Semaphore:
+        # thread semaphores, so that the limit holds across the event loops of concurrent batches
+        with self.lock:
+            if db_url not in self.db_semaphores:
+                self.db_semaphores[db_url] = threading.Semaphore(self.db_concurrency)
+            return self.db_semaphores[db_url]
+
+    @staticmethod
+    def read_sample(engine: Engine, query: str, context: Faldisco_Context = None) -> pd.DataFrame:
+        # with pyarrow, samples are columnar Arrow arrays - a few bytes per value instead of a python object per
+        # cell - and low cardinality text columns are dictionary encoded. Otherwise nullable dtypes keep integer
+        # columns with NULLs as int64 values plus a NULL mask
+        context = context if context is not None else Faldisco_Context()
+        use_arrow = context.FALDISCO_ARROW_SAMPLES and pa is not None
+        with engine.connect() as connection:
+            df = pd.read_sql(
+                sql=query, con=connection, dtype_backend="pyarrow" if use_arrow else "numpy_nullable"
+            )
+        if use_arrow:
+            df = Faldisco_Orchestrator.dictionary_encode(df, context.FALDISCO_ARROW_DICTIONARY_SELECTIVITY)
+        return df
+
+    @staticmethod
+    def dictionary_encode(df: pd.DataFrame, selectivity: float) -> pd.DataFrame:
+        # text columns with few distinct values keep one copy of every value plus int32 indices
+        num_rows = len(df)
+        for c in df.columns:
+            dtype = df[c].dtype
+            if not (
+                    isinstance(dtype, pd.ArrowDtype)
+                    and (pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype))
+            ):
+                continue
+            values = pa.array(df[c])
+            encoded = values.dictionary_encode()
+            if len(encoded.dictionary) <= num_rows * selectivity:
+                df[c] = pd.Series(encoded, index=df.index, dtype=pd.ArrowDtype(encoded.type))
+        return df
+
+    def read_limited(self, db_url: str, query: str, context: Faldisco_Context = None) -> pd.DataFrame:
+        with self.get_db_semaphore(db_url):
+            return Faldisco_Orchestrator.read_sample(self.get_engine(db_url), query, context)
+
+    async def fetch(self, db_url: str, query: str, context: Faldisco_Context = None) -> pd.DataFrame:
+        # the fetching thread waits for its turn on the database
+        return await asyncio.to_thread(self.read_limited, db_url, query, context)
+
+    async def run_jobs(
+            self,
+            jobs: [(str, str, str, object)],
+            compute,
+            write,
+            executor: Executor = None,
+            compute_slots: int = 1,
+    ) -> {str: int}:
+        loop = asyncio.get_running_loop()
+        # samples that are fetched or being fetched, and not computed yet
+        pending = asyncio.Semaphore(compute_slots + self.prefetch)
+        computing = asyncio.Semaphore(compute_slots)
+        writes = []
+        num_alignments = {}
+
+        async def run_job(
+                name: str, db_url: str, query: str, payload: object, context: Faldisco_Context = None
+        ):
+            async with pending:
+                df = await self.fetch(db_url, query, context)
+                logger.info(f"FALDISCO__DEBUG: {name}: fetched {len(df)} rows")
+                async with computing:
+                    num_alignments[name], outputs = await loop.run_in_executor(
+                        executor, compute, payload, df
+                    )
+            logger.info(f"FALDISCO__DEBUG: {name}: Number of alignments={num_alignments[name]}")
+            writes.append(asyncio.create_task(asyncio.to_thread(write, outputs)))
+
+        async def run_job_safely(job: (str, str, str, object)):
+            # one failing job does not stop the others
+            try:
+                await run_job(*job)
+            except Exception:
+                logger.exception(f"FALDISCO__DEBUG: alignment of {job[0]} failed")
+
+        # jobs wait for the semaphores in submission order, so samples are fetched in job order
+        await asyncio.gather(*[run_job_safely(job) for job in jobs])
+        for result in await asyncio.gather(*writes, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"FALDISCO__DEBUG: writing outputs failed: {result}")
+        return {job[0]: num_alignments[job[0]] for job in jobs if job[0] in num_alignments}
+
+    def run(
+            self,
+            jobs: [(str, str, str, object)],
+            compute,
+            write,
+            executor: Executor = None,
+            compute_slots: int = 1,
+    ) -> {str: int}:
+        return asyncio.run(self.run_jobs(jobs, compute, write, executor, compute_slots))
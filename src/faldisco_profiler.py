@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import faldisco_globals as fg
+
+logger = logging.getLogger(__name__)
+
+# allocations of the profiling itself and of imports are left out of the allocation report
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+# CPU and memory profile of the stages of a run (faldisco.py --profile). Every stage runs under its own
+# deterministic profiler, whose statistics are written to a .prof file per stage (pstats, snakeviz), and under
+# tracemalloc, so the report lists the elapsed time, the peak traced memory, the hottest functions and the
+# source lines that allocated the most memory of every stage. Only the thread a stage runs in is profiled, and
+# stages do not nest. Memory allocated outside the Python allocator, like Arrow buffers, is not traced
+class Faldisco_Profiler:
+    path: str  # path prefix of the profile files
+    top_n: int
+    stages: [(str, float, int, pstats.Stats, [tracemalloc.StatisticDiff])]
+    started_tracemalloc: bool
+
+    def __init__(self, path: str, top_n: int = fg.FALDISCO_PROFILE_TOP_N):
+        self.path = path
+        self.top_n = top_n
+        self.stages = []
+        self.started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+
+    def stop(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str):
+        self.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            _current, peak = tracemalloc.get_traced_memory()
+            allocations = (
+                tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS).compare_to(before, "lineno")
+            )
+            profile.dump_stats(self.get_stage_path(name))
+            self.stages.append((name, elapsed, peak, pstats.Stats(profile), allocations[: self.top_n]))
+            logger.info(
+                f"FALDISCO__DEBUG: stage {name}: {elapsed:.3f}s, peak traced memory {peak / 2 ** 20:.1f} MiB"
+            )
+
+    def get_stage_path(self, name: str) -> str:
+        return f"{self.path}_{name.replace(' ', '_')}.prof"
+
+    def get_report(self) -> str:
+        report = io.StringIO()
+        for name, elapsed, peak, stats, allocations in self.stages:
+            report.write(
+                f"=== stage {name}: {elapsed:.3f}s, peak traced memory {peak / 2 ** 20:.1f} MiB, "
+                + f"profile {self.get_stage_path(name)}\n"
+            )
+            report.write(f"--- top {self.top_n} functions by cumulative time\n")
+            stats.stream = report
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+            report.write(f"--- top {self.top_n} allocations by size (growth during the stage)\n")
+            for allocation in allocations:
+                report.write(f"{allocation}\n")
+            report.write("\n")
+        return report.getvalue()
+
+    def write_report(self) -> str:
+        path = f"{self.path}_report.txt"
+        with open(path, "w") as f:
+            f.write(self.get_report())
+        logger.info(f"FALDISCO__DEBUG: profile report of {len(self.stages)} stages written to {path}")
+        return path
@@ -12,36 +12,44 @@ import logging
 from pandas import DataFrame
 
 import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
 from field_profiles import (
-    Field_Profiles,
+    Field_Profiles_Store,
 )
+from result_ranking import Result_Ranking
+from value_alignment_writer import Value_Alignment_Writer
 from value_matches import Value_Matches
 
 logger = logging.getLogger(__name__)
 
 
 class Faldisco_Results:
+    context: Faldisco_Context
     results_df: DataFrame
     potential_matches: {}
-    field_profiles: {Field_Profiles}
+    field_profiles: Field_Profiles_Store
     ref_table_namespace: str
     ref_table_name: str
     target_table_namespace: str
     target_table_name: str
     value_matches: Value_Matches
-    value_matches_df: DataFrame
-    value_matches_row_num: int
+    sparse_value_matches: Value_Matches
+    value_alignment_writer: Value_Alignment_Writer
+    result_rows: [[]]  # rows of results_df
 
     def __init__(
             self,
-            field_profiles: {Field_Profiles},
+            field_profiles: Field_Profiles_Store,
             ref_table_namespace: str,
             ref_table_name: str,
             target_table_namespace: str,
             target_table_name: str,
             value_matches: Value_Matches,
-            value_matches_df: DataFrame,
+            sparse_value_matches: Value_Matches,
+            value_alignment_writer: Value_Alignment_Writer,
+            context: Faldisco_Context = None,
     ):
+        self.context = context if context is not None else Faldisco_Context()
         self.potential_matches = {}
         self.field_profiles = field_profiles
         self.results_df = DataFrame(columns=fg.FIELD_ALIGNMENT_TABLE_FIELDS)
@@ -50,30 +58,30 @@ class Faldisco_Results:
         self.ref_table_namespace = ref_table_namespace
         self.ref_table_name = ref_table_name
         self.value_matches = value_matches
-        self.value_matches_df = value_matches_df
-        self.value_matches_row_num = 0
+        self.sparse_value_matches = sparse_value_matches
+        self.value_alignment_writer = value_alignment_writer
+        self.result_rows = []
         return
 
     def dedup_results(self) -> DataFrame:
-        row_num = 0
         for t in self.potential_matches.keys():
-            fp = self.field_profiles[t]
-            if fp.is_sparse_field():
-                row_num = self.dedup_sparse_field(row_num, t)
+            if self.field_profiles.is_sparse_field(t):
+                self.dedup_sparse_field(t)
             else:
-                row_num = self.dedup_field(row_num, t)
+                self.dedup_field(t)
+        # one data frame of all the result rows, instead of growing it one row at a time
+        self.results_df = DataFrame(self.result_rows, columns=fg.FIELD_ALIGNMENT_TABLE_FIELDS)
         return self.results_df
 
-    def dedup_field(self, row_num: int, target_field_name: str):
+    def get_top_k(self, alignment_type: str) -> int:
+        return self.context.FALDISCO_RESULTS_TOP_K_PER_TYPE.get(alignment_type, self.context.FALDISCO_RESULTS_TOP_K)
+
+    def dedup_field(self, target_field_name: str):
         # matches are a list of alignment type and alignment strength
-        max_exact_match_strength = 0
-        max_alignment_strength = 0
-        min_selectivity = 1
-        max_strength_selectivity_ratio = 0
-        top_exact_matches = []
-        top_alignments = []
-        other_alignments = []
-        fp: Field_Profiles
+        exact_matches = Result_Ranking(self.get_top_k(fg.ALIGNMENT_TYPE_EXACT_MATCH))
+        # transform matches keep their alignment type, which names the transform
+        transform_matches = Result_Ranking(self.get_top_k(fg.ALIGNMENT_TYPE_TRANSFORM_MATCH))
+        alignment_candidates = []
         matches = self.get_matches(target_field_name)
         for r in matches.keys():
             al = self.get_alignments(target_field_name, r)
@@ -82,60 +90,87 @@ class Faldisco_Results:
                     target_field_name, r, alignment_type
                 )
                 if alignment_type == fg.ALIGNMENT_TYPE_EXACT_MATCH:
-                    if alignment_strength > max_exact_match_strength:
-                        max_exact_match_strength = alignment_strength
-                        top_exact_matches = [r]
-                    elif alignment_strength == max_exact_match_strength:
-                        top_exact_matches.append(r)
-                elif alignment_strength > max_exact_match_strength:
-                    # we have alignments stronger than max exact matches
-                    selectivity = self.get_selectivity(r)
-                    strength_selectivity_ratio = alignment_strength / selectivity
-                    if strength_selectivity_ratio >= max_strength_selectivity_ratio:
-                        # if we have better strength selectivity ratio, add the alignment to the list - it may also be
-                        # added to top_alignments, but we will filter that later. On the other hand, if we do not add
-                        # it now, it may be bumped from top_alignments and we will lose it
-                        max_strength_selectivity_ratio = strength_selectivity_ratio
-                        other_alignments.append(r)
-                    if alignment_strength > max_alignment_strength or (
-                            alignment_strength == max_alignment_strength
-                            and selectivity < min_selectivity
-                    ):
-                        # we have a new champion
-                        max_alignment_strength = alignment_strength
-                        top_alignments = [r]
-                        min_selectivity = selectivity
-                    elif (
-                            alignment_strength == max_alignment_strength
-                            and min_selectivity == selectivity
-                    ):
-                        top_alignments.append(r)
+                    exact_matches.add(r, alignment_strength)
+                elif fg.is_transform_alignment_type(alignment_type):
+                    transform_matches.add((r, alignment_type), alignment_strength)
+                else:
+                    alignment_candidates.append((r, alignment_strength))
+
+        # only alignments stronger than the exact matches are ranked - by strength and then by lower selectivity,
+        # and by their strength selectivity ratio for the other alignments. As before the rankings, the other
+        # alignments are the ones that raised the max strength selectivity ratio when they were added - with an
+        # ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD above 0, a later weaker ratio within the threshold is not one
+        max_exact_match_strength = exact_matches.get_max_score()
+        top_k = self.get_top_k(fg.ALIGNMENT_TYPE_ALIGNMENT)
+        alignments = Result_Ranking(top_k)
+        other_alignments = Result_Ranking(top_k)
+        max_strength_selectivity_ratio = 0
+        for r, alignment_strength in alignment_candidates:
+            if alignment_strength > max_exact_match_strength:
+                selectivity = self.get_selectivity(r)
+                alignments.add(r, alignment_strength, selectivity)
+                strength_selectivity_ratio = alignment_strength / selectivity
+                if strength_selectivity_ratio >= max_strength_selectivity_ratio:
+                    max_strength_selectivity_ratio = strength_selectivity_ratio
+                    other_alignments.add(r, strength_selectivity_ratio)
 
-        row_num = self.add_field_results(
-            row_num,
+        top_exact_matches = exact_matches.get_top()
+        self.add_matches_to_result(
             target_field_name,
-            max_exact_match_strength,
-            max_alignment_strength,
-            min_selectivity,
-            max_strength_selectivity_ratio,
             top_exact_matches,
-            top_alignments,
-            other_alignments,
+            fg.ALIGNMENT_TYPE_EXACT_MATCH,
+            max_exact_match_strength,
         )
-        return row_num
+        max_transform_match_strength = transform_matches.get_max_score()
+        if max_exact_match_strength < max_transform_match_strength:
+            # a function of a ref field matches more rows than any field as is
+            for r, alignment_type in transform_matches.get_top():
+                self.add_match_to_result(
+                    r,
+                    target_field_name,
+                    alignment_type,
+                    max_transform_match_strength,
+                )
+        max_alignment_strength = alignments.get_max_score()
+        if max_exact_match_strength < max_alignment_strength:
+            # let's add alignments
+            # first do the max strength ones with minimum selectivity
+            top_alignments = alignments.get_top(by_selectivity=True)
+            self.add_matches_to_result(
+                target_field_name,
+                top_alignments,
+                fg.ALIGNMENT_TYPE_ALIGNMENT,
+                max_alignment_strength,
+            )
+            # now it gets tricky, we want to find other alignments where ratio of alignment strength and selectivity vs.
+            # the match with highest alignment strength and minimum selectivity is > ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
+            # leaving out the ones that are either in exact_matches or alignments
+            threshold = (
+                    other_alignments.get_max_score() - self.context.ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
+            )
+            if top_k > 0 and len(top_alignments) >= top_k:
+                return
+            for r in other_alignments.get_at_least(
+                    threshold,
+                    set(top_alignments) | set(top_exact_matches),
+                    top_k - len(top_alignments) if top_k > 0 else 0,
+            ):
+                alignment_strength = self.get_alignment_strength(
+                    target_field_name, r, fg.ALIGNMENT_TYPE_ALIGNMENT
+                )
+                if alignment_strength > max_exact_match_strength:
+                    self.add_match_to_result(
+                        r,
+                        target_field_name,
+                        fg.ALIGNMENT_TYPE_ALIGNMENT,
+                        alignment_strength,
+                    )
 
-    def dedup_sparse_field(self, row_num: int, target_field_name: str):
+    def dedup_sparse_field(self, target_field_name: str):
         # matches are a list of alignment type and alignment strength
-        max_exact_match_strength = 0
-        max_alignment_strength = 0
-        max_sparse_non_mfv_alignment_strength = 0
-        min_selectivity = 1
-        max_strength_selectivity_ratio = 0
-        top_exact_matches = []
-        top_alignments = []
-        other_alignments = []
-        top_non_mfv_alignments = []
-        fp: Field_Profiles
+        exact_matches = Result_Ranking(self.get_top_k(fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH))
+        alignment_candidates = []
+        non_mfv_alignment_candidates = []
         matches = self.get_matches(target_field_name)
         for r in matches.keys():
             al = self.get_alignments(target_field_name, r)
@@ -144,63 +179,24 @@ class Faldisco_Results:
                     target_field_name, r, alignment_type
                 )
                 if alignment_type == fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH:
-                    if alignment_strength > max_exact_match_strength:
-                        max_exact_match_strength = alignment_strength
-                        top_exact_matches = [r]
-                    elif alignment_strength == max_exact_match_strength:
-                        top_exact_matches.append(r)
-                elif (
-                        alignment_type == fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT
-                        and alignment_strength > max_exact_match_strength
-                ):
-                    # we have alignments stronger than max exact matches
-                    if alignment_strength > max_alignment_strength:
-                        # we have a new champion
-                        max_alignment_strength = alignment_strength
-                        top_alignments = [r]
-                    elif alignment_strength > max_sparse_non_mfv_alignment_strength:
-                        top_alignments.append(r)
-                elif (
-                        alignment_type == fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT
-                        and alignment_strength > max_alignment_strength
-                ):
-                    # we have non-mfv alignments stronger than max alignment
-                    if alignment_strength > max_sparse_non_mfv_alignment_strength:
-                        # we have a new champion
-                        max_sparse_non_mfv_alignment_strength = alignment_strength
-                        top_non_mfv_alignments = [r]
-                    elif alignment_strength > max_sparse_non_mfv_alignment_strength:
-                        top_non_mfv_alignments.append(r)
-
-        row_num = self.add_sparse_field_results(
-            row_num,
-            target_field_name,
-            max_exact_match_strength,
-            max_alignment_strength,
-            min_selectivity,
-            max_strength_selectivity_ratio,
-            max_sparse_non_mfv_alignment_strength,
-            top_exact_matches,
-            top_alignments,
-            other_alignments,
-            top_non_mfv_alignments,
-        )
-        return row_num
-
-    def add_sparse_field_results(
-            self,
-            row_num: int,
-            target_field_name: str,
-            max_exact_match_strength: float,
-            max_alignment_strength: float,
-            min_selectivity: float,
-            max_strength_selectivity_ratio: float,
-            max_sparse_non_mfv_alignment_strength: float,
-            top_exact_matches: [str],
-            top_alignments: [str],
-            other_alignments: [str],
-            top_non_mfv_alignments: [str],
-    ) -> int:
+                    exact_matches.add(r, alignment_strength)
+                elif alignment_type == fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT:
+                    alignment_candidates.append((r, alignment_strength))
+                elif alignment_type == fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT:
+                    non_mfv_alignment_candidates.append((r, alignment_strength))
+
+        # we only need alignments stronger than max exact matches, and non-mfv alignments stronger than max alignment
+        max_exact_match_strength = exact_matches.get_max_score()
+        alignments = Result_Ranking(self.get_top_k(fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT))
+        for r, alignment_strength in alignment_candidates:
+            if alignment_strength > max_exact_match_strength:
+                alignments.add(r, alignment_strength)
+        max_alignment_strength = alignments.get_max_score()
+        non_mfv_alignments = Result_Ranking(self.get_top_k(fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT))
+        for r, alignment_strength in non_mfv_alignment_candidates:
+            if alignment_strength > max_alignment_strength:
+                non_mfv_alignments.add(r, alignment_strength)
+        max_sparse_non_mfv_alignment_strength = non_mfv_alignments.get_max_score()
 
         # first see if we should add non mfv alignment to the results
         if (
@@ -208,122 +204,35 @@ class Faldisco_Results:
                 and max_sparse_non_mfv_alignment_strength > max_alignment_strength
                 and max_sparse_non_mfv_alignment_strength > 0
         ):
-            row_num = self.add_matches_to_result(
-                row_num,
+            self.add_matches_to_result(
                 target_field_name,
-                top_non_mfv_alignments,
+                non_mfv_alignments.get_top(),
                 fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT,
                 max_sparse_non_mfv_alignment_strength,
             )
-        if max_exact_match_strength >= 0:
-            # add top exact matches to the results
-            row_num = self.add_matches_to_result(
-                row_num,
-                target_field_name,
-                top_exact_matches,
-                fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH,
-                max_exact_match_strength,
-            )
+        # add top exact matches to the results
+        self.add_matches_to_result(
+            target_field_name,
+            exact_matches.get_top(),
+            fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH,
+            max_exact_match_strength,
+        )
         if max_exact_match_strength < max_alignment_strength:
-            # let's add alignments
-            # first do the max strength ones with minimum selectivity
-            row_num = self.add_matches_to_result(
-                row_num,
+            self.add_matches_to_result(
                 target_field_name,
-                top_alignments,
+                alignments.get_top(),
                 fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT,
                 max_alignment_strength,
             )
-            # now it gets tricky, we want to find other alignments where ratio of alignment strength and selectivity vs.
-            # the match with highest alignment strength and minimum selectivity is > ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
-            # filter out other_alignments that are either in exact_matches or alignments
-            other_alignments = Faldisco_Results.filter_out_dups(
-                other_alignments, top_alignments + top_exact_matches
-            )
-            row_num = self.process_other_alignments(
-                row_num,
-                other_alignments,
-                max_alignment_strength,
-                min_selectivity,
-                max_exact_match_strength,
-                max_strength_selectivity_ratio,
-                target_field_name,
-                fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT,
-            )
-
-        return row_num
-
-    def add_field_results(
-            self,
-            row_num: int,
-            target_field_name: str,
-            max_exact_match_strength: float,
-            max_alignment_strength: float,
-            min_selectivity: float,
-            max_strength_selectivity_ratio: float,
-            top_exact_matches: [str],
-            top_alignments: [str],
-            other_alignments: [str],
-    ) -> int:
-
-        if max_exact_match_strength >= 0:
-            # add top exact matches to the results
-            row_num = self.add_matches_to_result(
-                row_num,
-                target_field_name,
-                top_exact_matches,
-                fg.ALIGNMENT_TYPE_EXACT_MATCH,
-                max_exact_match_strength,
-            )
-        if max_exact_match_strength < max_alignment_strength:
-            # let's add alignments
-            # first do the max strength ones with minimum selectivity
-            row_num = self.add_matches_to_result(
-                row_num,
-                target_field_name,
-                top_alignments,
-                fg.ALIGNMENT_TYPE_ALIGNMENT,
-                max_alignment_strength,
-            )
-            # now it gets tricky, we want to find other alignments where ratio of alignment strength and selectivity vs.
-            # the match with highest alignment strength and minimum selectivity is > ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
-            # filter out other_alignments that are either in exact_matches or alignments
-            other_alignments = Faldisco_Results.filter_out_dups(
-                other_alignments, top_alignments + top_exact_matches
-            )
-            row_num = self.process_other_alignments(
-                row_num,
-                other_alignments,
-                max_alignment_strength,
-                min_selectivity,
-                max_exact_match_strength,
-                max_strength_selectivity_ratio,
-                target_field_name,
-                fg.ALIGNMENT_TYPE_ALIGNMENT,
-            )
-
-        return row_num
-
-    @staticmethod
-    def filter_out_dups(list1: [str], list2: [str]) -> [str]:
-        # remove any items in list2 from list1
-        deduped_list = []
-        for i in list1:
-            if i not in list2 + deduped_list:
-                deduped_list.append(i)
-        return deduped_list
 
     def get_selectivity(self, f: str) -> float:
-        fp: Field_Profiles
-        if self.field_profiles is not None and f in self.field_profiles.keys():
-            fp = self.field_profiles[f]
-            return fp.get_field_selectivity()
+        if self.field_profiles is not None and f in self.field_profiles:
+            return self.field_profiles.get_field_selectivity(f)
         else:
             return -1
 
     def add_match_to_result(
             self,
-            row_num: int,
             ref_field_name: str,
             target_field_name: str,
             alignment_type: str,
@@ -332,32 +241,33 @@ class Faldisco_Results:
         orig_ref_field_name = fg.make_orig_field_name(ref_field_name)
         orig_target_field_name = fg.make_orig_field_name(target_field_name)
 
-        self.results_df.loc[row_num] = [
-            self.ref_table_namespace,
-            self.ref_table_name,
-            orig_ref_field_name,
-            self.target_table_namespace,
-            self.target_table_name,
-            orig_target_field_name,
-            alignment_type,
-            alignment_strength,
-        ]
-        row_num += 1
+        self.result_rows.append(
+            [
+                self.ref_table_namespace,
+                self.ref_table_name,
+                orig_ref_field_name,
+                self.target_table_namespace,
+                self.target_table_name,
+                orig_target_field_name,
+                alignment_type,
+                alignment_strength,
+            ]
+        )
         if (
-                f"r__{orig_ref_field_name}" in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                or f"t__{orig_target_field_name}" in fg.TRACE_RECORDS_FOR_FIELDS_ANY
+                f"r__{orig_ref_field_name}" in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
+                or f"t__{orig_target_field_name}" in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
                 or (
-                f"r__{orig_ref_field_name}" in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                and f"t__{orig_target_field_name}" in fg.TRACE_RECORDS_FOR_FIELDS_ALL
+                f"r__{orig_ref_field_name}" in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                and f"t__{orig_target_field_name}" in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
         )
         ):
             logger.info(
-                f"FALDISCO__DEBUG: Adding {alignment_type} at row {row_num} between {ref_field_name} and {target_field_name} = {alignment_strength} to results"
+                f"FALDISCO__DEBUG: Adding {alignment_type} at row {len(self.result_rows)} between {ref_field_name} and {target_field_name} = {alignment_strength} to results"
             )
 
         # if an alignment, add value matches
         if alignment_type == fg.ALIGNMENT_TYPE_ALIGNMENT:
-            self.value_matches_row_num = self.value_matches.add_alignment_values_to_df(
+            self.value_matches.write_alignment_values(
                 self.ref_table_namespace,
                 self.ref_table_name,
                 ref_field_name,
@@ -365,82 +275,38 @@ class Faldisco_Results:
                 self.target_table_name,
                 target_field_name,
                 alignment_type,
-                self.value_matches_df,
-                self.value_matches_row_num,
+                self.value_alignment_writer,
             )
         elif alignment_type == fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT:
-            ref_mfv = self.field_profiles.get_field_mfv(ref_field_name)
-            target_mfv = self.field_profiles.get_field_mfv(target_field_name)
-            self.value_matches_row_num = (
-                self.value_matches.add_sparse_alignment_values_to_df(
-                    self.ref_table_namespace,
-                    self.ref_table_name,
-                    ref_field_name,
-                    self.target_table_namespace,
-                    self.target_table_name,
-                    target_field_name,
-                    ref_mfv,
-                    target_mfv,
-                    alignment_type,
-                    self.value_matches_df,
-                    self.value_matches_row_num,
-                )
+            ref_mfv = self.field_profiles.get_combination_mfv(ref_field_name, target_field_name)
+            target_mfv = self.field_profiles.get_combination_mfv(target_field_name, ref_field_name)
+            self.sparse_value_matches.write_sparse_alignment_values(
+                self.ref_table_namespace,
+                self.ref_table_name,
+                ref_field_name,
+                self.target_table_namespace,
+                self.target_table_name,
+                target_field_name,
+                ref_mfv,
+                target_mfv,
+                alignment_type,
+                self.value_alignment_writer,
             )
 
-        return row_num
-
     def add_matches_to_result(
             self,
-            row_num: int,
             target_field_name: str,
             matches: [str],
             alignment_type: str,
             alignment_strength: float,
     ):
         for r in matches:
-            row_num = self.add_match_to_result(
-                row_num,
+            self.add_match_to_result(
                 r,
                 target_field_name,
                 alignment_type,
                 alignment_strength,
             )
-        return row_num
-
-    def process_other_alignments(
-            self,
-            row_num: int,
-            other_alignments: [],
-            max_alignment_strength: float,
-            min_selectivity: float,
-            max_exact_match_strength: float,
-            max_strength_selectivity_ratio: float,
-            target_field_name: str,
-            alignment_type: str,
-    ):
-        # now it gets tricky, we want to find other alignments where ratio of alignment strength and selectivity vs.
-        # the match with highest alignment strength and minimum selectivity is > ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
-        threshold = (
-                max_strength_selectivity_ratio - fg.ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD
-        )
-        for r in other_alignments:
-            alignment_strength = self.get_alignment_strength(
-                target_field_name, r, alignment_type
-            )
-            if alignment_strength > max_exact_match_strength:
-                # worth exploring
-                selectivity = self.get_selectivity(r)
-                strength_selectivity_ratio = alignment_strength / selectivity
-                if strength_selectivity_ratio >= threshold:
-                    self.add_match_to_result(
-                        row_num,
-                        r,
-                        target_field_name,
-                        alignment_type,
-                        alignment_strength,
-                    )
-                    row_num += 1
-        return row_num
 
     def add_match(
             self,
@@ -458,11 +324,11 @@ class Faldisco_Results:
         al = rf[ref_field_name]
         al[alignment_type] = alignment_strength
         if (
-                ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                or target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
+                ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
+                or target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
                 or (
-                ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
+                ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                and target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
         )
         ):
             logger.info(
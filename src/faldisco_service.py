@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from sqlalchemy import MetaData
+
+import faldisco_globals as fg
+from column_pruning import Column_Pruning
+from faldisco_context import Faldisco_Context
+from faldisco_orchestrator import Faldisco_Orchestrator
+from faldisco_utils import FaldiscoUtils
+from partition_pruning import Partition_Pruning
+from table_sample import REFERENCE_FIELD_PREFIX, TARGET_FIELD_PREFIX, Table_Sample
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+
+# a discovery job: one shared sample - a reference or a target table - against a list of tables of the other side
+class Faldisco_Job:
+    job_id: str
+    request: {}
+    status: str
+    submitted: float
+    started: float
+    finished: float
+    # (schema name, table name, field names, join keys, field prefix, partition) of the shared sample
+    sample_spec: (str, str, [str], List[str], str, {str: object})
+    sample_key: (str, str, str, tuple, tuple, str, tuple, str)  # key of the shared sample in the sample cache
+    tables: [(str, str, [str], List[str], {str: object})]
+    workers: int
+    context: Faldisco_Context  # settings of the job's runs - faldisco_globals with the request's "settings"
+    estimated_cost: float  # rows times field combinations
+    estimated_memory: int  # bytes
+    num_alignments: {str: int}
+    results: [{}]
+    error: str
+    lock: threading.Lock
+
+    def __init__(self, job_id: str, request: {}):
+        self.job_id = job_id
+        self.request = request
+        self.status = JOB_STATUS_QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.sample_spec = None
+        self.sample_key = None
+        self.tables = []
+        self.workers = fg.FALDISCO_WORKERS
+        self.context = None
+        self.estimated_cost = 0.0
+        self.estimated_memory = 0
+        self.num_alignments = {}
+        self.results = []
+        self.error = None
+        self.lock = threading.Lock()
+
+    def estimate(self):
+        num_sample_fields = len(self.sample_spec[2])
+        num_fields = [len(table[2]) for table in self.tables] + [0]
+        self.estimated_cost = float(
+            self.context.SAMPLE_SIZE * num_sample_fields * sum(num_fields)
+        )
+        # the shared sample plus the joined samples evaluated at the same time
+        self.estimated_memory = (
+                self.context.SAMPLE_SIZE
+                * fg.FALDISCO_SERVICE_BYTES_PER_VALUE
+                * (num_sample_fields + max(num_fields) * max(min(self.workers, len(self.tables)), 1))
+        )
+
+    def get_priority(self, now: float) -> float:
+        # cheapest first; waiting jobs age so that a stream of cheap jobs does not starve an expensive one
+        waited = now - self.submitted
+        return self.estimated_cost * 0.5 ** (waited / fg.FALDISCO_SERVICE_COST_HALF_LIFE)
+
+    def add_outputs(self, outputs: (str, str, object, object, int, object)):
+        _ref_table_name, _target_table_name, _profiles_df, results_df, _num_value_alignments, _context = outputs
+        with self.lock:
+            self.results += results_df.to_dict("records")
+
+    def to_dict(self) -> {}:
+        return {
+            "job_id": self.job_id,
+            "request": self.request,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "num_tables": len(self.tables),
+            "estimated_cost": self.estimated_cost,
+            "estimated_memory": self.estimated_memory,
+            "num_alignments": self.num_alignments,
+            "error": self.error,
+        }
+
+
+# long lived discovery service: keeps engines, reflected metadata and shared samples warm between jobs, and runs
+# queued jobs on a bounded number of job threads, cheapest first, within a memory budget. Cached samples count
+# against the budget unless a running job uses them - its estimate already holds its sample. Samples are evicted
+# once they are older than FALDISCO_SERVICE_SAMPLE_TTL, and least recently used first when a job needs their memory
+class Faldisco_Service:
+    db_url: str
+    orchestrator: Faldisco_Orchestrator
+    metadata: {str: MetaData}
+    # shared samples by database, table, fields, join keys, side, partition and settings, least recently used
+    # first: (load time, estimated memory, sample)
+    samples: OrderedDict
+    # locks of the samples being loaded or cached
+    sample_locks: {(str, str, str, tuple, tuple, str, tuple, str): threading.Lock}
+    jobs: {str: Faldisco_Job}
+    queue: [Faldisco_Job]
+    running: {str: Faldisco_Job}
+    max_jobs: int
+    memory_limit: int
+    condition: threading.Condition
+    metadata_lock: threading.Lock
+    job_ids: itertools.count
+
+    def __init__(
+            self,
+            db_url: str,
+            max_jobs: int = fg.FALDISCO_SERVICE_JOBS,
+            memory_limit: int = fg.FALDISCO_SERVICE_MEMORY_LIMIT,
+    ):
+        self.db_url = db_url
+        self.orchestrator = Faldisco_Orchestrator()
+        self.metadata = {}
+        self.samples = OrderedDict()
+        self.sample_locks = {}
+        self.jobs = {}
+        self.queue = []
+        self.running = {}
+        self.max_jobs = max(max_jobs, 1)
+        self.memory_limit = memory_limit
+        self.condition = threading.Condition()
+        self.metadata_lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+
+    def get_metadata(self, db_url: str) -> MetaData:
+        with self.metadata_lock:
+            if db_url not in self.metadata:
+                metadata_obj = MetaData(bind=self.orchestrator.get_engine(db_url))
+                metadata_obj.reflect()
+                self.metadata[db_url] = metadata_obj
+            return self.metadata[db_url]
+
+    def refresh(self):
+        # drop reflected metadata and samples - the next jobs see schema and data changes
+        with self.metadata_lock:
+            self.metadata = {}
+        with self.condition:
+            for key in list(self.samples.keys()):
+                self.evict_sample(key)
+            self.condition.notify_all()
+
+    @staticmethod
+    def get_sample_key(
+            db_url: str,
+            schema_name: str,
+            table_name: str,
+            field_names: [str],
+            join_keys: List[str],
+            field_prefix: str,
+            partition: {str: object},
+            context: Faldisco_Context,
+    ) -> (str, str, str, tuple, tuple, str, tuple, str):
+        # runs on a shared sample have its settings, so only jobs with the same settings share it
+        settings = json.dumps(context.get_settings(), sort_keys=True, default=str)
+        return (
+            db_url,
+            schema_name,
+            table_name,
+            tuple(field_names),
+            tuple(join_keys),
+            field_prefix,
+            tuple(partition.items()),
+            settings,
+        )
+
+    @staticmethod
+    def get_sample_memory(sample: Table_Sample) -> int:
+        # estimated like the shared sample of a job
+        return len(sample.df) * len(sample.field_names) * fg.FALDISCO_SERVICE_BYTES_PER_VALUE
+
+    def evict_sample(self, key: (str, str, str, tuple, tuple, str, tuple, str)):
+        # called with the condition held. A sample being loaded keeps its lock
+        self.samples.pop(key, None)
+        lock = self.sample_locks.get(key)
+        if lock is not None and not lock.locked():
+            del self.sample_locks[key]
+
+    def evict_expired_samples(self):
+        # called with the condition held
+        now = time.time()
+        for key, (loaded, _memory, _sample) in list(self.samples.items()):
+            if now - loaded >= fg.FALDISCO_SERVICE_SAMPLE_TTL:
+                self.evict_sample(key)
+
+    def get_cached_memory(self, excluded_keys: set) -> int:
+        # called with the condition held: memory of the cached samples no running job uses
+        return sum(memory for key, (_loaded, memory, _sample) in self.samples.items() if key not in excluded_keys)
+
+    def get_sample(
+            self,
+            db_url: str,
+            schema_name: str,
+            table_name: str,
+            field_names: [str],
+            join_keys: List[str],
+            field_prefix: str,
+            partition: {str: object},
+            context: Faldisco_Context,
+    ) -> Table_Sample:
+        key = Faldisco_Service.get_sample_key(
+            db_url, schema_name, table_name, field_names, join_keys, field_prefix, partition, context
+        )
+        with self.condition:
+            lock = self.sample_locks.setdefault(key, threading.Lock())
+        # jobs that share a sample wait for one load
+        with lock:
+            with self.condition:
+                self.evict_expired_samples()
+                loaded = self.samples.get(key)
+                if loaded is not None:
+                    self.samples.move_to_end(key)
+            if loaded is not None:
+                logger.info(f"FALDISCO__DEBUG: reusing sample of {schema_name}.{table_name}")
+                return loaded[2]
+            sample = FaldiscoUtils.load_sample(
+                self.orchestrator.get_engine(db_url),
+                schema_name,
+                table_name,
+                field_names,
+                join_keys,
+                field_prefix,
+                context,
+                partition,
+            )
+            with self.condition:
+                self.samples[key] = (time.time(), Faldisco_Service.get_sample_memory(sample), sample)
+                self.sample_locks[key] = lock
+            return sample
+
+    @staticmethod
+    def get_names(value) -> [str]:
+        # a list of names, or a comma separated string of them
+        if isinstance(value, str):
+            value = value.split(",")
+        return [v.strip() for v in value]
+
+    def plan_job(self, job: Faldisco_Job):
+        # resolve the tables of the request the same way as the command line: either side can be many
+        # tables, but not both
+        request = job.request
+        db_url = request.get("db_url", self.db_url)
+        refs = Faldisco_Service.get_names(request["reference"])
+        targets = Faldisco_Service.get_names(request["target"])
+        ref_join_keys = Faldisco_Service.get_names(request["join_keys"])
+        target_join_keys = Faldisco_Service.get_names(
+            request.get("target_join_keys", ref_join_keys)
+        )
+        job.workers = int(request.get("workers", fg.FALDISCO_WORKERS))
+        # settings of faldisco_globals to change for this job only, e.g. {"SAMPLE_SIZE": 10000}
+        job.context = Faldisco_Context(**request.get("settings", {}))
+        if not (all("." in r for r in refs) and all("." in t for t in targets)):
+            raise ValueError("tables must be named ns.table")
+        is_many_refs = len(refs) > 1 or refs[0].endswith(".*")
+        is_many_targets = len(targets) > 1 or targets[0].endswith(".*")
+        if is_many_refs and is_many_targets:
+            raise ValueError("either the reference or the target can be many tables, not both")
+        metadata_obj = self.get_metadata(db_url)
+        if is_many_refs:
+            schema_name, table_name = targets[0].split(".")[0:2]
+            shared_join_keys, other_names, other_join_keys = target_join_keys, refs, ref_join_keys
+            shared_partition_spec, other_partition_spec = request.get("target_partition"), request.get("ref_partition")
+            field_prefix = TARGET_FIELD_PREFIX
+        else:
+            schema_name, table_name = refs[0].split(".")[0:2]
+            shared_join_keys, other_names, other_join_keys = ref_join_keys, targets, target_join_keys
+            shared_partition_spec, other_partition_spec = request.get("ref_partition"), request.get("target_partition")
+            field_prefix = REFERENCE_FIELD_PREFIX
+        if table_name not in metadata_obj.tables:
+            raise ValueError(f"table {schema_name}.{table_name} does not exist")
+        shared_table = metadata_obj.tables[table_name]
+        engine = self.orchestrator.get_engine(db_url)
+        job.sample_spec = (
+            schema_name,
+            table_name,
+            Column_Pruning.prune_columns(engine, schema_name, shared_table, shared_join_keys, job.context),
+            shared_join_keys,
+            field_prefix,
+            Partition_Pruning.get_partition(engine, schema_name, shared_table, shared_partition_spec),
+        )
+        job.sample_key = Faldisco_Service.get_sample_key(db_url, *job.sample_spec, job.context)
+        job.tables = [
+            (
+                other_schema_name,
+                t.name,
+                Column_Pruning.prune_columns(engine, other_schema_name, t, other_join_keys, job.context),
+                other_join_keys,
+                Partition_Pruning.get_partition(engine, other_schema_name, t, other_partition_spec),
+            )
+            for other_schema_name, t in FaldiscoUtils.get_tables(
+                metadata_obj, other_names, other_join_keys[0], shared_table
+            )
+        ]
+        job.estimate()
+
+    def submit(self, request: {}) -> Faldisco_Job:
+        job = Faldisco_Job(str(next(self.job_ids)), request)
+        self.plan_job(job)
+        with self.condition:
+            self.jobs[job.job_id] = job
+            self.queue.append(job)
+            self.condition.notify_all()
+        logger.info(
+            f"FALDISCO__DEBUG: job {job.job_id} queued: {len(job.tables)} tables, "
+            + f"cost={job.estimated_cost}, memory={job.estimated_memory}"
+        )
+        return job
+
+    def get_job(self, job_id: str) -> Faldisco_Job:
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def next_job(self) -> Faldisco_Job:
+        # the job with the best priority that fits in the memory budget - any job when nothing runs. Cached
+        # samples that no running job uses are evicted, least recently used first, to make room for it
+        if len(self.running) >= self.max_jobs:
+            return None
+        self.evict_expired_samples()
+        used_memory = sum(job.estimated_memory for job in self.running.values())
+        running_keys = {job.sample_key for job in self.running.values()}
+        now = time.time()
+        for job in sorted(self.queue, key=lambda j: j.get_priority(now)):
+            # the job's own cached sample is already in its estimate
+            in_use = running_keys | {job.sample_key}
+            if (
+                    self.memory_limit > 0
+                    and len(self.running) > 0
+                    and used_memory + job.estimated_memory > self.memory_limit
+            ):
+                continue
+            for key in list(self.samples.keys()):
+                if (
+                        self.memory_limit <= 0
+                        or used_memory + job.estimated_memory + self.get_cached_memory(in_use) <= self.memory_limit
+                ):
+                    break
+                if key not in in_use:
+                    self.evict_sample(key)
+            return job
+        return None
+
+    def schedule(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self.next_job()
+                self.queue.remove(job)
+                self.running[job.job_id] = job
+                job.status = JOB_STATUS_RUNNING
+                job.started = time.time()
+            threading.Thread(target=self.run_job, args=(job,), daemon=True).start()
+
+    def run_job(self, job: Faldisco_Job):
+        db_url = job.request.get("db_url", self.db_url)
+
+        def write(outputs):
+            FaldiscoUtils.write_outputs(outputs)
+            job.add_outputs(outputs)
+
+        try:
+            sample = self.get_sample(db_url, *job.sample_spec, job.context)
+            job.num_alignments = FaldiscoUtils.find_alignments_for_sample(
+                db_url, sample, job.tables, job.workers, self.orchestrator, write
+            )
+            job.status = JOB_STATUS_DONE
+        except Exception as e:
+            logger.exception(f"FALDISCO__DEBUG: job {job.job_id} failed")
+            job.error = str(e)
+            job.status = JOB_STATUS_FAILED
+        job.finished = time.time()
+        logger.info(f"FALDISCO__DEBUG: job {job.job_id} {job.status} in {job.finished - job.started:.1f}s")
+        with self.condition:
+            del self.running[job.job_id]
+            self.condition.notify_all()
+
+    def serve(self, port: int = fg.FALDISCO_SERVICE_PORT):
+        threading.Thread(target=self.schedule, daemon=True).start()
+        server = ThreadingHTTPServer(("127.0.0.1", port), Faldisco_Request_Handler)
+        server.service = self
+        logger.info(f"FALDISCO__DEBUG: serving on 127.0.0.1:{port}")
+        server.serve_forever()
+
+
+# JSON API:
+#   POST /jobs {"reference": "ns.t", "target": "ns.t1,ns.t2", "join_keys": "id"} -> job status
+#   GET /jobs, GET /jobs/<id> -> job status; GET /jobs/<id>/results -> field alignments found so far
+#   POST /refresh -> drop reflected metadata and cached samples
+class Faldisco_Request_Handler(BaseHTTPRequestHandler):
+    def send_json(self, code: int, body):
+        data = json.dumps(
+            body, default=lambda v: v.item() if hasattr(v, "item") else str(v)
+        ).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [p for p in self.path.split("/") if p != ""]
+        if parts == ["jobs"]:
+            with service.condition:
+                jobs = list(service.jobs.values())
+            self.send_json(200, [job.to_dict() for job in jobs])
+            return
+        job = service.get_job(parts[1]) if len(parts) >= 2 and parts[0] == "jobs" else None
+        if job is None:
+            self.send_json(404, {"error": f"not found: {self.path}"})
+        elif len(parts) == 2:
+            self.send_json(200, job.to_dict())
+        elif len(parts) == 3 and parts[2] == "results":
+            with job.lock:
+                results = list(job.results)
+            self.send_json(200, {"status": job.status, "results": results})
+        else:
+            self.send_json(404, {"error": f"not found: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path == "/refresh":
+            service.refresh()
+            self.send_json(200, {})
+            return
+        if self.path != "/jobs":
+            self.send_json(404, {"error": f"not found: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = service.submit(json.loads(self.rfile.read(length)))
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logger.exception("FALDISCO__DEBUG: job submission failed")
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        logger.info(f"FALDISCO__DEBUG: {self.address_string()} {format % args}")
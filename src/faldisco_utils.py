@@ -8,21 +8,33 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
-from typing import List
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
 import pandas as pd
+from sqlalchemy import MetaData, Table, create_engine
 from sqlalchemy.engine import Engine
 from sqlalchemy.sql import ColumnCollection
 
 import faldisco_globals as fg
+from faldisco_checkpoint import CHECKPOINT_STAGE_NONE, CHECKPOINT_STAGE_SAMPLE, Faldisco_Checkpoint
+from faldisco_context import Faldisco_Context
+from faldisco_orchestrator import Faldisco_Orchestrator
+from faldisco_profiler import Faldisco_Profiler
 from field_alignment import (
     Field_Alignment,
 )
+from partition_stability import Partition_Stability
+from table_sample import REFERENCE_FIELD_PREFIX, TARGET_FIELD_PREFIX, Table_Sample
 
 logger = logging.getLogger(__name__)
 
 
 class FaldiscoUtils:
+    # state of a worker process evaluating tables against a shared sample
+    worker_sample: Table_Sample = None
+
     def __init__(self):
         return
 
@@ -61,12 +73,18 @@ class FaldiscoUtils:
             engine: Engine,
             ref_schema_name: str,
             ref_table_name: str,
-            ref_table_fields: ColumnCollection,
+            ref_table_fields: List[str],
             ref_join_keys: List[str],
             target_schema_name: str,
             target_table_name: str,
-            target_table_fields: ColumnCollection,
+            target_table_fields: List[str],
             target_join_keys: List[str],
+            checkpoint: Faldisco_Checkpoint = None,
+            resume: bool = False,
+            context: Faldisco_Context = None,
+            profiler: Faldisco_Profiler = None,
+            ref_partition: Dict[str, object] = None,
+            target_partition: Dict[str, object] = None,
     ):
         fa = Field_Alignment(
             ref_schema_name,
@@ -74,54 +92,441 @@ class FaldiscoUtils:
             target_schema_name,
             target_table_name,
             ref_join_keys,
-            ref_table_fields.keys(),
-            target_table_fields.keys(),
+            ref_table_fields,
+            target_table_fields,
+            context=context,
+            ref_partition=ref_partition,
+            target_partition=target_partition,
         )
+        fa.profiler = profiler
+
+        stage = CHECKPOINT_STAGE_NONE
+        if checkpoint is not None:
+            if resume:
+                stage = fa.restore_checkpoint(checkpoint)
+            else:
+                # a new run with the same id starts over
+                checkpoint.clear()
 
-        query = fa.gen_sql()
         logger.setLevel(logging.INFO)
-        logger.info("FALDISCO__DEBUG: query={query}")
-        with engine.connect() as connection:
-            qresults_df = pd.read_sql(sql=query, con=connection)
-        logger.info(f"FALDISCO__DEBUG: {qresults_df} result size {qresults_df.shape}")
-        fa.df = qresults_df
-        num_alignments = fa.find_field_alignment()
+        if stage < CHECKPOINT_STAGE_SAMPLE:
+            with fa.profile_stage("sample"):
+                if fa.context.FALDISCO_DB_PROFILES is not None:
+                    fa.profile_fields_in_db(engine, fa.context.FALDISCO_DB_PROFILES)
+                if fa.is_sliced():
+                    fa.set_slices(FaldiscoUtils.read_slices(engine, fa))
+                else:
+                    query = fa.gen_sql()
+                    logger.info("FALDISCO__DEBUG: query={query}")
+                    qresults_df = Faldisco_Orchestrator.read_sample(engine, query, fa.context)
+                    logger.info(f"FALDISCO__DEBUG: {qresults_df} result size {qresults_df.shape}")
+                    fa.df = qresults_df
+            fa.save_checkpoint(checkpoint, CHECKPOINT_STAGE_SAMPLE)
+        num_alignments = fa.find_field_alignment(checkpoint, stage)
         logger.info("FALDISCO__DEBUG: Number of alignments=" + str(num_alignments))
+        with fa.profile_stage("write"):
+            FaldiscoUtils.write_results(fa)
+        fa.release()
+        if checkpoint is not None:
+            # the run is complete - nothing is left to resume
+            checkpoint.clear()
+
+    # one reference, target table pair over many partitions - e.g. the last 14 days - instead of one run per
+    # partition: the partitions are fetched in parallel, each on its own connection, the profiles and combinations
+    # of the run are planned once from all their rows, and the workers count every partition for that plan in
+    # parallel. Counts add up, so the combined counts of all partitions are scored into the field alignments and
+    # value alignments of the run, and the strengths of every partition on its own into the
+    # FIELD_ALIGNMENT_STABILITY_FIELDS of each result. partitions are (name, ref partition, target partition)
+    # tuples, in the order their rows are counted
+    @staticmethod
+    def find_partition_alignments(
+            db_url: str,
+            ref_schema_name: str,
+            ref_table_name: str,
+            ref_table_fields: List[str],
+            ref_join_keys: List[str],
+            target_schema_name: str,
+            target_table_name: str,
+            target_table_fields: List[str],
+            partitions: [(str, Dict[str, object], Dict[str, object])],
+            workers: int = fg.FALDISCO_WORKERS,
+            context: Faldisco_Context = None,
+    ) -> int:
+        fa = Field_Alignment(
+            ref_schema_name,
+            ref_table_name,
+            target_schema_name,
+            target_table_name,
+            ref_join_keys,
+            ref_table_fields,
+            target_table_fields,
+            context=context,
+        )
+        queries = [
+            Field_Alignment(
+                ref_schema_name,
+                ref_table_name,
+                target_schema_name,
+                target_table_name,
+                ref_join_keys,
+                ref_table_fields,
+                target_table_fields,
+                context=fa.context,
+                ref_partition=ref_partition,
+                target_partition=target_partition,
+            ).gen_sql()
+            for _name, ref_partition, target_partition in partitions
+        ]
+        engine = create_engine(db_url)
+        with ThreadPoolExecutor(max_workers=max(fa.context.FALDISCO_DB_CONCURRENCY, 1)) as executor:
+            dfs = list(
+                executor.map(lambda query: Faldisco_Orchestrator.read_sample(engine, query, fa.context), queries)
+            )
+        for (name, _ref_partition, _target_partition), df in zip(partitions, dfs):
+            logger.info(f"FALDISCO__DEBUG: partition {name}: fetched {len(df)} rows")
+
+        stability = Partition_Stability()
+        fa.df = pd.concat(dfs, ignore_index=True)
+        fa.deduped_df = fa.df
+        fa.num_rows = len(fa.df)
+        num_alignments = 0
+        if fa.num_rows > 0:
+            fa.create_combinations(fa.df)
+            # the rows are counted partition by partition
+            fa.df = None
+            fa.deduped_df = None
+            fa.num_rows = 0
+            logger.info(
+                f"FALDISCO__DEBUG: Created combinations. total # combinations: {fa.num_combinations()}"
+            )
+            if fa.num_combinations() > 0 or fa.has_transform_fields():
+                # every partition gets its own copy of the plan
+                with FaldiscoUtils.make_executor(workers) as executor:
+                    futures = [
+                        executor.submit(Partition_Stability.count_partition, fa.copy_plan(), df) for df in dfs
+                    ]
+                    dfs = None
+                    for (name, _ref_partition, _target_partition), future in zip(partitions, futures):
+                        counts, strengths = future.result()
+                        fa.add_counts(counts)
+                        stability.add_partition(name, strengths)
+                fa.find_transform_matches(fa.transform_counts)
+                num_alignments = fa.score_results()
+        fa.results_df = stability.add_stability(fa.results_df)
+        logger.info(
+            f"FALDISCO__DEBUG: Number of alignments={num_alignments} over {len(stability.partition_names)} partitions"
+        )
+        FaldiscoUtils.write_results(fa)
+        fa.release()
+        return num_alignments
+
+    @staticmethod
+    def read_slices(engine: Engine, fa: Field_Alignment) -> [pd.DataFrame]:
+        # fetch the vertical slices of a wide sample, at most FALDISCO_DB_CONCURRENCY at a time and at most
+        # FALDISCO_PREFETCH ahead of the slice being profiled, so only a few slices are in flight
+        queries = fa.gen_slice_sqls()
+        logger.info(f"FALDISCO__DEBUG: fetching the sample in {len(queries)} slices")
+        slices = []
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(fa.context.FALDISCO_DB_CONCURRENCY, 1)) as executor:
+            for query in queries:
+                pending.append(executor.submit(Faldisco_Orchestrator.read_sample, engine, query, fa.context))
+                if len(pending) > fa.context.FALDISCO_PREFETCH:
+                    fa.add_slice(slices, pending.popleft().result())
+            while pending:
+                fa.add_slice(slices, pending.popleft().result())
+        return slices
+
+    @staticmethod
+    def write_results(fa: Field_Alignment):
+        FaldiscoUtils.write_outputs(FaldiscoUtils.get_outputs(fa))
 
+    # everything write_outputs needs from a finished run, without the run's value counts and samples - value
+    # alignments are already written, only their number and the run's settings are kept
+    @staticmethod
+    def get_outputs(
+            fa: Field_Alignment,
+    ) -> (str, str, pd.DataFrame, pd.DataFrame, int, Faldisco_Context):
+        return (
+            fa.ref_table_name,
+            fa.target_table_name,
+            fa.profiles_to_df(fg.FIELD_PROFILES_TABLE_FIELDS),
+            fa.results_df,
+            fa.num_value_alignments,
+            fa.context,
+        )
+
+    @staticmethod
+    def write_outputs(outputs: (str, str, pd.DataFrame, pd.DataFrame, int, Faldisco_Context)):
+        ref_table_name, target_table_name, profiles_df, results_df, num_value_alignments, context = outputs
         # write out profiles
-        profiles_df = fa.profiles_to_df(fg.FIELD_PROFILES_TABLE_FIELDS)
-        # load results
-        profiles_df.to_csv(path_or_buf=f"{fg.FALDISCO_OUTPUT_FOLDER}{fg.FALDISCO_OUTPUT_FOLDER}{ref_table_name}_to_{target_table_name}_profiles")
-        results_df = fa.results_df
+        profiles_df.to_csv(
+            path_or_buf=f"{fg.FALDISCO_OUTPUT_FOLDER}{fg.FALDISCO_OUTPUT_FOLDER}{ref_table_name}_to_{target_table_name}_profiles"
+        )
         for _index, row in results_df.iterrows():
             t = f"t__{row['target_field_name']}"
             r = f"r__{row['reference_field_name']}"
             if (
-                    (r in fg.TRACE_FIELDS_ANY)
-                    or (t in fg.TRACE_FIELDS_ANY)
-                    or (r in fg.TRACE_FIELDS_ALL and t in fg.TRACE_FIELDS_ALL)
+                    (r in context.TRACE_FIELDS_ANY)
+                    or (t in context.TRACE_FIELDS_ANY)
+                    or (r in context.TRACE_FIELDS_ALL and t in context.TRACE_FIELDS_ALL)
             ):
                 logger.info(
                     f"FALDISCO__DEBUG: RESULTS: {row['reference_field_name']}, {row['target_field_name']}, alignment type={row['alignment_type']}, strength={row['alignment_strength']}"
                 )
         # load results
         results_df.to_csv(path_or_buf=f"{fg.FALDISCO_OUTPUT_FOLDER}{fg.FALDISCO_OUTPUT_FOLDER}{ref_table_name}_to_{target_table_name}_field_alignments")
-        alignment_values_df = fa.alignment_values_df
-        for _index, row in alignment_values_df.iterrows():
-            t = f"t__{row['target_field_name']}"
-            r = f"r__{row['reference_field_name']}"
-            if (
-                    (r in fg.TRACE_FIELDS_ANY)
-                    or (t in fg.TRACE_FIELDS_ANY)
-                    or (r in fg.TRACE_FIELDS_ALL and t in fg.TRACE_FIELDS_ALL)
-            ):
-                logger.info(
-                    f"FALDISCO__DEBUG: RESULTS: {row['reference_field_name']}={row['reference_field_value']}, {row['target_field_name']}={row['target_field_value']}, {row['alignment_type']}, alignment={row['alignment_count']}, misalignment={row['misalignment_count']}"
-                )
-
-        if len(alignment_values_df) == 0:
+        if num_value_alignments == 0:
             logger.info("FALDISCO__DEBUG: no value alignments found")
         else:
-            # load results
-            alignment_values_df.to_csv(path_or_buf=f"{fg.FALDISCO_OUTPUT_FOLDER}{fg.FALDISCO_OUTPUT_FOLDER}{ref_table_name}_to_{target_table_name}_value_alignments")
+            logger.info(f"FALDISCO__DEBUG: {num_value_alignments} value alignments written")
 
+    @staticmethod
+    def load_sample(
+            engine: Engine,
+            schema_name: str,
+            table_name: str,
+            field_names: [str],
+            join_keys: List[str],
+            field_prefix: str,
+            context: Faldisco_Context = None,
+            partition: Dict[str, object] = None,
+    ) -> Table_Sample:
+        sample = Table_Sample(
+            schema_name, table_name, join_keys, field_names, field_prefix, context, partition
+        )
+        query = sample.gen_sql()
+        logger.info(f"FALDISCO__DEBUG: sample query={query}")
+        sample.set_df(Faldisco_Orchestrator.read_sample(engine, query, sample.context))
+        if sample.context.FALDISCO_DB_PROFILES is not None:
+            sample.profile_fields_in_db(engine, sample.context.FALDISCO_DB_PROFILES)
+        return sample
+
+    @staticmethod
+    def make_sample_alignment(
+            sample: Table_Sample,
+            schema_name: str,
+            table_name: str,
+            field_names: [str],
+            join_keys: List[str],
+            partition: Dict[str, object] = None,
+    ) -> Field_Alignment:
+        # only the other side is fetched, profiled and encoded - the shared side comes from the sample. Each side
+        # is read from its partition: the sample's, and partition for the other side
+        if sample.is_reference():
+            return Field_Alignment(
+                sample.table_namespace,
+                sample.table_name,
+                schema_name,
+                table_name,
+                sample.orig_join_field_names,
+                sample.orig_field_names,
+                field_names,
+                sample,
+                ref_partition=sample.partition,
+                target_partition=partition,
+            )
+        return Field_Alignment(
+            schema_name,
+            table_name,
+            sample.table_namespace,
+            sample.table_name,
+            join_keys if join_keys else sample.orig_join_field_names,
+            field_names,
+            sample.orig_field_names,
+            sample,
+            ref_partition=partition,
+            target_partition=sample.partition,
+        )
+
+    @staticmethod
+    def init_worker(sample: Table_Sample):
+        FaldiscoUtils.worker_sample = sample
+
+    @staticmethod
+    def evaluate_worker_table(
+            table: (str, str, [str], List[str]), df: pd.DataFrame
+    ) -> (int, (str, str, pd.DataFrame, pd.DataFrame, pd.DataFrame)):
+        fa = FaldiscoUtils.make_sample_alignment(FaldiscoUtils.worker_sample, *table)
+        fa.join_sample(df)
+        num_alignments = fa.find_field_alignment()
+        return num_alignments, FaldiscoUtils.get_outputs(fa)
+
+    @staticmethod
+    def evaluate_alignment(
+            fa: Field_Alignment, df: pd.DataFrame
+    ) -> (int, (str, str, pd.DataFrame, pd.DataFrame, pd.DataFrame)):
+        fa.df = df
+        num_alignments = fa.find_field_alignment()
+        outputs = FaldiscoUtils.get_outputs(fa)
+        # the batch keeps every pair's run until it is done - only their outputs are needed
+        fa.release()
+        return num_alignments, outputs
+
+    @staticmethod
+    def make_executor(workers: int, initializer=None, initargs=()) -> Executor:
+        # computation runs in worker processes, or in one thread next to the fetching and writing threads
+        if workers <= 1:
+            if initializer is not None:
+                initializer(*initargs)
+            return ThreadPoolExecutor(max_workers=1)
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=initializer, initargs=initargs
+        )
+
+    # evaluate one shared sample against many tables of the other side: the sample is fetched, profiled and
+    # encoded once and shared by the workers, each table costs only its own fetch and evaluation. Samples of
+    # the next tables are fetched while the current ones are evaluated.
+    # tables are (schema name, table name, field names, join keys) tuples, with the partition of the table as an
+    # optional fifth element
+    @staticmethod
+    def find_alignments_for_sample(
+            db_url: str,
+            sample: Table_Sample,
+            tables: [(str, str, [str], List[str])],
+            workers: int = fg.FALDISCO_WORKERS,
+            orchestrator: Faldisco_Orchestrator = None,
+            write=None,
+    ) -> {str: int}:
+        jobs = [
+            (
+                f"{table[0]}.{table[1]}",
+                db_url,
+                FaldiscoUtils.make_sample_alignment(sample, *table).gen_sample_sql(table[3]),
+                table,
+                sample.context,
+            )
+            for table in tables
+        ]
+        with FaldiscoUtils.make_executor(
+                workers, FaldiscoUtils.init_worker, (sample,)
+        ) as executor:
+            return (orchestrator or Faldisco_Orchestrator()).run(
+                jobs,
+                FaldiscoUtils.evaluate_worker_table,
+                write or FaldiscoUtils.write_outputs,
+                executor,
+                max(workers, 1),
+            )
+
+    # a batch of independent reference, target table pairs, each a (ref schema name, ref table name, ref field
+    # names, ref join keys, target schema name, target table name, target field names) tuple. The sample of the
+    # next pair is fetched while the current pair is profiled and scored
+    @staticmethod
+    def find_alignments(
+            db_url: str,
+            pairs: [(str, str, [str], List[str], str, str, [str])],
+            workers: int = fg.FALDISCO_WORKERS,
+            orchestrator: Faldisco_Orchestrator = None,
+            write=None,
+            context: Faldisco_Context = None,
+    ) -> {str: int}:
+        jobs = []
+        for (
+                ref_schema_name,
+                ref_table_name,
+                ref_field_names,
+                ref_join_keys,
+                target_schema_name,
+                target_table_name,
+                target_field_names,
+        ) in pairs:
+            fa = Field_Alignment(
+                ref_schema_name,
+                ref_table_name,
+                target_schema_name,
+                target_table_name,
+                ref_join_keys,
+                ref_field_names,
+                target_field_names,
+                context=context,
+            )
+            jobs.append(
+                (
+                    f"{ref_schema_name}.{ref_table_name}_to_{target_schema_name}.{target_table_name}",
+                    db_url,
+                    fa.gen_sql(),
+                    fa,
+                    fa.context,
+                )
+            )
+        with FaldiscoUtils.make_executor(workers) as executor:
+            return (orchestrator or Faldisco_Orchestrator()).run(
+                jobs,
+                FaldiscoUtils.evaluate_alignment,
+                write or FaldiscoUtils.write_outputs,
+                executor,
+                max(workers, 1),
+            )
+
+    # one reference table against many target tables
+    @staticmethod
+    def find_alignments_for_reference(
+            db_url: str,
+            ref_schema_name: str,
+            ref_table_name: str,
+            ref_field_names: [str],
+            ref_join_keys: List[str],
+            targets: [(str, str, [str], List[str])],
+            workers: int = fg.FALDISCO_WORKERS,
+            context: Faldisco_Context = None,
+            ref_partition: Dict[str, object] = None,
+    ) -> {str: int}:
+        reference = FaldiscoUtils.load_sample(
+            create_engine(db_url),
+            ref_schema_name,
+            ref_table_name,
+            ref_field_names,
+            ref_join_keys,
+            REFERENCE_FIELD_PREFIX,
+            context,
+            ref_partition,
+        )
+        return FaldiscoUtils.find_alignments_for_sample(db_url, reference, targets, workers)
+
+    # many reference tables against one target table - the target sample, its value encoding, profiles and
+    # value index are shared by all references
+    @staticmethod
+    def find_alignments_for_target(
+            db_url: str,
+            target_schema_name: str,
+            target_table_name: str,
+            target_field_names: [str],
+            target_join_keys: List[str],
+            references: [(str, str, [str], List[str])],
+            workers: int = fg.FALDISCO_WORKERS,
+            context: Faldisco_Context = None,
+            target_partition: Dict[str, object] = None,
+    ) -> {str: int}:
+        target = FaldiscoUtils.load_sample(
+            create_engine(db_url),
+            target_schema_name,
+            target_table_name,
+            target_field_names,
+            target_join_keys,
+            TARGET_FIELD_PREFIX,
+            context,
+            target_partition,
+        )
+        return FaldiscoUtils.find_alignments_for_sample(db_url, target, references, workers)
+
+    # tables named by a list of ns.table and ns.* names - ns.* is every table with the join key, except
+    # other_table. Tables are (schema name, table) tuples
+    @staticmethod
+    def get_tables(
+            metadata_obj: MetaData, names: List[str], join_key: str, other_table: Table
+    ) -> List[Tuple[str, Table]]:
+        tables = []
+        for name in names:
+            schema_name, table_name = name.split(".")[0:2]
+            if table_name == "*":
+                tables += [
+                    (schema_name, t)
+                    for n, t in metadata_obj.tables.items()
+                    if n != other_table.name and join_key in t.c
+                ]
+            elif table_name in metadata_obj.tables:
+                tables.append((schema_name, metadata_obj.tables[table_name]))
+            else:
+                logger.info(f"Table {name} does not exist - skipped")
+        return tables
@@ -7,43 +7,82 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import copy
 import logging
-from typing import Dict
+from contextlib import nullcontext
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
+from sqlalchemy.engine import Engine
 
 import faldisco_globals as fg
+from db_profiles import Db_Profiles
+from faldisco_checkpoint import (
+    CHECKPOINT_STAGE_ALIGNMENTS,
+    CHECKPOINT_STAGE_COMBINATIONS,
+    CHECKPOINT_STAGE_EXACT_MATCHES,
+    CHECKPOINT_STAGE_NONE,
+    CHECKPOINT_STAGE_SPARSE_ALIGNMENTS,
+    CHECKPOINT_STAGE_TRANSFORMS,
+    Faldisco_Checkpoint,
+)
+from faldisco_context import Faldisco_Context
+from faldisco_profiler import Faldisco_Profiler
 from faldisco_results import Faldisco_Results
 from field_combinations import Field_Combinations
-from field_profiles import Field_Profiles
+from field_profiles import Field_Profiles, Field_Profiles_Store, VALUE_KIND_TEXT
+from partition_pruning import Partition_Pruning
+from table_sample import Table_Sample
+from value_alignment_writer import Value_Alignment_Writer
+from value_index import Value_Index
 from value_matches import Value_Matches
+from value_transforms import Value_Transforms
 
 logger = logging.getLogger(__name__)
 
+# position of the shared sample row of every joined row
+SAMPLE_ROW_FIELD_NAME = "faldisco_sample_row"
 
+
+# one run of a reference table against a target table. All the state of the run lives on the instance and all
+# its settings on its context, so runs in threads of the same process do not share anything but a Table_Sample,
+# which runs only read
 class Field_Alignment:
+    context: Faldisco_Context
     ref_table_namespace: str
     ref_table_name: str
     target_table_namespace: str
     target_table_name: str
+    # partition of each side the queries read, {} for all rows
+    ref_partition: {str: object}
+    target_partition: {str: object}
     # contains valid ref, target field combinations and their alignment percentage - 0 means no alignment and no
     # processing
     alignment_combinations: Field_Combinations
     exact_match_combinations: Field_Combinations
     sparse_alignment_combinations: Field_Combinations
     alignment_exact_match_combinations: Field_Combinations
+    # target = f(ref) matches found by Value_Transforms and the name of the transform f of every combination
+    transform_match_combinations: Field_Combinations
+    transform_match_names: {(str, str): str}
+    # matching rows of every transform of every ref field with the transformable target fields
+    transform_counts: {str: {str: np.ndarray}}
 
-    ref_field_names = [str]  # list of reference fields
-    target_field_names = [str]  # list of target fields
-    join_field_names = [str]  # list of join fields
-    orig_ref_field_names = [str]  # list of reference fields
-    orig_target_field_names = [str]  # list of target fields
-    orig_join_field_names = [str]  # list of join fields
+    ref_field_names: [str]  # list of reference fields
+    target_field_names: [str]  # list of target fields
+    join_field_names: [str]  # list of join fields
+    orig_ref_field_names: [str]  # list of reference fields
+    orig_target_field_names: [str]  # list of target fields
+    orig_join_field_names: [str]  # list of join fields
     df: DataFrame  # data frame with the join
     deduped_df: DataFrame  # data frame without any duplicates
-    num_rows = 0
-    field_profiles : Dict[str, Field_Profiles] = {}
+    num_rows: int
+    field_profiles: Field_Profiles_Store
+    # profiles computed in the database, used instead of profiling the fetched rows
+    db_profiles: {str: Field_Profiles}
+    # fields profiled as their vertical slice of the sample arrived
+    profiled_field_names: {str}
 
     # final list of aligned field combinations
     results_df: DataFrame
@@ -53,6 +92,16 @@ class Field_Alignment:
     value_matches: Value_Matches
     sparse_value_matches: Value_Matches
 
+    # shared reference or target sample - its profiles, value codes, value texts and value index are reused
+    # instead of recomputed
+    sample: Table_Sample
+    sample_rows: np.ndarray  # sample row of every row of df
+
+    # combinations of the current counting stage whose value matches are counted - a resumed run skips them
+    num_processed_combinations: int
+    # CPU and memory profile of the stages of the run, None when the run is not profiled
+    profiler: Faldisco_Profiler
+
     def __init__(
             self,
             ref_table_namespace: str,
@@ -62,171 +111,157 @@ class Field_Alignment:
             join_field_names: [str],
             ref_field_names: [str],
             target_field_names: [str],
+            sample: Table_Sample = None,
+            context: Faldisco_Context = None,
+            ref_partition: {str: object} = None,
+            target_partition: {str: object} = None,
     ):
+        # a run on a shared sample has the sample's settings
+        if context is None:
+            context = sample.context if sample is not None else Faldisco_Context()
+        self.context = context
         self.target_table_namespace = target_table_namespace
         self.target_table_name = target_table_name
         self.ref_table_namespace = ref_table_namespace
         self.ref_table_name = ref_table_name
+        self.ref_partition = ref_partition or {}
+        self.target_partition = target_partition or {}
         self.orig_ref_field_names = ref_field_names
         self.orig_target_field_names = target_field_names
         self.orig_join_field_names = join_field_names
         self.ref_field_names = [f"r__{c}" for c in self.orig_ref_field_names]
         self.target_field_names = [f"t__{c}" for c in self.orig_target_field_names]
         self.join_field_names = [f"r_j__{c}" for c in self.orig_join_field_names]
-        self.alignment_combinations = Field_Combinations("alignments")
-        self.exact_match_combinations = Field_Combinations("exact matches")
-        self.sparse_alignment_combinations = Field_Combinations("sparse alignments")
+        self.field_profiles = Field_Profiles_Store(
+            self.ref_field_names + self.target_field_names,
+            [ref_table_namespace] * len(self.ref_field_names)
+            + [target_table_namespace] * len(self.target_field_names),
+            [ref_table_name] * len(self.ref_field_names)
+            + [target_table_name] * len(self.target_field_names),
+            self.context,
+        )
+        self.alignment_combinations = Field_Combinations(
+            "alignments", self.ref_field_names, self.target_field_names
+        )
+        self.exact_match_combinations = Field_Combinations(
+            "exact matches", self.ref_field_names, self.target_field_names
+        )
+        self.sparse_alignment_combinations = Field_Combinations(
+            "sparse alignments", self.ref_field_names, self.target_field_names
+        )
         self.alignment_exact_match_combinations = Field_Combinations(
-            "alignment exact matches"
+            "alignment exact matches", self.ref_field_names, self.target_field_names
         )
-        self.results_df = DataFrame(columns=fg.FIELD_ALIGNMENT_TABLE_FIELDS)
-        self.alignment_values_df = DataFrame(
-            columns=fg.FIELD_VALUE_ALIGNMENT_TABLE_FIELDS
+        self.transform_match_combinations = Field_Combinations(
+            "transform matches", self.ref_field_names, self.target_field_names
         )
-        self.alignment_values_df.astype(fg.FIELD_VALUE_ALIGNMENT_TABLE_FIELD_TYPES)
+        self.transform_match_names = {}
+        self.transform_counts = {}
+        self.results_df = DataFrame(columns=fg.FIELD_ALIGNMENT_TABLE_FIELDS)
+        self.df = None
+        self.deduped_df = None
+        self.num_rows = 0
+        self.value_matches = None
+        self.sparse_value_matches = None
+        self.num_value_alignments = 0
         self.results = None
+        self.sample = sample
+        self.sample_rows = None
+        self.num_processed_combinations = 0
+        self.profiler = None
+        self.db_profiles = {}
+        self.profiled_field_names = set()
 
-    @staticmethod
-    def check_min_int(current: int, new: int):
-        if current == -1 or current > new:
-            return new
-        else:
-            return current
-
-    @staticmethod
-    def check_max_int(current: int, new: int):
-        if current == -1 or current < new:
-            return new
-        return current
-
-    @staticmethod
-    def check_min_str(current: str, new: str):
-        if current is None or current > new:
-            return new
-        else:
-            return current
-
-    @staticmethod
-    def check_max_str(current: str, new: str):
-        if current is None or current < new:
-            return new
-        else:
-            return current
+    def is_sample_field(self, field_name: str) -> bool:
+        return self.sample is not None and field_name in self.sample.profiles
 
     def profile_field(self, df: DataFrame, field_name: str):
         logger.setLevel(logging.DEBUG)
-        # field_df = df.field_name
-        sorted_df = df.sort_values(by=[field_name])
-        prev = None
-        # most frequent value count
-        mfv_count = 0
-        unique_count = 0
-        current_count = 0
-        mfv = None
-        min_val = None
-        max_val = None
-        min_len = -1
-        max_len = -1
-        val = None
-        val_len = -1
-        num_rows = self.num_rows
-
-        for _index, r in sorted_df.iterrows():
-            val = str(r[field_name])
-            if prev is None or prev != val:
-                unique_count += 1
-                if prev is not None and current_count > mfv_count:
-                    # we have a new value, process previous value
-                    mfv_count = current_count
-                    mfv = prev
-                prev = val
-                # if value is not a FALDISCO fill in for NULL or empty string, check the length
-                if not fg.is_special_value(val):
-                    val_len = len(str(val))
-                    min_len = Field_Alignment.check_min_int(min_len, val_len)
-                    max_len = Field_Alignment.check_max_int(max_len, val_len)
-                    min_val = Field_Alignment.check_min_str(min_val, val)
-                    max_val = Field_Alignment.check_max_str(max_val, val)
-                current_count = 1
-            else:
-                # we have a duplicate value
-                current_count += 1
-        # process the last value
-        if not fg.is_special_value(val):
-            val_len = len(str(val))
-            min_len = Field_Alignment.check_min_int(min_len, val_len)
-            max_len = Field_Alignment.check_max_int(max_len, val_len)
-            min_val = Field_Alignment.check_min_str(min_val, val)
-            max_val = Field_Alignment.check_max_str(max_val, val)
-        if current_count > mfv_count:
-            # we have a new value, process previous value
-            mfv_count = current_count
-            mfv = prev
-        # ok - here's what we have:
-        # - unique_count has number of unique values in the field - if it is 1, we have a constant column
-        # - mfv_count has the number of rows of most frequent value
-        # self.field_profiles.set_field_mfv(field_name, str(mfv))
-        selectivity = unique_count / num_rows
-        fp = Field_Profiles(
-            # num_rows: int,
-            num_rows,
-            # cardinality: int
-            unique_count,
-            # selectivity: float,
-            selectivity,
-            # mfv_count: int,
-            mfv_count,
-            # min_len: int,
-            min_len,
-            # max_len: int,
-            max_len,
-            # min_val: str,
-            min_val,
-            # max_val: str,
-            max_val,
-            # mfv
-            mfv,
-        )
-        if field_name in fg.TRACE_FIELDS_ANY:
+        fp = Field_Profiles_Store.profile_values(df[field_name], self.num_rows)
+        if field_name in self.context.TRACE_FIELDS_ANY:
             logger.info(
-                f"FALDISCO__DEBUG: profiling field: {field_name}: mfv={mfv}, mfv_count={mfv_count}, "
-                + f"cardinality = {unique_count}, selectivity={selectivity}, "
-                + f"min_len={min_len}, max_len={max_len}, min_val={min_val}, "
-                + f"max_val={max_val}, is_unique={fp.is_unique_field()}, "
-                + f"is_constant={fp.is_constant_field()}, is_sparse={fp.is_sparse_field()}"
+                f"FALDISCO__DEBUG: profiling field: {field_name}: mfv={fp.get_field_mfv()}, "
+                + f"mfv_count={fp.get_field_mfv_count()}, cardinality = {fp.get_field_cardinality()}, "
+                + f"selectivity={fp.get_field_selectivity()}, min_len={fp.get_field_min_len()}, "
+                + f"max_len={fp.get_field_max_len()}, min_val={fp.get_field_min_val()}, "
+                + f"max_val={fp.get_field_max_val()}, is_unique={fp.is_unique_field(self.context)}, "
+                + f"is_constant={fp.is_constant_field(self.context)}, "
+                + f"is_sparse={fp.is_sparse_field(self.context)}"
             )
         return fp
 
     def profile_fields(self, df: DataFrame, field_names: {}):
         for c in field_names:
-            self.field_profiles[c] = self.profile_field(df, c)
+            if c in self.profiled_field_names:
+                continue
+            if self.is_sample_field(c) and self.sample.db_profiled:
+                # database profiles of the shared table
+                self.field_profiles.set_profile(c, self.sample.profiles[c])
+            elif c in self.db_profiles:
+                self.field_profiles.set_profile(
+                    c, Db_Profiles.set_value_kind(self.db_profiles[c], Field_Profiles_Store.value_kind(df[c]))
+                )
+            else:
+                self.field_profiles.set_profile(c, self.profile_field(df, c))
+
+    def profile_fields_in_db(self, engine: Engine, mode: str):
+        # profile the whole tables before the sample is fetched
+        Db_Profiles.check_mode(mode)
+        self.db_profiles = Db_Profiles.profile_fields(
+            engine,
+            Partition_Pruning.gen_source(self.ref_table_namespace, self.ref_table_name, self.ref_partition),
+            dict(zip(self.ref_field_names, self.orig_ref_field_names)),
+            self.context.FALDISCO_DB_APPROX_DISTINCT,
+        )
+        self.db_profiles.update(
+            Db_Profiles.profile_fields(
+                engine,
+                Partition_Pruning.gen_source(
+                    self.target_table_namespace, self.target_table_name, self.target_partition
+                ),
+                dict(zip(self.target_field_names, self.orig_target_field_names)),
+                self.context.FALDISCO_DB_APPROX_DISTINCT,
+            )
+        )
+
+    def get_value_texts(self, df: DataFrame, field_name: str) -> np.ndarray:
+        if self.is_sample_field(field_name):
+            return self.sample.value_texts[field_name][self.sample_rows]
+        return Field_Profiles_Store.value_texts(df[field_name])
+
+    def sketch_fields(self, df: DataFrame, field_names: [str]):
+        for c in field_names:
+            self.field_profiles.set_signature(
+                c, Field_Profiles_Store.make_signature(self.get_value_texts(df, c))
+            )
 
     def can_fields_have_exact_match(
             self, ref_field_name: str, target_field_name: str
     ) -> bool:
-        rp = self.field_profiles[ref_field_name]
-        tp = self.field_profiles[target_field_name]
-        rmax_len = rp.get_field_max_len()
-        rmin_len = rp.get_field_min_len()
-        tmax_len = tp.get_field_max_len()
-        tmin_len = tp.get_field_min_len()
-        rmax = rp.get_field_max_val()
-        rmin = rp.get_field_min_val()
-        tmax = tp.get_field_max_val()
-        tmin = tp.get_field_min_val()
+        fps = self.field_profiles
+        ri = fps.get_field_id(ref_field_name)
+        ti = fps.get_field_id(target_field_name)
+        rmax_len = fps.max_len[ri]
+        rmin_len = fps.min_len[ri]
+        tmax_len = fps.max_len[ti]
+        tmin_len = fps.min_len[ti]
+        rmax = fps.max_val[ri]
+        rmin = fps.min_val[ri]
+        tmax = fps.max_val[ti]
+        tmin = fps.min_val[ti]
 
         # first check if lengths overlap
-        # then check if values can overlap - TODO: currently comparing as strings, may not work for all data types
-        check = (
-                rmin_len <= tmax_len
-                and tmin_len <= rmax_len
-                and rmax is not None
-                and rmin is not None
-                and tmax is not None
-                and tmin is not None
-                and rmin <= tmax
-                and tmin <= rmax
-        )
+        # then check if values can overlap - numbers and datetimes compare by value, text as strings. Fields
+        # of different kinds are compared as text, so their value ranges do not apply
+        has_range = rmax is not None and rmin is not None and tmax is not None and tmin is not None
+        # lengths and value ranges of database profiles are in the database's texts and collation
+        if fps.from_db[ri] or fps.from_db[ti]:
+            return has_range
+        check = rmin_len <= tmax_len and tmin_len <= rmax_len and has_range
+        if check and fps.value_kinds[ri] == fps.value_kinds[ti]:
+            if fps.value_kinds[ri] == VALUE_KIND_TEXT:
+                rmin, rmax, tmin, tmax = str(rmin), str(rmax), str(tmin), str(tmax)
+            check = rmin <= tmax and tmin <= rmax
         return check
 
     def classify_field(
@@ -236,23 +271,23 @@ class Field_Alignment:
             unique_ref_field_names: [],
             sparse_ref_field_names: [],
     ):
-        fp = self.field_profiles[field_name]
-        if not fp.is_constant_field():
-            if fp.is_sparse_field():
+        fps = self.field_profiles
+        if not fps.is_constant_field(field_name):
+            if fps.is_sparse_field(field_name):
                 # Important: unique sparse fields should be treated as sparse, not as unique
                 sparse_ref_field_names.append(field_name)
                 if (
-                        field_name in fg.TRACE_FIELDS_ANY
-                        or field_name in fg.TRACE_FIELDS_ALL
+                        field_name in self.context.TRACE_FIELDS_ANY
+                        or field_name in self.context.TRACE_FIELDS_ALL
                 ):
                     logger.info(
                         f"FALDISCO__DEBUG: sparse field #{len(sparse_ref_field_names)}={field_name}"
                     )
-            elif fp.is_unique_field():
+            elif fps.is_unique_field(field_name):
                 unique_ref_field_names.append(field_name)
                 if (
-                        field_name in fg.TRACE_FIELDS_ANY
-                        or field_name in fg.TRACE_FIELDS_ALL
+                        field_name in self.context.TRACE_FIELDS_ANY
+                        or field_name in self.context.TRACE_FIELDS_ALL
                 ):
                     logger.info(
                         f"FALDISCO__DEBUG: unique field#{len(unique_ref_field_names)}= {field_name}"
@@ -260,15 +295,15 @@ class Field_Alignment:
             else:
                 alignment_ref_field_names.append(field_name)
                 if (
-                        field_name in fg.TRACE_FIELDS_ANY
-                        or field_name in fg.TRACE_FIELDS_ALL
+                        field_name in self.context.TRACE_FIELDS_ANY
+                        or field_name in self.context.TRACE_FIELDS_ALL
                 ):
                     logger.info(
                         f"FALDISCO__DEBUG: alignment field#{len(alignment_ref_field_names)}= {field_name}"
                     )
 
         else:
-            if field_name in fg.TRACE_FIELDS_ANY or field_name in fg.TRACE_FIELDS_ALL:
+            if field_name in self.context.TRACE_FIELDS_ANY or field_name in self.context.TRACE_FIELDS_ALL:
                 logger.info(f"FALDISCO__DEBUG: constant field {field_name}")
 
     def make_combinations(
@@ -277,19 +312,31 @@ class Field_Alignment:
             target_field_names: [str],
             ac: Field_Combinations,
             axc: Field_Combinations,
+            prune_with_sketches: bool = False,
     ):
         num_alignment_combinations = 0
-        num_exact_match_combinations = 0
-        for r in ref_field_names:
-            for t in target_field_names:
-                # these fields can be used in alignment discovery and exact match discovery
-                if ac is not None:
-                    ac.add_combination(r, t)
-                    num_alignment_combinations += 1
-                if self.can_fields_have_exact_match(r, t):
-                    axc.add_combination(r, t)
-                    # xc.log_combinations()
-                    num_exact_match_combinations += 1
+        if ac is not None:
+            # these fields can be used in alignment discovery and exact match discovery
+            ac.add_combinations(ref_field_names, target_field_names)
+            num_alignment_combinations = len(ref_field_names) * len(target_field_names)
+        # only pairs whose profiles overlap can have exact matches
+        candidates = self.field_profiles.exact_match_candidates(
+            ref_field_names, target_field_names
+        )
+        if prune_with_sketches:
+            # drop candidates whose value sketches show too little overlap for an exact match
+            overlap = self.field_profiles.exact_match_overlap(
+                ref_field_names, target_field_names
+            )
+            pruned = candidates & (
+                    overlap < self.context.FIELD_EXACT_MATCH_THRESHOLD - self.context.FIELD_SKETCH_OVERLAP_SLACK
+            )
+            logger.info(
+                f"FALDISCO__DEBUG: value sketches dropped {int(pruned.sum())} of {int(candidates.sum())} exact match candidates"
+            )
+            candidates &= ~pruned
+        axc.add_combinations(ref_field_names, target_field_names, candidates)
+        num_exact_match_combinations = int(candidates.sum())
         return num_alignment_combinations, num_exact_match_combinations
 
     def create_combinations(self, df: DataFrame):
@@ -297,6 +344,7 @@ class Field_Alignment:
         logger.setLevel(logging.DEBUG)
         self.profile_fields(df, self.ref_field_names)
         self.profile_fields(df, self.target_field_names)
+        self.field_profiles.classify_fields()
         # now that we have profiles, create three lists:
         # combos of potential alignments
         # combos of potential exact matches
@@ -345,11 +393,19 @@ class Field_Alignment:
         )
 
         self.value_matches = Value_Matches(
-            alignment_ref_field_names, alignment_target_field_names
+            alignment_ref_field_names, alignment_target_field_names, self.context
         )
+        if self.sample is not None:
+            self.value_matches.load_dictionary(self.sample.dictionary)
 
+        if self.context.FALDISCO_SKETCH_PRUNING:
+            self.sketch_fields(df, unique_ref_field_names + unique_target_field_names)
         (_ignore, num_exact_match_combinations,) = self.make_combinations(
-            unique_ref_field_names, unique_target_field_names, None, xc
+            unique_ref_field_names,
+            unique_target_field_names,
+            None,
+            xc,
+            self.context.FALDISCO_SKETCH_PRUNING,
         )
 
         sac = self.sparse_alignment_combinations
@@ -358,317 +414,505 @@ class Field_Alignment:
         )
 
         self.sparse_value_matches = Value_Matches(
-            sparse_ref_field_names, sparse_target_field_names
+            sparse_ref_field_names, sparse_target_field_names, self.context
         )
+        if self.sample is not None:
+            self.sparse_value_matches.load_dictionary(self.sample.dictionary)
         logger.info(
             f"FALDISCO__DEBUG: Combos: alignment: {num_alignment_combinations}; "
             + f"exact:{num_exact_match_combinations}; sparse:{num_sparse_alignment_combinations}"
         )
 
-    def process_row_alignments(self, row):
-        vm = self.value_matches
-        for r in self.alignment_combinations.get_ref_field_names():
-            for t in self.alignment_combinations.get_target_field_names(r):
-                # add value for this combination
-                rval = row[r]
-                tval = row[t]
-                if rval != rval:
-                    rval = fg.FALDISCO_NAN
-                    if r in fg.TRACE_RECORDS_FOR_FIELDS_ANY or (
-                            r in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                            and t in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    ):
-                        k = self.join_field_names[0]
-                        kval = row[k]
-                        logger.info(
-                            f"FALDISCO__DEBUG: process row: alignment: unexpected value {r}={rval} at {k}={kval}"
-                        )
-
-                if tval != tval:
-                    tval = fg.FALDISCO_NAN
-                    if t in fg.TRACE_RECORDS_FOR_FIELDS_ANY or (
-                            r in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                            and t in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    ):
-                        k = self.join_field_names[0]
-                        kval = row[k]
-                        logger.info(
-                            f"FALDISCO__DEBUG: process row: alignment: unexpected value {t}={tval} at {k}={kval}"
-                        )
-                vm.add_value(r, t, rval, tval)
+    def encode_field_values(self, vm: Value_Matches, df: DataFrame, field_name: str, as_text: bool):
+        # numbers and datetimes keep their native values, everything else - and numbers and datetimes compared
+        # with fields of another kind - is encoded by its text
+        as_text = as_text or self.field_profiles.is_text_field(field_name)
+        if self.is_sample_field(field_name):
+            if as_text == (self.sample.profiles[field_name].get_field_value_kind() == VALUE_KIND_TEXT):
+                # vm starts from the sample dictionary, so the sample codes are valid as is
+                return self.sample.value_codes[field_name][self.sample_rows]
+            return vm.encode_values(pd.Series(self.get_value_texts(df, field_name)), True)
+        return vm.encode_values(df[field_name], as_text)
+
+    def add_value_matches(
+            self,
+            vm: Value_Matches,
+            df: DataFrame,
+            combinations: [(str, str)],
+            checkpoint: Faldisco_Checkpoint,
+            stage: int,
+    ):
+        # count value pairs for all rows of each combination; every field is encoded once per encoding, native or
+        # text. With a checkpoint, the counts of the last FALDISCO_CHECKPOINT_COMBINATIONS combinations are saved
+        # as a delta of the previous stage
+        codes = {}
+        num_saved_combinations = self.num_processed_combinations
+        num_saved_values = len(vm.values)
+        for i, (r, t) in enumerate(combinations):
+            if i < self.num_processed_combinations:
+                continue
+            as_text = self.field_profiles.is_text_combination(r, t)
+            for f in (r, t):
+                if (f, as_text) not in codes:
+                    codes[(f, as_text)] = self.encode_field_values(vm, df, f, as_text)
+            vm.add_column_values(r, t, codes[(r, as_text)], codes[(t, as_text)])
+            self.num_processed_combinations = i + 1
+            if (
+                    checkpoint is not None
+                    and self.num_processed_combinations % self.context.FALDISCO_CHECKPOINT_COMBINATIONS == 0
+            ):
+                checkpoint.save_delta(
+                    stage,
+                    {
+                        "sparse": vm is self.sparse_value_matches,
+                        "num_processed_combinations": self.num_processed_combinations,
+                        "value_matches": vm.get_delta(
+                            combinations[num_saved_combinations:self.num_processed_combinations], num_saved_values
+                        ),
+                    },
+                )
+                num_saved_combinations = self.num_processed_combinations
+                num_saved_values = len(vm.values)
+        self.num_processed_combinations = 0
+
+    def process_alignments(
+            self, df: DataFrame, combinations: [(str, str)], checkpoint: Faldisco_Checkpoint = None
+    ):
+        self.add_value_matches(
+            self.value_matches, df, combinations, checkpoint, CHECKPOINT_STAGE_COMBINATIONS
+        )
+
+    def process_sparse_alignments(
+            self, df: DataFrame, combinations: [(str, str)], checkpoint: Faldisco_Checkpoint = None
+    ):
+        self.add_value_matches(
+            self.sparse_value_matches, df, combinations, checkpoint, CHECKPOINT_STAGE_ALIGNMENTS
+        )
 
-    @staticmethod
     def record_level_trace_for_field(
+            self,
             field_name: str,
             other_field_name: str,
             msg: str,
     ):
-        if field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY or (
-                field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                and other_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
+        if field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY or (
+                field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                and other_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
         ):
             logger.info(msg)
 
-    @staticmethod
     def record_level_trace_for_combination_of_fields(
+            self,
             field_name: str,
             other_field_name: str,
             msg: str,
     ):
         if (
-                field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                or other_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
+                field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
+                or other_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
                 or (
-                field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                and other_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
+                field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                and other_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
         )
         ):
             logger.info(msg)
 
-    def process_row_exact_matches(self, row):
+    def get_target_value_index(
+            self, df: DataFrame, target_field_names: [str], include_nulls: bool = True
+    ) -> (Value_Index, np.ndarray, np.ndarray):
+        # index over the target fields, the index rows of the rows of df and the index position of every target
+        # field. A shared target sample has one index of all its fields by sample row; probes that skip NULLs
+        # find the same matches in it as in an index without NULLs
+        if self.sample is not None and not self.sample.is_reference():
+            index = self.sample.get_value_index()
+            positions = {f: i for i, f in enumerate(index.field_names)}
+            return (
+                index,
+                self.sample_rows,
+                np.array([positions[f] for f in target_field_names], dtype=np.int64),
+            )
+        return (
+            Value_Index(df, target_field_names, include_nulls),
+            None,
+            np.arange(len(target_field_names)),
+        )
+
+    def process_exact_matches(self, df: DataFrame):
+        # all target fields with exact match candidates go into one (row, value) -> target fields index, then
+        # every ref field finds the number of matching rows of all its candidates in one probe. NULLs match each
+        # other, as the FALDISCO_NULL markers did
         xc = self.exact_match_combinations
+        ref_field_names = xc.get_ref_field_names()
+        if len(ref_field_names) == 0:
+            return
+        target_field_ids = np.flatnonzero(xc.target_fields)
+        index, rows, positions = self.get_target_value_index(
+            df, [xc.target_field_names[ti] for ti in target_field_ids]
+        )
+        for r in ref_field_names:
+            ri = xc.ref_field_ids[r]
+            counts = index.count_matches(self.get_value_texts(df, r), rows=rows)[positions]
+            # the combinations are already tracked - only their number of matches changes
+            tracked = xc.state[ri, target_field_ids]
+            xc.strength[ri, target_field_ids[tracked]] = counts[tracked]
+            for t in xc.get_target_field_names(r):
+                self.record_level_trace_for_combination_of_fields(
+                    r,
+                    t,
+                    f"FALDISCO__DEBUG: found exact matches between: {r} and {t} num_matches={xc.get_combination(r, t)}",
+                )
 
-        for r in self.exact_match_combinations.get_ref_field_names():
-            for t in self.exact_match_combinations.get_target_field_names(r):
-                rval = row[r]
-                tval = row[t]
-                if rval == tval:
-                    # found a match
-                    xc.increment_combination(r, t, 1)
-                    Field_Alignment.record_level_trace_for_combination_of_fields(
-                        r,
-                        t,
-                        f"FALDISCO__DEBUG: found exact match between: {r} and {t} on {row[r]} num_matches={xc.get_combination(r, t)} ({self.exact_match_combinations.get_combination(r, t)})",
-                    )
-                elif rval != rval and tval != tval:
-                    k = self.join_field_names[0]
-                    kval = row[k]
-
-                    xc.increment_combination(r, t, 1)
-                    Field_Alignment.record_level_trace_for_combination_of_fields(
-                        r,
-                        t,
-                        f"FALDISCO__DEBUG: found exact match between unexpected (nan) values {r} and {t} on {row[r]} at key={kval}.  num_matches={xc.get_combination(r, t)} ({self.exact_match_combinations.get_combination(r, t)})",
-                    )
-                elif rval != rval or tval != tval:
-                    # no match, but log unexpected value
-                    k = self.join_field_names[0]
-                    kval = row[k]
-                    if rval != rval:
-                        Field_Alignment.record_level_trace_for_field(
-                            r,
-                            t,
-                            f"FALDISCO__DEBUG: process_row: exact matches: unexpected value {r}={rval} at {k}={kval}",
-                        )
-                    else:
-                        Field_Alignment.record_level_trace_for_field(
-                            t,
-                            r,
-                            f"FALDISCO__DEBUG: process_row: exact matches: unexpected value {t}={tval} at {k}={kval}",
-                        )
-
-    def process_row_sparse_alignments(self, row):
-        svm = self.sparse_value_matches
-        for r in self.sparse_alignment_combinations.get_ref_field_names():
-            for t in self.sparse_alignment_combinations.get_target_field_names(r):
-                # add value for this combination
-                svm.add_value(r, t, str(row[r]), str(row[t]))
-
-    def process_row(self, row):
-        self.process_row_alignments(row)
-        self.process_row_exact_matches(row)
-        self.process_row_sparse_alignments(row)
-
-    def process_rows(self, df):
-        # initialize field_alignment matrix
-        for _index, row in df.iterrows():
-            self.process_row(row)
+    def process_rows(
+            self,
+            df,
+            checkpoint: Faldisco_Checkpoint = None,
+            stage: int = CHECKPOINT_STAGE_COMBINATIONS,
+    ):
+        # stages completed before stage are skipped
+        if stage < CHECKPOINT_STAGE_ALIGNMENTS:
+            with self.profile_stage("alignments"):
+                self.process_alignments(
+                    df, self.alignment_combinations.get_combinations(), checkpoint
+                )
+            self.save_checkpoint(checkpoint, CHECKPOINT_STAGE_ALIGNMENTS)
+        if stage < CHECKPOINT_STAGE_SPARSE_ALIGNMENTS:
+            with self.profile_stage("sparse alignments"):
+                self.process_sparse_alignments(
+                    df, self.sparse_alignment_combinations.get_combinations(), checkpoint
+                )
+            self.save_checkpoint(checkpoint, CHECKPOINT_STAGE_SPARSE_ALIGNMENTS)
+        if stage < CHECKPOINT_STAGE_EXACT_MATCHES:
+            with self.profile_stage("exact matches"):
+                self.process_exact_matches(df)
+            self.save_checkpoint(checkpoint, CHECKPOINT_STAGE_EXACT_MATCHES)
+        if self.context.FALDISCO_TRANSFORMS and stage < CHECKPOINT_STAGE_TRANSFORMS:
+            with self.profile_stage("transforms"):
+                self.process_transforms(df)
+            self.save_checkpoint(checkpoint, CHECKPOINT_STAGE_TRANSFORMS)
         return len(df)
 
+    def profile_stage(self, name: str):
+        # context of a stage of the run - profiled with a profiler, nothing otherwise
+        return self.profiler.stage(name) if self.profiler is not None else nullcontext()
+
+    def save_checkpoint(self, checkpoint: Faldisco_Checkpoint, stage: int):
+        if checkpoint is not None:
+            # the profiler belongs to the process running the run, not to its state
+            checkpoint.save(stage, {k: v for k, v in self.__dict__.items() if k != "profiler"})
+
+    def restore_checkpoint(self, checkpoint: Faldisco_Checkpoint) -> int:
+        # the last completed stage; the state of the run is as it was after that stage
+        stage, state, deltas = checkpoint.load()
+        if state is not None:
+            self.__dict__.update(state)
+        for delta in deltas:
+            vm = self.sparse_value_matches if delta["sparse"] else self.value_matches
+            vm.add_delta(delta["value_matches"])
+            self.num_processed_combinations = delta["num_processed_combinations"]
+        return stage
+
+    def can_transform_field(self, field_name: str) -> bool:
+        # constant and sparse fields would only match on their most frequent value
+        fps = self.field_profiles
+        return not (fps.is_constant_field(field_name) or fps.is_sparse_field(field_name))
+
+    @staticmethod
+    def count_transform_matches(
+            index: Value_Index, rows: np.ndarray, positions: np.ndarray, transformed_values: pd.Series
+    ) -> np.ndarray:
+        texts = Field_Profiles_Store.value_texts(transformed_values)
+        return index.count_matches(texts, Value_Index.is_value(texts), rows)[positions]
+
+    def get_transform_field_names(self) -> ([str], [str]):
+        return (
+            [f for f in self.ref_field_names if self.can_transform_field(f)],
+            [f for f in self.target_field_names if self.can_transform_field(f)],
+        )
+
+    def count_transforms(self, df: DataFrame) -> {str: {str: np.ndarray}}:
+        # matching rows of every transform of every ref field with every target field: all target fields go into
+        # one value index, and every transform of a ref field probes it once instead of being compared with every
+        # target field. The counts of a ref field are by transform name, the identity first with the name None
+        ref_field_names, target_field_names = self.get_transform_field_names()
+        if len(ref_field_names) == 0 or len(target_field_names) == 0:
+            return {}
+        index, rows, positions = self.get_target_value_index(
+            df, target_field_names, include_nulls=False
+        )
+        transform_counts = {}
+        for r in ref_field_names:
+            values = df[r]
+            texts = self.get_value_texts(df, r)
+            is_value = Value_Index.is_value(texts)
+            counts = {None: index.count_matches(texts, is_value, rows)[positions]}
+            texts = pd.Series(texts, index=values.index).where(is_value, None)
+            value_kind = self.field_profiles.get_field_value_kind(r)
+            # text transforms get the value texts, number and datetime transforms the native values
+            transforms = [
+                (name, transform, texts)
+                for name, transform in Value_Transforms.get_text_transforms(value_kind, self.context)
+            ]
+            transforms += [
+                (name, transform, values)
+                for name, transform in Value_Transforms.get_native_transforms(value_kind, self.context)
+            ]
+            for name, transform, transform_values in transforms:
+                counts[name] = Field_Alignment.count_transform_matches(
+                    index, rows, positions, transform(transform_values)
+                )
+            transform_counts[r] = counts
+        return transform_counts
+
+    def find_transform_matches(self, transform_counts: {str: {str: np.ndarray}}):
+        # find target = f(ref) matches: a transform only counts where it matches more rows than the identity
+        _ref_field_names, target_field_names = self.get_transform_field_names()
+        tc = self.transform_match_combinations
+        for r, counts in transform_counts.items():
+            best_counts = counts[None].copy()
+            best_names = np.full(len(target_field_names), None, dtype=object)
+            for name, name_counts in counts.items():
+                if name is None:
+                    continue
+                better = name_counts > best_counts
+                best_counts[better] = name_counts[better]
+                best_names[better] = name
+            match_strength = best_counts / self.num_rows
+            for ti in np.flatnonzero(
+                    pd.notna(best_names) & (match_strength >= self.context.FIELD_EXACT_MATCH_THRESHOLD)
+            ):
+                t = target_field_names[ti]
+                tc.set_combination(r, t, float(match_strength[ti]))
+                self.transform_match_names[(r, t)] = best_names[ti]
+                self.record_level_trace_for_combination_of_fields(
+                    r,
+                    t,
+                    f"FALDISCO__DEBUG: found transform match {t} = {best_names[ti]}({r}) strength={match_strength[ti]}",
+                )
+        logger.info(
+            f"FALDISCO__DEBUG: transform matches: {tc.num_combinations()}"
+        )
+
+    def process_transforms(self, df: DataFrame):
+        # the counts are kept, so the runs of other partitions can add theirs
+        self.transform_counts = self.count_transforms(df)
+        if len(self.transform_counts) > 0:
+            self.find_transform_matches(self.transform_counts)
+
     def update_alignments(self):
         # row_num = len(results.index)
         vm = self.value_matches
         ac = self.alignment_combinations
         xac = self.alignment_exact_match_combinations
-        remove_combinations = {}
         # ac.log_combinations()
-        for r in ac.get_ref_field_names():
-            for t in ac.get_target_field_names(r):
-                check_for_exact_matches = xac.check_combination(r, t)
-                # calculate alignment
-                (
-                    alignment,
-                    exact_match_strength,
-                    value_match_strength,
-                ) = vm.calc_field_combination_alignment(
-                    r, t, self.field_profiles, check_for_exact_matches
+        ris, tis = ac.get_combination_ids()
+        combinations = ac.get_combinations()
+        check_for_exact_matches = xac.state[ris, tis]
+        # calculate alignment for all combinations at once
+        (
+            alignment,
+            exact_match_strength,
+            value_match_strength,
+        ) = vm.calc_field_combination_alignments(
+            combinations, self.field_profiles, check_for_exact_matches
+        )
+        exact_matches = exact_match_strength >= self.context.FIELD_EXACT_MATCH_THRESHOLD
+        # process alignment, but only if it is stronger than exact_match_strength
+        alignments = (
+                (exact_match_strength <= alignment)
+                & (alignment > self.context.FIELD_ROW_ALIGNMENT_THRESHOLD)
+                & (value_match_strength > self.context.FIELD_VALUE_ALIGNMENT_THRESHOLD)
+        )
+        for i, (r, t) in enumerate(combinations):
+            # first, process exact matches
+            if exact_matches[i]:
+                self.results.add_match(
+                    r,
+                    t,
+                    fg.ALIGNMENT_TYPE_EXACT_MATCH,
+                    float(exact_match_strength[i]),
                 )
-                # first, process exact matches
-                if exact_match_strength >= fg.FIELD_EXACT_MATCH_THRESHOLD:
-                    self.results.add_match(
-                        r,
-                        t,
-                        fg.ALIGNMENT_TYPE_EXACT_MATCH,
-                        exact_match_strength,
-                    )
-                    xac.set_combination(r, t, exact_match_strength)
-                else:
-                    # no exact match
-                    xac.remove_combination(r, t)
-
-                # now process alignment, but only if it is stronger than exact_match_strength
-                if (
-                        exact_match_strength <= alignment
-                        and alignment > fg.FIELD_ROW_ALIGNMENT_THRESHOLD
-                        and value_match_strength > fg.FIELD_VALUE_ALIGNMENT_THRESHOLD
-                ):
-                    self.results.add_match(
-                        r,
-                        t,
-                        fg.ALIGNMENT_TYPE_ALIGNMENT,
-                        alignment,
-                    )
-                    ac.set_combination(r, t, alignment)
-                else:
-                    # stop tracking - there is no alignment
-                    remove_combinations[r] = t
-        # remove the combinations that are not exact matches
-        for r in remove_combinations.keys():
-            ac.remove_combination(r, remove_combinations[r])
+            if alignments[i]:
+                self.results.add_match(
+                    r,
+                    t,
+                    fg.ALIGNMENT_TYPE_ALIGNMENT,
+                    float(alignment[i]),
+                )
+        # keep tracking only the exact matches and alignments
+        xac.set_combinations(ris[exact_matches], tis[exact_matches], exact_match_strength[exact_matches])
+        ac.set_combinations(ris[alignments], tis[alignments], alignment[alignments])
+        xac.remove_combinations(Field_Alignment.combination_mask(xac, ris[~exact_matches], tis[~exact_matches]))
+        ac.remove_combinations(Field_Alignment.combination_mask(ac, ris[~alignments], tis[~alignments]))
         return
 
+    @staticmethod
+    def combination_mask(
+            combinations: Field_Combinations, ref_field_ids: np.ndarray, target_field_ids: np.ndarray
+    ) -> np.ndarray:
+        mask = np.zeros_like(combinations.state)
+        mask[ref_field_ids, target_field_ids] = True
+        return mask
+
     def update_sparse_alignments(self):
         # row_num = len(results.index)
         svm = self.sparse_value_matches
         sac = self.sparse_alignment_combinations
         xac = self.alignment_exact_match_combinations
-        remove_combinations = {}
         # sac.log_combinations()
-        for r in sac.get_ref_field_names():
-            for t in sac.get_target_field_names(r):
-                check_for_exact_matches = xac.check_combination(r, t)
-                # calculate alignment
-                (
-                    alignment,
-                    exact_match_strength,
-                    value_match_strength,
-                    non_mfv_row_alignments,
-                ) = svm.calc_sparse_field_combination_alignment(
-                    r, t, self.field_profiles, check_for_exact_matches
+        ris, tis = sac.get_combination_ids()
+        combinations = sac.get_combinations()
+        check_for_exact_matches = xac.state[ris, tis]
+        # calculate alignment for all combinations at once
+        (
+            alignment,
+            exact_match_strength,
+            value_match_strength,
+            non_mfv_row_alignments,
+        ) = svm.calc_sparse_field_combination_alignments(
+            combinations, self.field_profiles, check_for_exact_matches
+        )
+        exact_matches = exact_match_strength >= self.context.FIELD_EXACT_MATCH_THRESHOLD
+        # process alignment, but only if it is stronger than exact_match_strength
+        alignments = (
+                (exact_match_strength <= alignment)
+                & (alignment > self.context.FIELD_ROW_ALIGNMENT_THRESHOLD)
+                & (value_match_strength > self.context.FIELD_VALUE_ALIGNMENT_THRESHOLD)
+        )
+        # we do not have alignment, but looks like the shape matches - every time there is a non-mfv
+        # value in ref field, there is one in target field
+        non_mfv_alignments = ~alignments & (
+                non_mfv_row_alignments > self.context.FIELD_SPARSE_NON_MFV_ALIGNMENT_THRESHOLD
+        )
+        for i, (r, t) in enumerate(combinations):
+            self.record_level_trace_for_combination_of_fields(
+                r,
+                t,
+                f"FALDISCO__DEBUG: calc sparse exact matches between {r} and {t} returned: alignment = "
+                + f"{alignment[i]}, exact_match_strength = {exact_match_strength[i]}, "
+                + f"value_match_strength={value_match_strength[i]}, non_mfv_row_alignments={non_mfv_row_alignments[i]}",
+            )
+            # # first, process exact matches
+            if exact_matches[i]:
+                self.results.add_match(
+                    r,
+                    t,
+                    fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH,
+                    float(exact_match_strength[i]),
                 )
-                Field_Alignment.record_level_trace_for_combination_of_fields(
+            if alignments[i]:
+                self.results.add_match(
                     r,
                     t,
-                    f"FALDISCO__DEBUG: calc sparse exact matches between {r} and {t} returned: alignment = "
-                    + f"{alignment}, exact_match_strength = {exact_match_strength}, "
-                    + f"value_match_strength={value_match_strength}, non_mfv_row_alignments={non_mfv_row_alignments}",
+                    fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT,
+                    float(alignment[i]),
                 )
-                # # first, process exact matches
-                if exact_match_strength >= fg.FIELD_EXACT_MATCH_THRESHOLD:
-                    self.results.add_match(
-                        r,
-                        t,
-                        fg.ALIGNMENT_TYPE_SPARSE_EXACT_MATCH,
-                        exact_match_strength,
-                    )
-                    xac.set_combination(r, t, exact_match_strength)
-                else:
-                    # no exact match
-                    xac.remove_combination(r, t)
-
-                # now process alignment, but only if it is stronger than exact_match_strength
-                if (
-                        exact_match_strength <= alignment
-                        and alignment > fg.FIELD_ROW_ALIGNMENT_THRESHOLD
-                        and value_match_strength > fg.FIELD_VALUE_ALIGNMENT_THRESHOLD
-                ):
-                    self.results.add_match(
-                        r,
-                        t,
-                        fg.ALIGNMENT_TYPE_SPARSE_ALIGNMENT,
-                        alignment,
-                    )
-                    sac.set_combination(r, t, alignment)
-                elif (
-                        non_mfv_row_alignments > fg.FIELD_SPARSE_NON_MFV_ALIGNMENT_THRESHOLD
-                ):
-                    # we do not have alignment, but looks like the shape matches - every time there is a non-mfv
-                    # value in ref field, there is one in target field
-                    self.results.add_match(
-                        r,
-                        t,
-                        fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT,
-                        non_mfv_row_alignments,
-                    )
-                else:
-                    # stop tracking - there is no alignment
-                    remove_combinations[r] = t
-        # remove the combinations that are not exact matches
-        for r in remove_combinations.keys():
-            sac.remove_combination(r, remove_combinations[r])
+            elif non_mfv_alignments[i]:
+                self.results.add_match(
+                    r,
+                    t,
+                    fg.ALIGNMENT_TYPE_SPARSE_NON_MFV_ALIGNMENT,
+                    float(non_mfv_row_alignments[i]),
+                )
+        # keep tracking only the exact matches and alignments
+        xac.set_combinations(ris[exact_matches], tis[exact_matches], exact_match_strength[exact_matches])
+        sac.set_combinations(ris[alignments], tis[alignments], alignment[alignments])
+        xac.remove_combinations(Field_Alignment.combination_mask(xac, ris[~exact_matches], tis[~exact_matches]))
+        stop_tracking = ~(alignments | non_mfv_alignments)
+        sac.remove_combinations(Field_Alignment.combination_mask(sac, ris[stop_tracking], tis[stop_tracking]))
         return
 
     def update_exact_matches(self):
-        match_strength: float
         num_rows = self.num_rows
         xc = self.exact_match_combinations
-        remove_combinations = {}
         # xc.log_combinations()
-        for r in xc.get_ref_field_names():
-            for t in xc.get_target_field_names(r):
-                # check if match is > threshold
-                num_matches = xc.get_combination(r, t)
-                match_strength = num_matches / num_rows
-                if match_strength >= fg.FIELD_EXACT_MATCH_THRESHOLD:
-                    self.results.add_match(
-                        r, t, fg.ALIGNMENT_TYPE_EXACT_MATCH, match_strength
-                    )
-                else:
-                    # stop tracking - there is no alignment
-                    remove_combinations[r] = t
-        # remove the combinations that are not exact matches
-        for r in remove_combinations.keys():
-            xc.remove_combination(r, remove_combinations[r])
-
-    def find_field_alignment(self):
-        # first prepare the data frame for processing
-        # all remove duplicate rows
-        # self.deduped_df = self.df.drop_duplicates(
-        #     subset=self.join_field_names, keep=False
-        # )
-        self.deduped_df = self.df
-        self.num_rows = len(self.deduped_df)
-        logger.setLevel(logging.INFO)
-        if self.num_rows == 0:
-            logger.info("All rows are duplicates")
-            return
-        logger.setLevel(logging.DEBUG)
-        logger.info(
-            f"FALDISCO__DEBUG: Removed Duplicates. Remaining # rows: {self.num_rows}"
-        )
+        # check if match is > threshold for all combinations at once
+        match_strength = xc.strength / num_rows
+        matches = xc.state & (match_strength >= self.context.FIELD_EXACT_MATCH_THRESHOLD)
+        for ri, ti in zip(*np.nonzero(matches)):
+            self.results.add_match(
+                xc.ref_field_names[ri],
+                xc.target_field_names[ti],
+                fg.ALIGNMENT_TYPE_EXACT_MATCH,
+                float(match_strength[ri, ti]),
+            )
+        # stop tracking the combinations that are not exact matches
+        xc.remove_combinations(xc.state & ~matches)
 
-        # see what field combinations we can create
-        self.create_combinations(self.deduped_df)
+    def update_transform_matches(self):
+        tc = self.transform_match_combinations
+        for r, t in tc.get_combinations():
+            self.results.add_match(
+                r,
+                t,
+                fg.make_transform_alignment_type(self.transform_match_names[(r, t)]),
+                float(tc.get_combination(r, t)),
+            )
+
+    def find_field_alignment(
+            self, checkpoint: Faldisco_Checkpoint = None, stage: int = CHECKPOINT_STAGE_NONE
+    ):
+        # with a checkpoint, the state after every stage is saved; a resumed run passes the stage it restored
+        if stage < CHECKPOINT_STAGE_COMBINATIONS:
+            # first prepare the data frame for processing
+            # all remove duplicate rows
+            # self.deduped_df = self.df.drop_duplicates(
+            #     subset=self.join_field_names, keep=False
+            # )
+            self.deduped_df = self.df
+            self.num_rows = len(self.deduped_df)
+            logger.setLevel(logging.INFO)
+            if self.num_rows == 0:
+                logger.info("All rows are duplicates")
+                return
+            logger.setLevel(logging.DEBUG)
+            logger.info(
+                f"FALDISCO__DEBUG: Removed Duplicates. Remaining # rows: {self.num_rows}"
+            )
+
+            # see what field combinations we can create
+            with self.profile_stage("combinations"):
+                self.create_combinations(self.deduped_df)
+            if checkpoint is not None:
+                # spilled value matches must survive with the checkpoint
+                self.value_matches.spill_root = checkpoint.get_folder()
+                self.sparse_value_matches.spill_root = checkpoint.get_folder()
+            self.save_checkpoint(checkpoint, CHECKPOINT_STAGE_COMBINATIONS)
 
         # check if there are any combinations left to check
-        num_combinations = (
-                self.alignment_combinations.num_combinations()
-                + self.exact_match_combinations.num_combinations()
-                + self.sparse_alignment_combinations.num_combinations()
-        )
+        num_combinations = self.num_combinations()
 
         logger.info(
             f"FALDISCO__DEBUG: Created combinations. total # combinations: {num_combinations}"
         )
-        if num_combinations == 0:
+        if num_combinations == 0 and not self.has_transform_fields():
             # nothing to evaluate
             return 0
 
         # Ok - we have good rows and good combinations, process the rows
-        self.process_rows(self.deduped_df)
+        self.process_rows(self.deduped_df, checkpoint, max(stage, CHECKPOINT_STAGE_COMBINATIONS))
 
         # self.exact_match_combinations.log_combinations()
-        # check field alignments and create a data frame with results (field_alignments_df)
+        return self.score_results()
+
+    # transforms are tried on every transformable pair, also when no combination survived the profiles - hashed
+    # or normalized copies of unique fields have value ranges that do not overlap with their originals
+    def has_transform_fields(self) -> bool:
+        ref_field_names, target_field_names = self.get_transform_field_names()
+        return self.context.FALDISCO_TRANSFORMS and len(ref_field_names) > 0 and len(target_field_names) > 0
+
+    def num_combinations(self) -> int:
+        return (
+                self.alignment_combinations.num_combinations()
+                + self.exact_match_combinations.num_combinations()
+                + self.sparse_alignment_combinations.num_combinations()
+        )
+
+    def score_results(self) -> int:
+        # check field alignments and create a data frame with results (field_alignments_df); value alignments are
+        # written out as every result is added
+        value_alignment_writer = Value_Alignment_Writer(
+            Value_Alignment_Writer.get_path(self.ref_table_name, self.target_table_name), self.context
+        )
         self.results = Faldisco_Results(
             self.field_profiles,
             self.ref_table_namespace,
@@ -676,132 +920,282 @@ class Field_Alignment:
             self.target_table_namespace,
             self.target_table_name,
             self.value_matches,
-            self.alignment_values_df,
+            self.sparse_value_matches,
+            value_alignment_writer,
+            self.context,
         )
 
-        self.update_alignments()
-        self.update_exact_matches()
-        self.update_sparse_alignments()
-        self.results_df = self.results.dedup_results()
+        with self.profile_stage("results"):
+            self.update_alignments()
+            self.update_exact_matches()
+            self.update_sparse_alignments()
+            self.update_transform_matches()
+            try:
+                self.results_df = self.results.dedup_results()
+            except Exception:
+                value_alignment_writer.abort()
+                raise
+            self.num_value_alignments = value_alignment_writer.close()
+        self.value_matches.cleanup()
+        self.sparse_value_matches.cleanup()
         num_result_rows = len(self.results_df)
         logger.info(f"FALDISCO__DEBUG: Processed results: {num_result_rows}")
         return num_result_rows
 
+    def get_match_strengths(self) -> {(str, str, str): float}:
+        # strength of every match of the counted rows by (ref field, target field, alignment type), before the
+        # matches are ranked and without writing value alignments. Stops tracking the combinations that do not
+        # match, like the scoring of results does
+        self.results = Faldisco_Results(
+            self.field_profiles,
+            self.ref_table_namespace,
+            self.ref_table_name,
+            self.target_table_namespace,
+            self.target_table_name,
+            self.value_matches,
+            self.sparse_value_matches,
+            None,
+            self.context,
+        )
+        self.update_alignments()
+        self.update_exact_matches()
+        self.update_sparse_alignments()
+        self.update_transform_matches()
+        return {
+            (fg.make_orig_field_name(r), fg.make_orig_field_name(t), alignment_type): alignment_strength
+            for t, ref_fields in self.results.potential_matches.items()
+            for r, alignments in ref_fields.items()
+            for alignment_type, alignment_strength in alignments.items()
+        }
+
+    def copy_plan(self) -> "Field_Alignment":
+        # a run of the same profiles and combinations without rows and counts, to count other rows - like another
+        # partition - with. The shared sample is not copied
+        fa = Field_Alignment.__new__(Field_Alignment)
+        fa.__dict__.update(
+            copy.deepcopy(
+                {
+                    k: v
+                    for k, v in self.__dict__.items()
+                    if k not in ("df", "deduped_df", "sample", "sample_rows", "profiler")
+                }
+            )
+        )
+        fa.df = None
+        fa.deduped_df = None
+        fa.sample = self.sample
+        fa.sample_rows = None
+        fa.profiler = None
+        return fa
+
+    # the additive state of a counted run: its number of rows, value matches, exact match counts and transform
+    # counts. The counts of runs of the same plan on different rows add up to the counts of all their rows
+    def get_counts(self) -> (int, Value_Matches, Value_Matches, np.ndarray, {str: {str: np.ndarray}}):
+        return (
+            self.num_rows,
+            self.value_matches,
+            self.sparse_value_matches,
+            self.exact_match_combinations.strength.copy(),
+            self.transform_counts,
+        )
+
+    def add_counts(
+            self, counts: (int, Value_Matches, Value_Matches, np.ndarray, {str: {str: np.ndarray}})
+    ):
+        num_rows, value_matches, sparse_value_matches, exact_match_counts, transform_counts = counts
+        self.num_rows += num_rows
+        self.value_matches.merge(value_matches)
+        self.sparse_value_matches.merge(sparse_value_matches)
+        value_matches.cleanup()
+        sparse_value_matches.cleanup()
+        xc = self.exact_match_combinations
+        xc.strength[xc.state] += exact_match_counts[xc.state]
+        for r, counts_by_name in transform_counts.items():
+            if r not in self.transform_counts:
+                self.transform_counts[r] = {name: c.copy() for name, c in counts_by_name.items()}
+                continue
+            for name, c in counts_by_name.items():
+                self.transform_counts[r][name] += c
+
+    def release(self):
+        # drop the rows and value counts of a finished run and keep its profiles and results, so runs that are
+        # kept around after they finish - a batch of pairs - do not hold on to their samples
+        self.df = None
+        self.deduped_df = None
+        self.sample_rows = None
+        self.db_profiles = {}
+        self.value_matches = None
+        self.sparse_value_matches = None
+        self.results = None
+
     # combine reference table and target table on alignment key
     # rename all ref fields r__ field name
     # rename all target fields t__ field name
     # to avoid name collissions
+    # with partitions, both the key_counts CTE and the main join only read the partition of each side
     def gen_sql(self) -> str:
         ojk = self.orig_join_field_names[0]
         rjk = self.join_field_names[0]
-        sql_statement = f"""
-            with key_counts as (select r.{ojk}, count(*) as numrows 
-            from {self.ref_table_namespace}.{self.ref_table_name} r join 
-            {self.target_table_namespace}.{self.target_table_name} t on 
-            r.{ojk} = t.{ojk}  
-            group by r.{ojk}) select r.{ojk} as {rjk} 
-            """
+        partition_predicates = self.gen_partition_predicates()
+        sql_statement = f"{self.gen_key_counts_sql()} select r.{ojk} as {rjk} "
 
+        # fetch values with their native types - NULLs and empty strings are masked after loading
         for c in self.orig_ref_field_names:
-            sql_statement = (
-                    sql_statement
-                    + f""", case when (r.{c} is null) then 'FALDISCO_NULL' 
-                        when cast(r.{c} as char) = '' then 'FALDISCO_EMPTY' 
-                        else cast(r.{c} as char) end 
-                        as r__{c}
-                        """
-            )
+            sql_statement = sql_statement + f", r.{c} as r__{c}"
         for c in self.orig_target_field_names:
-            sql_statement = (
-                    sql_statement
-                    + f""", case when (t.{c} is null) then 'FALDISCO_NULL' 
-                       when cast(t.{c} as char) = '' then  'FALDISCO_EMPTY' 
-                       else cast(t.{c} as char) end 
-                       as t__{c}
-                  """
-            )
-            # sql_statement = sql_statement + f", t.{c} as t__{c}"
+            sql_statement = sql_statement + f", t.{c} as t__{c}"
         sql_statement = (
                 sql_statement
                 + f" from {self.ref_table_namespace}.{self.ref_table_name} r join "
                 + f"{self.target_table_namespace}.{self.target_table_name} t on "
                 + f"r.{ojk} = t.{ojk}"
                 + f" join key_counts k on r.{ojk} = k.{ojk}"
-                + f" where  k.numrows >= {fg.KEY_MIN_VALUE_COUNT} and k.numrows <= {fg.KEY_MAX_VALUE_COUNT}"
-                + f" LIMIT {fg.SAMPLE_SIZE}"
+                + f" where {self.gen_key_count_predicate()}"
+                + "".join(f" and {p}" for p in partition_predicates)
+                + f" LIMIT {self.context.SAMPLE_SIZE}"
         )
         return sql_statement
 
-    def profiles_to_df(
-            self,
-            profiling_table_fields: [str],
-    ) -> pd.DataFrame:
-        df = DataFrame(columns=profiling_table_fields)
-        row_num = 0
-        for r in self.ref_field_names:
-            self.add_profile_field_to_df(
-                df, row_num, self.ref_table_namespace, self.ref_table_name, r
-            )
-            row_num += 1
+    # the number of joined rows of every key, in the partitions of both sides
+    def gen_key_counts_sql(self) -> str:
+        ojk = self.orig_join_field_names[0]
+        partition_predicates = self.gen_partition_predicates()
+        partition_where = f"where {' and '.join(partition_predicates)}" if partition_predicates else ""
+        return f"""
+            with key_counts as (select r.{ojk}, count(*) as numrows 
+            from {self.ref_table_namespace}.{self.ref_table_name} r join 
+            {self.target_table_namespace}.{self.target_table_name} t on 
+            r.{ojk} = t.{ojk} {partition_where}
+            group by r.{ojk})"""
+
+    def gen_key_count_predicate(self) -> str:
+        return (
+            f"k.numrows >= {self.context.KEY_MIN_VALUE_COUNT} and k.numrows <= {self.context.KEY_MAX_VALUE_COUNT}"
+        )
+
+    def gen_partition_predicates(self) -> [str]:
+        return Partition_Pruning.gen_predicates("r", self.ref_partition) + Partition_Pruning.gen_predicates(
+            "t", self.target_partition
+        )
+
+    # slices are assembled by key, so only samples with one row per key - a key count limit of 1 - are sliced
+    def is_sliced(self) -> bool:
+        return (
+                0 < self.context.FALDISCO_SLICE_COLUMNS < len(self.ref_field_names) + len(self.target_field_names)
+                and self.context.KEY_MAX_VALUE_COUNT <= 1
+        )
+
+    # key sample of sliced queries, over the key_counts of gen_key_counts_sql: the keys gen_sql samples, with the
+    # same key count limits, ordered by key so that every slice selects the same keys (gen_sql takes any
+    # SAMPLE_SIZE rows)
+    def gen_keys_sql(self) -> str:
+        ojk = self.orig_join_field_names[0]
+        return (
+                f"select k.{ojk} from key_counts k"
+                + f" where {self.gen_key_count_predicate()}"
+                + f" order by k.{ojk} LIMIT {self.context.SAMPLE_SIZE}"
+        )
+
+    # one query per vertical slice of at most FALDISCO_SLICE_COLUMNS ref or target columns, instead of one
+    # query with every column of both tables. Every slice joins its table to the key sample, like
+    # Table_Sample.gen_other_sql, so the length of a query does not grow with SAMPLE_SIZE either
+    def gen_slice_sqls(self) -> [str]:
+        ojk = self.orig_join_field_names[0]
+        rjk = self.join_field_names[0]
+        size = self.context.FALDISCO_SLICE_COLUMNS
+        queries = []
+        for table_namespace, table_name, partition, field_names, field_prefix in (
+                (
+                    self.ref_table_namespace,
+                    self.ref_table_name,
+                    self.ref_partition,
+                    self.orig_ref_field_names,
+                    "r__",
+                ),
+                (
+                    self.target_table_namespace,
+                    self.target_table_name,
+                    self.target_partition,
+                    self.orig_target_field_names,
+                    "t__",
+                ),
+        ):
+            for start in range(0, len(field_names), size):
+                sql_statement = f"{self.gen_key_counts_sql()} select s.{ojk} as {rjk}"
+                for c in field_names[start:start + size]:
+                    sql_statement = sql_statement + f", s.{c} as {field_prefix}{c}"
+                sql_statement = (
+                        sql_statement
+                        + f" from {table_namespace}.{table_name} s"
+                        + f" join ({self.gen_keys_sql()}) k on s.{ojk} = k.{ojk}"
+                        + Partition_Pruning.gen_where("s", partition)
+                        + f" order by s.{ojk}"
+                )
+                queries.append(sql_statement)
+        return queries
+
+    # add a fetched slice to the sample, aligned by key to the first slice, and profile its fields while the
+    # next slices are fetched
+    def add_slice(self, slices: [DataFrame], slice_df: DataFrame):
+        rjk = self.join_field_names[0]
+        if len(slices) == 0:
+            slice_df = slice_df.reset_index(drop=True)
+        else:
+            keys = slices[0][rjk]
+            slice_df = slice_df.set_index(rjk).reindex(keys).reset_index(drop=True)
+        field_names = [c for c in slice_df.columns if c != rjk]
+        self.num_rows = len(slice_df)
+        self.profile_fields(slice_df, field_names)
+        self.profiled_field_names.update(field_names)
+        slices.append(slice_df)
 
-        # now the target table
-        for t in self.target_field_names:
-            self.add_profile_field_to_df(
-                df, row_num, self.target_table_namespace, self.target_table_name, t
+    def set_slices(self, slices: [DataFrame]):
+        self.df = pd.concat(slices, axis=1)
+
+    # select the rows of the other side with the keys of the shared sample; they are joined to the sample in
+    # join_sample, so the shared table is not read again
+    def gen_sample_sql(self, other_join_field_names: [str] = None) -> str:
+        if self.sample.is_reference():
+            return self.sample.gen_other_sql(
+                self.target_table_namespace,
+                self.target_table_name,
+                other_join_field_names,
+                self.orig_target_field_names,
+                "t__",
+                self.target_partition,
             )
-            row_num += 1
-        return df
+        return self.sample.gen_other_sql(
+            self.ref_table_namespace,
+            self.ref_table_name,
+            other_join_field_names,
+            self.orig_ref_field_names,
+            "r__",
+            self.ref_partition,
+        )
+
+    # join the rows of the other side to the shared sample on the key, with the same key count limits as gen_sql
+    def join_sample(self, other_df: DataFrame):
+        sjk = self.sample.join_field_names[0]
+        sample_df = self.sample.df
+        keys = DataFrame(
+            {sjk: sample_df[sjk], SAMPLE_ROW_FIELD_NAME: np.arange(len(sample_df))}
+        )
+        joined = keys.merge(other_df, on=sjk)
+        key_counts = joined.groupby(sjk)[sjk].transform("size")
+        joined = joined[
+            (key_counts >= self.context.KEY_MIN_VALUE_COUNT) & (key_counts <= self.context.KEY_MAX_VALUE_COUNT)
+        ].head(self.context.SAMPLE_SIZE).reset_index(drop=True)
+        self.sample_rows = joined[SAMPLE_ROW_FIELD_NAME].to_numpy()
+        columns = {self.join_field_names[0]: joined[sjk]}
+        for c in self.ref_field_names + self.target_field_names:
+            if self.is_sample_field(c):
+                columns[c] = sample_df[c].iloc[self.sample_rows].reset_index(drop=True)
+            else:
+                columns[c] = joined[c]
+        self.df = DataFrame(columns)
 
-    def add_profile_field_to_df(
+    def profiles_to_df(
             self,
-            df: DataFrame,
-            row_num: int,
-            table_namespace: str,
-            table_name: str,
-            field_name: str
-    ) -> None:
-        fp = self.field_profiles[field_name]
-        original_field_name = fg.make_orig_field_name(field_name)
-        if fp.is_unique_field():
-            is_unique = "y"
-        else:
-            is_unique = "n"
-        if fp.is_sparse_field():
-            is_sparse = "y"
-        else:
-            is_sparse = "n"
-        if fp.is_constant_field():
-            is_constant = "y"
-        else:
-            is_constant = "n"
-
-        df.loc[row_num] = [
-            # "table_namespace",
-            table_namespace,
-            # "table_name",
-            table_name,
-            # "field_name",
-            original_field_name,
-            # "cardinality",
-            fp.get_field_cardinality(),
-            # "selectivity",
-            fp.get_field_selectivity(),
-            # "min",
-            fp.get_field_min_val(),
-            # "max",
-            fp.get_field_max_val(),
-            # "min_len",
-            fp.get_field_min_len(),
-            # "max_len",
-            fp.get_field_max_len(),
-            # "mfv_count",
-            fp.get_field_mfv_count(),
-            # "num_rows",
-            fp.get_num_rows(),
-            # "is_unique",
-            is_unique,
-            # "is_sparse",
-            is_sparse,
-            # "is_constant",
-            is_constant,
-        ]
+            profiling_table_fields: [str],
+    ) -> pd.DataFrame:
+        return self.field_profiles.to_df(profiling_table_fields)
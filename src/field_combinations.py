@@ -9,107 +9,167 @@
 
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 
+# dense R x T matrix of (ref field, target field) combinations, indexed by field ids:
+# - state[r, t] is True while the combination is tracked
+# - strength[r, t] is its alignment strength (or number of matches)
 class Field_Combinations:
-    combinations: {}
-    ref_fields: {str}  # list of ref_fields with counts of target fields
-    target_fields: {str}  # list of target fields with counts of ref fields
     name: str
-
-    def __init__(self, name: str):
+    ref_field_names: [str]
+    target_field_names: [str]
+    ref_field_ids: {str: int}
+    target_field_ids: {str: int}
+    state: np.ndarray
+    strength: np.ndarray
+    ref_fields: np.ndarray  # number of target fields for each ref field
+    target_fields: np.ndarray  # number of ref fields for each target field
+    count: int
+
+    def __init__(self, name: str, ref_field_names: [str], target_field_names: [str]):
         self.name = name
-        self.combinations = {}
-        self.ref_fields = {}
-        self.target_fields = {}
+        self.ref_field_names = list(ref_field_names)
+        self.target_field_names = list(target_field_names)
+        self.ref_field_ids = {f: i for i, f in enumerate(self.ref_field_names)}
+        self.target_field_ids = {f: i for i, f in enumerate(self.target_field_names)}
+        shape = (len(self.ref_field_names), len(self.target_field_names))
+        self.state = np.zeros(shape, dtype=bool)
+        self.strength = np.zeros(shape, dtype=np.float64)
+        self.ref_fields = np.zeros(shape[0], dtype=np.int64)
+        self.target_fields = np.zeros(shape[1], dtype=np.int64)
+        self.count = 0
         return
 
+    def get_ids(self, ref_field_name: str, target_field_name: str) -> (int, int):
+        return (
+            self.ref_field_ids[ref_field_name],
+            self.target_field_ids[target_field_name],
+        )
+
+    def get_ref_field_ids(self, ref_field_names: [str]) -> np.ndarray:
+        return np.array([self.ref_field_ids[f] for f in ref_field_names], dtype=np.int64)
+
+    def get_target_field_ids(self, target_field_names: [str]) -> np.ndarray:
+        return np.array(
+            [self.target_field_ids[f] for f in target_field_names], dtype=np.int64
+        )
+
+    def activate(self, ri: int, ti: int):
+        if not self.state[ri, ti]:
+            # new combination - increment counts
+            self.state[ri, ti] = True
+            self.ref_fields[ri] += 1
+            self.target_fields[ti] += 1
+            self.count += 1
+
     def increment_combination(
             self, ref_field_name: str, target_field_name: str, val: float
     ):
-        tfs = self.get_target_fields(ref_field_name)
-        if target_field_name not in tfs.keys():
-            # new combination - increment counts
-            self.increment_ref_field_count(ref_field_name)
-            self.increment_target_field_count(target_field_name)
-            tfs[target_field_name] = val
+        ri, ti = self.get_ids(ref_field_name, target_field_name)
+        if not self.state[ri, ti]:
+            self.activate(ri, ti)
+            self.strength[ri, ti] = val
         else:
-            tfs[target_field_name] += val
+            self.strength[ri, ti] += val
 
     def get_combination(self, ref_field_name: str, target_field_name: str):
-        tfs = self.get_target_fields(ref_field_name)
-        if target_field_name not in tfs.keys():
-            tfs[target_field_name] = 0.0
-        return tfs[target_field_name]
-
-    def adjust_field_count(self, field_counts: {}, field_name: str, adjustment: int):
-        if field_name not in field_counts.keys():
-            field_counts[field_name] = 0
-        field_counts[field_name] += adjustment
-
-    def increment_ref_field_count(self, ref_field_name: str):
-        self.adjust_field_count(self.ref_fields, ref_field_name, 1)
-
-    def decrement_ref_field_count(self, ref_field_name: str):
-        self.adjust_field_count(self.ref_fields, ref_field_name, -1)
-
-    def increment_target_field_count(self, target_field_name: str):
-        self.adjust_field_count(self.target_fields, target_field_name, 1)
-
-    def decrement_target_field_count(self, target_field_name: str):
-        self.adjust_field_count(self.target_fields, target_field_name, -1)
+        ri, ti = self.get_ids(ref_field_name, target_field_name)
+        return self.strength[ri, ti]
 
     def set_combination(
             self, ref_field_name: str, target_field_name: str, value: float
     ):
-        tfs = self.get_target_fields(ref_field_name)
-        if target_field_name not in tfs.keys():
-            # new combination - increment counts
-            self.increment_ref_field_count(ref_field_name)
-            self.increment_target_field_count(target_field_name)
-        tfs[target_field_name] = value
+        ri, ti = self.get_ids(ref_field_name, target_field_name)
+        self.activate(ri, ti)
+        self.strength[ri, ti] = value
 
     def remove_combination(self, ref_field_name: str, target_field_name: str):
-        if ref_field_name in self.combinations.keys():
-            tfs = self.get_target_fields(ref_field_name)
-            if target_field_name in tfs.keys():
-                tfs.pop(target_field_name)
-                self.decrement_target_field_count(target_field_name)
-                self.decrement_ref_field_count(ref_field_name)
+        ri, ti = self.get_ids(ref_field_name, target_field_name)
+        if self.state[ri, ti]:
+            self.state[ri, ti] = False
+            self.strength[ri, ti] = 0.0
+            self.ref_fields[ri] -= 1
+            self.target_fields[ti] -= 1
+            self.count -= 1
 
     def check_combination(self, ref_field_name: str, target_field_name: str) -> bool:
-        if ref_field_name in self.combinations.keys():
-            if target_field_name in self.combinations[ref_field_name].keys():
-                return True
+        if (
+                ref_field_name in self.ref_field_ids
+                and target_field_name in self.target_field_ids
+        ):
+            ri, ti = self.get_ids(ref_field_name, target_field_name)
+            return bool(self.state[ri, ti])
         return False
 
-    def get_target_field_names(self, ref_field_name: str) -> {}:
-        target_fields = self.get_target_fields(ref_field_name)
-        return target_fields.keys()
+    def get_target_field_names(self, ref_field_name: str) -> [str]:
+        ri = self.ref_field_ids[ref_field_name]
+        return [self.target_field_names[ti] for ti in np.flatnonzero(self.state[ri])]
+
+    def get_ref_field_names(self) -> [str]:
+        return [self.ref_field_names[ri] for ri in np.flatnonzero(self.ref_fields)]
 
-    def get_target_fields(self, ref_field_name: str) -> {}:
-        if ref_field_name not in self.combinations.keys():
-            self.combinations[ref_field_name] = {}
-        return self.combinations[ref_field_name]
+    def get_combinations(self) -> [(str, str)]:
+        # all tracked (ref field, target field) combinations, ordered by ref field, then target field
+        ris, tis = np.nonzero(self.state)
+        return [
+            (self.ref_field_names[ri], self.target_field_names[ti])
+            for ri, ti in zip(ris, tis)
+        ]
 
-    def get_ref_field_names(self) -> {}:
-        return self.combinations.keys()
+    def get_combination_ids(self) -> (np.ndarray, np.ndarray):
+        # ref and target field ids of all tracked combinations, in the same order as get_combinations
+        return np.nonzero(self.state)
+
+    def set_combinations(self, ref_field_ids: np.ndarray, target_field_ids: np.ndarray, values: np.ndarray):
+        self.state[ref_field_ids, target_field_ids] = True
+        self.strength[ref_field_ids, target_field_ids] = values
+        self.update_counts()
 
     def add_combination(self, ref_field_name: str, target_field_name: str):
         self.set_combination(ref_field_name, target_field_name, 0.0)
 
+    def update_counts(self):
+        self.ref_fields = self.state.sum(axis=1)
+        self.target_fields = self.state.sum(axis=0)
+        self.count = int(self.ref_fields.sum())
+
+    def add_combinations(
+            self,
+            ref_field_names: [str],
+            target_field_names: [str],
+            mask: np.ndarray = None,
+    ):
+        # add all combinations of ref_field_names x target_field_names, or only the ones selected by mask
+        if len(ref_field_names) == 0 or len(target_field_names) == 0:
+            return
+        cells = np.ix_(
+            self.get_ref_field_ids(ref_field_names),
+            self.get_target_field_ids(target_field_names),
+        )
+        if mask is None:
+            mask = np.ones((len(ref_field_names), len(target_field_names)), dtype=bool)
+        new = mask & ~self.state[cells]
+        self.strength[cells] = np.where(new, 0.0, self.strength[cells])
+        self.state[cells] |= mask
+        self.update_counts()
+
+    def remove_combinations(self, mask: np.ndarray):
+        # mask is R x T over all ref and target fields
+        self.state &= ~mask
+        self.strength[mask] = 0.0
+        self.update_counts()
+
+    def below_threshold(self, threshold: float) -> np.ndarray:
+        # tracked combinations with strength < threshold
+        return self.state & (self.strength < threshold)
+
     def num_combinations(self) -> int:
-        cc = 0
-        for r in self.combinations:
-            # add up number of target fields for each reference field
-            cc += self.ref_fields[r]
-        return cc
+        return self.count
 
     def log_combinations(self):
-        ref_field_names = self.get_ref_field_names()
-        for r in ref_field_names:
-            target_field_names = self.get_target_field_names(r)
-            for t in target_field_names:
-                val = self.get_combination(r, t)
-                logger.info(f"FALDISCO__DEBUG: logging {self.name}: {r}, {t} = {val}")
+        for r, t in self.get_combinations():
+            val = self.get_combination(r, t)
+            logger.info(f"FALDISCO__DEBUG: logging {self.name}: {r}, {t} = {val}")
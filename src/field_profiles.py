@@ -9,10 +9,28 @@
 
 import logging
 
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
 import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
 
 logger = logging.getLogger(__name__)
 
+# max number of (ref, target) cells evaluated at once when generating exact match candidates
+EXACT_MATCH_CANDIDATES_BLOCK_CELLS = 1 << 22
+# max number of (value, hash function) cells evaluated at once when sketching a field
+SIGNATURE_BLOCK_CELLS = 1 << 22
+SIGNATURE_SEEDS = np.random.default_rng(0x5EED).integers(
+    0, np.iinfo(np.uint64).max, size=fg.FIELD_SKETCH_SIZE, dtype=np.uint64, endpoint=True
+)
+
+# how values of a field are compared: numbers and datetimes natively, everything else by its text
+VALUE_KIND_TEXT = "text"
+VALUE_KIND_NUMBER = "number"
+VALUE_KIND_DATETIME = "datetime"
+
 
 class Field_Profiles:
     cardinality: int
@@ -24,6 +42,8 @@ class Field_Profiles:
     min_val: str
     max_val: str
     mfv: str
+    value_kind: str
+    from_db: bool  # computed by the database - lengths and min/max values are the database's
 
     def __init__(
             self,
@@ -36,6 +56,8 @@ class Field_Profiles:
             min_val: str,
             max_val: str,
             mfv: str,
+            value_kind: str = VALUE_KIND_TEXT,
+            from_db: bool = False,
     ):
         self.num_rows = num_rows
         self.cardinality = cardinality
@@ -47,6 +69,8 @@ class Field_Profiles:
         self.min_val = min_val
         self.max_val = max_val
         self.mfv = mfv
+        self.value_kind = value_kind
+        self.from_db = from_db
 
     def set_num_rows(self, num_rows: int):
         self.num_rows = num_rows
@@ -75,6 +99,9 @@ class Field_Profiles:
     def set_mfv(self, mfv):
         self.mfv = mfv
 
+    def set_field_value_kind(self, value_kind):
+        self.value_kind = value_kind
+
     def get_field_cardinality(self):
         return self.cardinality
 
@@ -102,41 +129,48 @@ class Field_Profiles:
     def get_field_mfv(self) -> str:
         return self.mfv
 
-    def is_constant_field(self):
+    def is_from_db(self) -> bool:
+        return self.from_db
+
+    def get_field_value_kind(self) -> str:
+        return self.value_kind
+
+    # classification by the thresholds of a run's context
+    def is_constant_field(self, context: Faldisco_Context):
         # if the field only has one value - easy, it is constant
         if self.get_field_cardinality() <= 1:
             return True
         # if the field has one value that takes up most rows > CONSTANT_VALUE_THRESHOLD, it is constant
         elif (
                 self.get_field_mfv_count() / self.get_num_rows()
-                > fg.CONSTANT_VALUE_THRESHOLD
+                > context.CONSTANT_VALUE_THRESHOLD
         ):
             return True
         else:
             return False
 
-    def is_sparse_field(self):
+    def is_sparse_field(self, context: Faldisco_Context):
         # if the field only has one value - easy, it is constant
-        if self.is_constant_field():
+        if self.is_constant_field(context):
             return False
         # if the field has one value that takes up most rows > SPARSE_VALUE_THRESHOLD, it is constant
         elif (
-                self.get_field_mfv_count() / self.get_num_rows() > fg.SPARSE_VALUE_THRESHOLD
+                self.get_field_mfv_count() / self.get_num_rows() > context.SPARSE_VALUE_THRESHOLD
         ):
             return True
         else:
             return False
 
-    def is_unique_field(self):
+    def is_unique_field(self, context: Faldisco_Context):
         # if the field has selectivity of 1 - it is unique
-        if self.get_field_selectivity() > fg.UNIQUE_SELECTIVIY_THRESHOLD:
+        if self.get_field_selectivity() > context.UNIQUE_SELECTIVIY_THRESHOLD:
             return True
         # if we take out the most frequent value and the field becomes unique, consider it unique
         elif (self.get_num_rows() - self.get_field_mfv_count()) > 0 and (
                 self.get_field_cardinality() - 1
         ) / (
                 self.get_num_rows() - self.get_field_mfv_count()
-        ) > fg.UNIQUE_SELECTIVIY_THRESHOLD:
+        ) > context.UNIQUE_SELECTIVIY_THRESHOLD:
             return True
         return False
 
@@ -144,3 +178,414 @@ class Field_Profiles:
         return ("field_profile:" +
                 f"num_rows:{self.num_rows}, cardinality: {self.cardinality}, selectivity:{self.selectivity}, min_len:{self.min_len}" +
                 f"max_len:{self.max_len}, min_val:{self.min_val}, max_val:{self.max_val}")
+
+
+# columnar store of field profiles - one array per statistic, indexed by field id. The classification flags
+# (constant, sparse, unique) are computed once for all fields by classify_fields instead of on every call
+class Field_Profiles_Store:
+    context: Faldisco_Context
+    field_names: [str]
+    field_ids: {str: int}
+    table_namespaces: np.ndarray
+    table_names: np.ndarray
+    num_rows: np.ndarray
+    cardinality: np.ndarray
+    selectivity: np.ndarray
+    mfv_count: np.ndarray
+    min_len: np.ndarray
+    max_len: np.ndarray
+    min_val: np.ndarray
+    max_val: np.ndarray
+    mfv: np.ndarray
+    value_kinds: np.ndarray
+    from_db: np.ndarray
+    is_constant: np.ndarray
+    is_sparse: np.ndarray
+    is_unique: np.ndarray
+    signatures: np.ndarray  # minhash signature of every field, one row per field
+
+    def __init__(
+            self,
+            field_names: [str],
+            table_namespaces: [str],
+            table_names: [str],
+            context: Faldisco_Context = None,
+    ):
+        self.context = context if context is not None else Faldisco_Context()
+        num_fields = len(field_names)
+        self.field_names = list(field_names)
+        self.field_ids = {f: i for i, f in enumerate(self.field_names)}
+        self.table_namespaces = np.array(table_namespaces, dtype=object)
+        self.table_names = np.array(table_names, dtype=object)
+        self.num_rows = np.zeros(num_fields, dtype=np.int64)
+        self.cardinality = np.zeros(num_fields, dtype=np.int64)
+        self.selectivity = np.zeros(num_fields, dtype=np.float64)
+        self.mfv_count = np.zeros(num_fields, dtype=np.int64)
+        self.min_len = np.full(num_fields, -1, dtype=np.int64)
+        self.max_len = np.full(num_fields, -1, dtype=np.int64)
+        self.min_val = np.full(num_fields, None, dtype=object)
+        self.max_val = np.full(num_fields, None, dtype=object)
+        self.mfv = np.full(num_fields, None, dtype=object)
+        self.value_kinds = np.full(num_fields, VALUE_KIND_TEXT, dtype=object)
+        self.from_db = np.zeros(num_fields, dtype=bool)
+        self.is_constant = np.zeros(num_fields, dtype=bool)
+        self.is_sparse = np.zeros(num_fields, dtype=bool)
+        self.is_unique = np.zeros(num_fields, dtype=bool)
+        self.signatures = np.full(
+            (num_fields, fg.FIELD_SKETCH_SIZE), np.iinfo(np.uint64).max, dtype=np.uint64
+        )
+
+    def get_field_id(self, field_name: str) -> int:
+        return self.field_ids[field_name]
+
+    def get_field_ids(self, field_names: [str]) -> np.ndarray:
+        return np.array([self.field_ids[f] for f in field_names], dtype=np.int64)
+
+    def set_profile(self, field_name: str, fp: Field_Profiles):
+        i = self.field_ids[field_name]
+        self.num_rows[i] = fp.get_num_rows()
+        self.cardinality[i] = fp.get_field_cardinality()
+        self.selectivity[i] = fp.get_field_selectivity()
+        self.mfv_count[i] = fp.get_field_mfv_count()
+        self.min_len[i] = fp.get_field_min_len()
+        self.max_len[i] = fp.get_field_max_len()
+        self.min_val[i] = fp.get_field_min_val()
+        self.max_val[i] = fp.get_field_max_val()
+        self.mfv[i] = fp.get_field_mfv()
+        self.value_kinds[i] = fp.get_field_value_kind()
+        self.from_db[i] = fp.is_from_db()
+
+    def get_profile(self, field_name: str) -> Field_Profiles:
+        i = self.field_ids[field_name]
+        return Field_Profiles(
+            int(self.num_rows[i]),
+            int(self.cardinality[i]),
+            float(self.selectivity[i]),
+            int(self.mfv_count[i]),
+            int(self.min_len[i]),
+            int(self.max_len[i]),
+            self.min_val[i],
+            self.max_val[i],
+            self.mfv[i],
+            self.value_kinds[i],
+            bool(self.from_db[i]),
+        )
+
+    def __getitem__(self, field_name: str) -> Field_Profiles:
+        return self.get_profile(field_name)
+
+    def __contains__(self, field_name: str) -> bool:
+        return field_name in self.field_ids
+
+    def keys(self) -> [str]:
+        return self.field_names
+
+    def classify_fields(self):
+        # same rules as Field_Profiles.is_constant_field, is_sparse_field and is_unique_field, for all fields at once
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mfv_ratio = self.mfv_count / self.num_rows
+            non_mfv_rows = self.num_rows - self.mfv_count
+            non_mfv_selectivity = (self.cardinality - 1) / non_mfv_rows
+        self.is_constant = (self.cardinality <= 1) | (
+                mfv_ratio > self.context.CONSTANT_VALUE_THRESHOLD
+        )
+        self.is_sparse = ~self.is_constant & (mfv_ratio > self.context.SPARSE_VALUE_THRESHOLD)
+        self.is_unique = (self.selectivity > self.context.UNIQUE_SELECTIVIY_THRESHOLD) | (
+                (non_mfv_rows > 0)
+                & (non_mfv_selectivity > self.context.UNIQUE_SELECTIVIY_THRESHOLD)
+        )
+
+    def is_constant_field(self, field_name: str) -> bool:
+        return bool(self.is_constant[self.field_ids[field_name]])
+
+    def is_sparse_field(self, field_name: str) -> bool:
+        return bool(self.is_sparse[self.field_ids[field_name]])
+
+    def is_unique_field(self, field_name: str) -> bool:
+        return bool(self.is_unique[self.field_ids[field_name]])
+
+    def get_field_cardinality(self, field_name: str) -> int:
+        return int(self.cardinality[self.field_ids[field_name]])
+
+    def get_field_selectivity(self, field_name: str) -> float:
+        return float(self.selectivity[self.field_ids[field_name]])
+
+    def get_field_mfv(self, field_name: str) -> str:
+        return self.mfv[self.field_ids[field_name]]
+
+    def get_field_value_kind(self, field_name: str) -> str:
+        return self.value_kinds[self.field_ids[field_name]]
+
+    def is_text_field(self, field_name: str) -> bool:
+        return self.get_field_value_kind(field_name) == VALUE_KIND_TEXT
+
+    def is_text_combination(self, ref_field_name: str, target_field_name: str) -> bool:
+        # values of a combination are compared natively only when both fields are numbers or both are datetimes -
+        # an integer 28 and a varchar "28" are the same value by their text
+        kind = self.get_field_value_kind(ref_field_name)
+        return kind == VALUE_KIND_TEXT or kind != self.get_field_value_kind(target_field_name)
+
+    def get_combination_mfv(self, field_name: str, other_field_name: str):
+        # the mfv of a field as its values are encoded in a combination with other_field_name
+        mfv = self.get_field_mfv(field_name)
+        if mfv is not None and not self.is_text_field(field_name) and self.is_text_combination(
+                field_name, other_field_name
+        ):
+            return Field_Profiles_Store.value_text(mfv)
+        return mfv
+
+    @staticmethod
+    def profile_values(values: pd.Series, num_rows: int) -> Field_Profiles:
+        value_kind = Field_Profiles_Store.value_kind(values)
+        null, empty = Field_Profiles_Store.value_masks(values, value_kind)
+        # count every distinct value once, in sorted order, so ties for the most frequent value go to the
+        # smallest value. NULLs and empty strings count as the FALDISCO_NULL and FALDISCO_EMPTY values
+        value_counts = values[~(null | empty)].value_counts(sort=False)
+        special_counts = pd.Series(
+            [int(null.sum()), int(empty.sum())], index=[fg.FALDISCO_NULL, fg.FALDISCO_EMPTY]
+        )
+        special_counts = special_counts[special_counts > 0]
+        if value_kind == VALUE_KIND_TEXT:
+            # text is compared and sorted as strings
+            value_counts.index = value_counts.index.map(Field_Profiles_Store.value_text)
+            value_counts = pd.concat([value_counts, special_counts]).groupby(level=0).sum()
+            values = value_counts.index
+            # FALDISCO fill ins for NULL or empty strings do not count towards lengths and min/max values
+            values = values[~values.str.startswith(fg.FALDISCO_SPECIAL_VALUE_PREFIX)]
+        else:
+            # numbers and datetimes are sorted by value, NULLs go last
+            value_counts = value_counts.sort_index()
+            values = value_counts.index
+            value_counts = pd.concat([value_counts, special_counts])
+        # - unique_count has number of unique values in the field - if it is 1, we have a constant column
+        # - mfv_count has the number of rows of most frequent value
+        unique_count = len(value_counts)
+        mfv_count = 0
+        mfv = None
+        if unique_count > 0:
+            mfv = value_counts.idxmax()
+            mfv_count = int(value_counts[mfv])
+        min_val = None
+        max_val = None
+        min_len = -1
+        max_len = -1
+        if len(values) > 0:
+            min_val = values[0]
+            max_val = values[-1]
+            value_lens = values.map(Field_Profiles_Store.value_text).str.len()
+            min_len = int(value_lens.min())
+            max_len = int(value_lens.max())
+        selectivity = unique_count / num_rows
+        return Field_Profiles(
+            # num_rows: int,
+            num_rows,
+            # cardinality: int
+            unique_count,
+            # selectivity: float,
+            selectivity,
+            # mfv_count: int,
+            mfv_count,
+            # min_len: int,
+            min_len,
+            # max_len: int,
+            max_len,
+            # min_val: str,
+            min_val,
+            # max_val: str,
+            max_val,
+            # mfv
+            mfv,
+            # value_kind: str
+            value_kind,
+        )
+
+    @staticmethod
+    def value_kind(values: pd.Series) -> str:
+        # booleans are compared as text, like any other non numeric value
+        if pd.api.types.is_bool_dtype(values.dtype):
+            return VALUE_KIND_TEXT
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            return VALUE_KIND_NUMBER
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            return VALUE_KIND_DATETIME
+        return VALUE_KIND_TEXT
+
+    @staticmethod
+    def value_masks(values: pd.Series, value_kind: str) -> (np.ndarray, np.ndarray):
+        # NULL and empty string masks of a column - they replace the FALDISCO_NULL / FALDISCO_EMPTY markers
+        null = values.isna().to_numpy(dtype=bool)
+        if value_kind != VALUE_KIND_TEXT:
+            return null, np.zeros(len(values), dtype=bool)
+        empty = values.eq("").fillna(False).to_numpy(dtype=bool) & ~null
+        return null, empty
+
+    @staticmethod
+    def value_text(value) -> str:
+        # canonical text of a value: integral floats lose their fraction so that they read like integers
+        if value is None or value is pd.NA or value != value:
+            return fg.FALDISCO_NULL
+        if isinstance(value, str):
+            return value if value != "" else fg.FALDISCO_EMPTY
+        if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 63:
+            return str(int(value))
+        return str(value)
+
+    @staticmethod
+    def value_texts(values: pd.Series) -> np.ndarray:
+        # value_text of every value of a column
+        kind = Field_Profiles_Store.value_kind(values)
+        null, empty = Field_Profiles_Store.value_masks(values, kind)
+        texts = values.astype(object).map(str).to_numpy(dtype=object)
+        if pd.api.types.is_float_dtype(values.dtype):
+            numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            with np.errstate(invalid="ignore"):
+                integral = (
+                        np.isfinite(numbers)
+                        & (numbers == np.round(numbers))
+                        & (np.abs(numbers) < 2 ** 63)
+                )
+            texts[integral] = numbers[integral].astype(np.int64).astype(str)
+        texts[null] = fg.FALDISCO_NULL
+        texts[empty] = fg.FALDISCO_EMPTY
+        return texts
+
+    def exact_match_candidates(
+            self, ref_field_names: [str], target_field_names: [str]
+    ) -> np.ndarray:
+        # R x T mask of the (ref, target) pairs whose length ranges and min/max value ranges overlap - the
+        # same check as Field_Alignment.can_fields_have_exact_match, as an interval overlap join over the
+        # profile arrays. Value ranges are only compared between fields of the same kind - pairs compared as
+        # text across kinds only need overlapping lengths. Lengths and ranges of database profiles are in the
+        # database's texts and collation, so pairs with a database profile are always candidates
+        ri = self.get_field_ids(ref_field_names)
+        ti = self.get_field_ids(target_field_names)
+        candidates = np.zeros((len(ri), len(ti)), dtype=bool)
+        if len(ri) == 0 or len(ti) == 0:
+            return candidates
+        # rank the min/max values of each kind once so that the interval checks are integer comparisons -
+        # numbers and datetimes are ranked by value, text by its string
+        ids = np.concatenate([ri, ti])
+        has_range = np.array(
+            [self.min_val[i] is not None and self.max_val[i] is not None for i in ids]
+        )
+        kinds = self.value_kinds[ids]
+        min_rank = np.full(len(ids), -1, dtype=np.int64)
+        max_rank = np.full(len(ids), -1, dtype=np.int64)
+        for kind in (VALUE_KIND_TEXT, VALUE_KIND_NUMBER, VALUE_KIND_DATETIME):
+            ranged = has_range & (kinds == kind)
+            if not ranged.any():
+                continue
+            bounds = np.concatenate([self.min_val[ids[ranged]], self.max_val[ids[ranged]]])
+            if kind == VALUE_KIND_TEXT:
+                bounds = bounds.astype(str)
+            _values, ranks = np.unique(bounds, return_inverse=True)
+            num_ranged = int(ranged.sum())
+            min_rank[ranged] = ranks[:num_ranged]
+            max_rank[ranged] = ranks[num_ranged:]
+        r_kind, t_kind = kinds[: len(ri)], kinds[len(ri):]
+        r_range, t_range = has_range[: len(ri)], has_range[len(ri):]
+        r_min_rank, t_min_rank = min_rank[: len(ri)], min_rank[len(ri):]
+        r_max_rank, t_max_rank = max_rank[: len(ri)], max_rank[len(ri):]
+        r_min_len, r_max_len = self.min_len[ri], self.max_len[ri]
+        t_min_len, t_max_len = self.min_len[ti], self.max_len[ti]
+        r_from_db, t_from_db = self.from_db[ri], self.from_db[ti]
+        # sweep over blocks of ref fields so that the intermediate masks stay small for very wide tables
+        block = max(1, EXACT_MATCH_CANDIDATES_BLOCK_CELLS // len(ti))
+        for start in range(0, len(ri), block):
+            rows = slice(start, start + block)
+            from_db = r_from_db[rows, None] | t_from_db[None, :]
+            candidates[rows] = (
+                    r_range[rows, None]
+                    & t_range[None, :]
+                    & (
+                            from_db
+                            | (
+                                    (r_min_len[rows, None] <= t_max_len[None, :])
+                                    & (t_min_len[None, :] <= r_max_len[rows, None])
+                                    & (
+                                            (r_kind[rows, None] != t_kind[None, :])
+                                            | (
+                                                    (r_min_rank[rows, None] <= t_max_rank[None, :])
+                                                    & (t_min_rank[None, :] <= r_max_rank[rows, None])
+                                            )
+                                    )
+                            )
+                    )
+            )
+        return candidates
+
+    @staticmethod
+    def mix_hash(h: np.ndarray) -> np.ndarray:
+        # splitmix64 finalizer - uint64 arithmetic wraps around
+        h = h + np.uint64(0x9E3779B97F4A7C15)
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return h ^ (h >> np.uint64(31))
+
+    @staticmethod
+    def make_signature(texts: np.ndarray) -> np.ndarray:
+        # minhash over the multiset of value texts: the n-th occurrence of a value is its own token, so the
+        # estimated jaccard similarity of two fields bounds the number of rows where they can match
+        values = pd.Series(texts)
+        occurrence = values.groupby(values, sort=False).cumcount().to_numpy(dtype=np.uint64)
+        tokens = Field_Profiles_Store.mix_hash(
+            pd.util.hash_array(values.to_numpy(dtype=object))
+            ^ (occurrence * np.uint64(0xD6E8FEB86659FD93))
+        )
+        signature = np.full(fg.FIELD_SKETCH_SIZE, np.iinfo(np.uint64).max, dtype=np.uint64)
+        block = max(1, SIGNATURE_BLOCK_CELLS // fg.FIELD_SKETCH_SIZE)
+        for start in range(0, len(tokens), block):
+            hashes = Field_Profiles_Store.mix_hash(
+                tokens[start:start + block, None] ^ SIGNATURE_SEEDS[None, :]
+            )
+            signature = np.minimum(signature, hashes.min(axis=0))
+        return signature
+
+    def set_signature(self, field_name: str, signature: np.ndarray):
+        self.signatures[self.field_ids[field_name]] = signature
+
+    def exact_match_overlap(
+            self, ref_field_names: [str], target_field_names: [str]
+    ) -> np.ndarray:
+        # R x T estimate of the largest possible exact match strength of each pair. With j the estimated
+        # jaccard similarity of the two value multisets of num_rows values each, at most
+        # 2 * num_rows * j / (1 + j) rows can match
+        ri = self.get_field_ids(ref_field_names)
+        ti = self.get_field_ids(target_field_names)
+        similarity = np.zeros((len(ri), len(ti)), dtype=np.float64)
+        if len(ri) == 0 or len(ti) == 0:
+            return similarity
+        r_signatures = self.signatures[ri]
+        t_signatures = self.signatures[ti]
+        block = max(1, EXACT_MATCH_CANDIDATES_BLOCK_CELLS // (len(ti) * fg.FIELD_SKETCH_SIZE))
+        for start in range(0, len(ri), block):
+            rows = slice(start, start + block)
+            similarity[rows] = (
+                    r_signatures[rows, None, :] == t_signatures[None, :, :]
+            ).mean(axis=2)
+        return 2 * similarity / (1 + similarity)
+
+    def to_df(self, profiling_table_fields: [str]) -> DataFrame:
+        # build the whole profiles table from the columns in one step
+        df = DataFrame(
+            {
+                "table_namespace": self.table_namespaces,
+                "table_name": self.table_names,
+                "field_name": [fg.make_orig_field_name(f) for f in self.field_names],
+                "cardinality": self.cardinality,
+                "selectivity": self.selectivity,
+                "min_value": self.min_val,
+                "max_value": self.max_val,
+                "min_len": self.min_len,
+                "max_len": self.max_len,
+                "mfv_count": self.mfv_count,
+                "num_rows": self.num_rows,
+                "is_unique": np.where(self.is_unique, "y", "n"),
+                "is_sparse": np.where(self.is_sparse, "y", "n"),
+                "is_constant": np.where(self.is_constant, "y", "n"),
+            }
+        )
+        return df[profiling_table_fields]
+
+    def to_csv(self, path: str, profiling_table_fields: [str]):
+        self.to_df(profiling_table_fields).to_csv(path_or_buf=path)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+from typing import Dict, List
+
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Engine
+
+import faldisco_globals as fg
+
+logger = logging.getLogger(__name__)
+
+# dialects with a hidden "<table>$partitions" table listing the partitions of a table
+PARTITIONS_TABLE_DIALECTS = {"presto", "trino"}
+
+
+# restricts the queries of a run to one partition of each side: a partition is a {column: value} dict, and the
+# queries of a run get an equality predicate per partition column on every read of the table, so the database
+# only scans that partition. A column without a value is the latest partition - the largest value, read from
+# the catalog where the dialect has one, with max() otherwise
+class Partition_Pruning:
+    def __init__(self):
+        return
+
+    @staticmethod
+    def parse_partition(spec: str) -> Dict[str, object]:
+        # "ds=2024-01-01,hr=12" names values, "ds" is the latest partition
+        partition = {}
+        for item in spec.split(","):
+            column, _sep, value = item.strip().partition("=")
+            partition[column.strip()] = value.strip() if value.strip() else None
+        return partition
+
+    @staticmethod
+    def literal(value: object) -> str:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    @staticmethod
+    def gen_predicates(alias: str, partition: Dict[str, object]) -> List[str]:
+        return [f"{alias}.{c} = {Partition_Pruning.literal(v)}" for c, v in (partition or {}).items()]
+
+    @staticmethod
+    def gen_where(alias: str, partition: Dict[str, object]) -> str:
+        predicates = Partition_Pruning.gen_predicates(alias, partition)
+        return f" where {' and '.join(predicates)}" if predicates else ""
+
+    @staticmethod
+    def gen_source(schema_name: str, table_name: str, partition: Dict[str, object]) -> str:
+        # the table, or the rows of its partition, as the source of a query that selects columns by name
+        if not partition:
+            return f"{schema_name}.{table_name}"
+        return f"(select * from {schema_name}.{table_name} p{Partition_Pruning.gen_where('p', partition)}) p"
+
+    @staticmethod
+    def gen_partitions_source(dialect_name: str, schema_name: str, table_name: str) -> str:
+        # where the values of the partition columns are read from
+        if dialect_name in PARTITIONS_TABLE_DIALECTS:
+            return f'{schema_name}."{table_name}$partitions" p'
+        return f"{schema_name}.{table_name} p"
+
+    @staticmethod
+    def gen_latest_sql(
+            dialect_name: str, schema_name: str, table_name: str, column: str, resolved: Dict[str, object]
+    ) -> str:
+        source = Partition_Pruning.gen_partitions_source(dialect_name, schema_name, table_name)
+        return f"select max(p.{column}) from {source}{Partition_Pruning.gen_where('p', resolved)}"
+
+    @staticmethod
+    def gen_latest_values_sql(
+            dialect_name: str, schema_name: str, table_name: str, column: str, num_partitions: int
+    ) -> str:
+        source = Partition_Pruning.gen_partitions_source(dialect_name, schema_name, table_name)
+        return f"select distinct p.{column} from {source} order by p.{column} desc LIMIT {num_partitions}"
+
+    @staticmethod
+    def get_latest_partitions(
+            engine: Engine, schema_name: str, table_name: str, column: str, num_partitions: int
+    ) -> List[object]:
+        # the latest num_partitions values of the partition column, oldest first
+        with engine.connect() as connection:
+            values = [
+                row[0]
+                for row in connection.execute(
+                    text(
+                        Partition_Pruning.gen_latest_values_sql(
+                            engine.dialect.name, schema_name, table_name, column, num_partitions
+                        )
+                    )
+                )
+                if row[0] is not None
+            ]
+        if len(values) == 0:
+            raise ValueError(f"{schema_name}.{table_name} has no partitions of {column}")
+        return values[::-1]
+
+    @staticmethod
+    def resolve_partition(
+            engine: Engine, schema_name: str, table_name: str, partition: Dict[str, object]
+    ) -> Dict[str, object]:
+        # columns without a value get the latest one, within the values of the columns before them
+        resolved = {}
+        with engine.connect() as connection:
+            for column, value in partition.items():
+                if value is None:
+                    value = connection.execute(
+                        text(
+                            Partition_Pruning.gen_latest_sql(
+                                engine.dialect.name, schema_name, table_name, column, resolved
+                            )
+                        )
+                    ).scalar()
+                    if value is None:
+                        raise ValueError(f"{schema_name}.{table_name} has no partitions of {column}")
+                resolved[column] = value
+        if resolved:
+            logger.info(f"FALDISCO__DEBUG: {schema_name}.{table_name}: reading partition {resolved}")
+        return resolved
+
+    @staticmethod
+    def get_partition(
+            engine: Engine, schema_name: str, table: Table, spec: str = None
+    ) -> Dict[str, object]:
+        # the partition named by spec, or the latest partition of the FALDISCO_PARTITION_COLUMNS the table has
+        if spec:
+            partition = Partition_Pruning.parse_partition(spec)
+        else:
+            partition = {c: None for c in fg.FALDISCO_PARTITION_COLUMNS if c in table.c}
+        return Partition_Pruning.resolve_partition(engine, schema_name, table.name, partition)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import faldisco_globals as fg
+from field_alignment import Field_Alignment
+from value_matches import Value_Matches
+
+logger = logging.getLogger(__name__)
+
+
+# how stable the alignments of a run over many partitions are: every partition is counted on its own, for the
+# combinations planned from the profiles of all partitions, and keeps the strength of every match it finds. The
+# counts of all partitions add up to the combined results, and every combined result gets the smallest and
+# largest strength it has in a single partition. Partitions without rows do not count
+class Partition_Stability:
+    partition_names: [str]
+    # strength of every match of every partition with rows, by (ref field, target field, alignment type)
+    partition_strengths: [{(str, str, str): float}]
+
+    def __init__(self):
+        self.partition_names = []
+        self.partition_strengths = []
+
+    @staticmethod
+    def count_partition(
+            fa: Field_Alignment, df: DataFrame
+    ) -> ((int, Value_Matches, Value_Matches, np.ndarray, {str: {str: np.ndarray}}), {(str, str, str): float}):
+        # count the rows of one partition for the plan of fa, a copy of the plan for this partition: the counts to
+        # add to the combined run, and the strengths of the partition on its own - None without rows
+        fa.df = df
+        fa.deduped_df = df
+        fa.num_rows = len(df)
+        if fa.num_rows == 0:
+            return fa.get_counts(), None
+        fa.process_rows(df)
+        counts = fa.get_counts()
+        return counts, fa.get_match_strengths()
+
+    def add_partition(self, name: str, strengths: {(str, str, str): float}):
+        if strengths is None:
+            logger.info(f"FALDISCO__DEBUG: partition {name} has no rows - left out of the partition strengths")
+            return
+        self.partition_names.append(name)
+        self.partition_strengths.append(strengths)
+
+    def add_stability(self, results_df: DataFrame) -> DataFrame:
+        # the results with the FIELD_ALIGNMENT_STABILITY_FIELDS columns
+        keys = list(
+            zip(
+                results_df["reference_field_name"],
+                results_df["target_field_name"],
+                results_df["alignment_type"],
+            )
+        )
+        strengths = np.array(
+            [[s.get(k, 0.0) for s in self.partition_strengths] for k in keys], dtype=np.float64
+        ).reshape(len(keys), len(self.partition_strengths))
+        found = np.array(
+            [[k in s for s in self.partition_strengths] for k in keys], dtype=bool
+        ).reshape(len(keys), len(self.partition_strengths))
+        stability_df = results_df.copy()
+        min_strength, max_strength, num_aligned = fg.FIELD_ALIGNMENT_STABILITY_FIELDS
+        if len(self.partition_strengths) > 0:
+            stability_df[min_strength] = strengths.min(axis=1)
+            stability_df[max_strength] = strengths.max(axis=1)
+        else:
+            stability_df[min_strength] = pd.Series(np.nan, index=results_df.index, dtype=np.float64)
+            stability_df[max_strength] = pd.Series(np.nan, index=results_df.index, dtype=np.float64)
+        stability_df[num_aligned] = found.sum(axis=1)
+        return stability_df
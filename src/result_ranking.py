@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import heapq
+
+
+# ranking of the candidates - ref fields, or (ref field, alignment type) pairs - that match one target field
+# with one alignment type. Candidates are ranked by score, then by lower selectivity, then by the order they were
+# added. With top_k, a min heap keeps the top_k best candidates, so adding one costs O(log top_k) however many
+# ref fields align weakly with the target field; without it every candidate is kept
+class Result_Ranking:
+    top_k: int
+    entries: [(float, float, int, object)]  # (score, -selectivity, -order, candidate), a min heap with top_k
+    num_candidates: int
+
+    def __init__(self, top_k: int = 0):
+        self.top_k = top_k
+        self.entries = []
+        self.num_candidates = 0
+
+    def add(self, candidate: object, score: float, selectivity: float = 0.0):
+        entry = (score, -selectivity, -self.num_candidates, candidate)
+        self.num_candidates += 1
+        if self.top_k <= 0:
+            self.entries.append(entry)
+        elif len(self.entries) < self.top_k:
+            heapq.heappush(self.entries, entry)
+        elif entry > self.entries[0]:
+            heapq.heapreplace(self.entries, entry)
+
+    def get_max_score(self) -> float:
+        return max(self.entries)[0] if self.entries else 0
+
+    def get_top(self, by_selectivity: bool = False) -> [object]:
+        # the candidates tied at the max score - and at the min selectivity among them - in the order they were added
+        if not self.entries:
+            return []
+        best = max(self.entries)
+        return [
+            e[3]
+            for e in sorted(self.entries, key=lambda e: -e[2])
+            if e[0] == best[0] and (not by_selectivity or e[1] == best[1])
+        ]
+
+    def get_at_least(self, min_score: float, excluded: {object} = frozenset(), limit: int = 0) -> [object]:
+        # candidates with at least min_score that are not excluded, in the order they were added; with limit, the
+        # best limit of them
+        entries = [e for e in self.entries if e[0] >= min_score and e[3] not in excluded]
+        if limit > 0:
+            entries = heapq.nlargest(limit, entries)
+        return [e[3] for e in sorted(entries, key=lambda e: -e[2])]
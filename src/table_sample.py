@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+import numpy as np
+from pandas import DataFrame
+from sqlalchemy.engine import Engine
+
+from db_profiles import Db_Profiles
+from faldisco_context import Faldisco_Context
+from field_profiles import Field_Profiles, Field_Profiles_Store, VALUE_KIND_TEXT
+from partition_pruning import Partition_Pruning
+from value_index import Value_Index
+from value_matches import Value_Matches
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_FIELD_PREFIX = "r__"
+TARGET_FIELD_PREFIX = "t__"
+
+
+# sample of one side of many runs - a reference table evaluated against many target tables, or a target table
+# evaluated against many reference tables. The work of the shared side - fetching, profiling, value encoding,
+# value texts and the value index - is done once, and every run gathers the sample rows it joined to.
+# Profiles of the sample give the value kinds of its encodings; runs profile the rows they joined, like a run of
+# one reference and one target table, unless the profiles come from the database
+class Table_Sample:
+    context: Faldisco_Context
+    table_namespace: str
+    table_name: str
+    field_prefix: str  # r__ or t__ - the side of the runs the sample is on
+    partition: {str: object}  # partition of the table the sample is read from, {} for all rows
+    orig_join_field_names: [str]
+    join_field_names: [str]
+    orig_field_names: [str]
+    field_names: [str]
+    df: DataFrame
+    profiles: {str: Field_Profiles}
+    db_profiled: bool  # profiles come from the database, not from the sample rows
+    dictionary: Value_Matches  # value dictionary the value encodings of every run start from
+    value_codes: {str: np.ndarray}
+    value_texts: {str: np.ndarray}
+    value_index: Value_Index  # (sample row, value) -> fields, built on first use
+
+    def __init__(
+            self,
+            table_namespace: str,
+            table_name: str,
+            join_field_names: [str],
+            field_names: [str],
+            field_prefix: str = REFERENCE_FIELD_PREFIX,
+            context: Faldisco_Context = None,
+            partition: {str: object} = None,
+    ):
+        self.context = context if context is not None else Faldisco_Context()
+        self.partition = partition or {}
+        self.table_namespace = table_namespace
+        self.table_name = table_name
+        self.field_prefix = field_prefix
+        self.orig_join_field_names = list(join_field_names)
+        self.join_field_names = [f"r_j__{c}" for c in self.orig_join_field_names]
+        self.orig_field_names = list(field_names)
+        self.field_names = [f"{field_prefix}{c}" for c in self.orig_field_names]
+        self.df = None
+        self.profiles = {}
+        self.db_profiled = False
+        self.dictionary = Value_Matches([], [], self.context)
+        self.value_codes = {}
+        self.value_texts = {}
+        self.value_index = None
+
+    def is_reference(self) -> bool:
+        return self.field_prefix == REFERENCE_FIELD_PREFIX
+
+    # sample the rows with the smallest keys, so that the queries of the other side can select the same keys
+    def gen_sql(self) -> str:
+        ojk = self.orig_join_field_names[0]
+        sql_statement = f"select s.{ojk} as {self.join_field_names[0]}"
+        for c in self.orig_field_names:
+            sql_statement = sql_statement + f", s.{c} as {self.field_prefix}{c}"
+        sql_statement = (
+                sql_statement
+                + f" from {self.table_namespace}.{self.table_name} s"
+                + Partition_Pruning.gen_where("s", self.partition)
+                + f" order by s.{ojk} LIMIT {self.context.SAMPLE_SIZE}"
+        )
+        return sql_statement
+
+    # the distinct keys of the sample, to join the tables of the other side to
+    def gen_keys_sql(self) -> str:
+        ojk = self.orig_join_field_names[0]
+        return (
+            f"select distinct s.{ojk} from (select r.{ojk} from {self.table_namespace}.{self.table_name} r"
+            + Partition_Pruning.gen_where("r", self.partition)
+            + f" order by r.{ojk} LIMIT {self.context.SAMPLE_SIZE}) s"
+        )
+
+    # select the rows of a table of the other side with the keys of the sample
+    def gen_other_sql(
+            self,
+            table_namespace: str,
+            table_name: str,
+            join_field_names: [str],
+            field_names: [str],
+            field_prefix: str,
+            partition: {str: object} = None,
+    ) -> str:
+        ojk = self.orig_join_field_names[0]
+        jk = join_field_names[0] if join_field_names else ojk
+        sql_statement = f"select o.{jk} as {self.join_field_names[0]}"
+        for c in field_names:
+            sql_statement = sql_statement + f", o.{c} as {field_prefix}{c}"
+        sql_statement = (
+                sql_statement
+                + f" from {table_namespace}.{table_name} o"
+                + f" join ({self.gen_keys_sql()}) k on o.{jk} = k.{ojk}"
+                + Partition_Pruning.gen_where("o", partition)
+                + f" LIMIT {self.context.SAMPLE_SIZE}"
+        )
+        return sql_statement
+
+    def set_df(self, df: DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.value_index = None
+        # a new dictionary - runs of an earlier sample keep reading theirs
+        self.dictionary = Value_Matches([], [], self.context)
+        num_rows = len(self.df)
+        for f in self.field_names:
+            values = self.df[f]
+            fp = Field_Profiles_Store.profile_values(values, num_rows)
+            self.profiles[f] = fp
+            self.value_codes[f] = self.dictionary.encode_values(
+                values, fp.get_field_value_kind() == VALUE_KIND_TEXT
+            )
+            self.value_texts[f] = Field_Profiles_Store.value_texts(values)
+        logger.info(
+            f"FALDISCO__DEBUG: prepared sample {self.table_namespace}.{self.table_name}: "
+            + f"{num_rows} rows, {len(self.field_names)} fields, {self.dictionary.num_values()} distinct values"
+        )
+
+    def profile_fields_in_db(self, engine: Engine, mode: str):
+        # database profiles of the whole table replace the profiles of the fetched rows
+        Db_Profiles.check_mode(mode)
+        profiles = Db_Profiles.profile_fields(
+            engine,
+            Partition_Pruning.gen_source(self.table_namespace, self.table_name, self.partition),
+            dict(zip(self.field_names, self.orig_field_names)),
+            self.context.FALDISCO_DB_APPROX_DISTINCT,
+        )
+        for f, fp in profiles.items():
+            self.profiles[f] = Db_Profiles.set_value_kind(fp, self.profiles[f].get_field_value_kind())
+        self.db_profiled = True
+
+    def get_value_index(self) -> Value_Index:
+        # NULLs are indexed, so the index serves exact matches; probes that skip NULLs serve transforms
+        if self.value_index is None:
+            self.value_index = Value_Index(self.df, self.field_names)
+        return self.value_index
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bz2
+import csv
+import gzip
+import heapq
+import logging
+import lzma
+import os
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+
+logger = logging.getLogger(__name__)
+
+# openers and file name suffixes of the supported compressions
+COMPRESSIONS = {
+    "gzip": (gzip.open, ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+
+# streams value alignments to the value alignments file as each combination is finalized, instead of holding
+# them in a data frame until the run is written. The file has the columns of FIELD_VALUE_ALIGNMENT_TABLE_FIELDS
+# and a row number column, like the data frame csv it replaces. With max_rows_per_combination, only the values
+# with the largest alignment counts of a combination are written, plus one FALDISCO_OTHER row with the counts of
+# the rest, so memory and output size are bounded per combination. Compression and the cap are settings of the
+# run's context. The file is written under a temporary name and only appears once it is closed with at least one
+# row
+class Value_Alignment_Writer:
+    context: Faldisco_Context
+    path: str
+    compression: str
+    max_rows_per_combination: int
+    file: object
+    writer: object
+    num_rows: int
+    combination: [str]  # table and field names of the current combination
+    alignment_type: str
+    combination_rows: [(int, int, [str, str, str, int, int])]  # heap of (alignment count, -order, value row)
+    num_combination_values: int
+    other_count: int
+    other_misalignment_count: int
+
+    def __init__(self, path: str, context: Faldisco_Context = None):
+        self.context = context if context is not None else Faldisco_Context()
+        self.compression = self.context.FALDISCO_VALUE_ALIGNMENTS_COMPRESSION
+        self.path = path + (COMPRESSIONS[self.compression][1] if self.compression else "")
+        self.max_rows_per_combination = self.context.FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION
+        self.file = None
+        self.writer = None
+        self.num_rows = 0
+        self.combination = None
+        self.alignment_type = None
+        self.combination_rows = []
+        self.num_combination_values = 0
+        self.other_count = 0
+        self.other_misalignment_count = 0
+
+    @staticmethod
+    def get_path(ref_table_name: str, target_table_name: str) -> str:
+        return f"{fg.FALDISCO_OUTPUT_FOLDER}{fg.FALDISCO_OUTPUT_FOLDER}{ref_table_name}_to_{target_table_name}_value_alignments"
+
+    def open(self):
+        tmp_path = self.path + ".tmp"
+        if self.compression:
+            self.file = COMPRESSIONS[self.compression][0](tmp_path, "wt", newline="")
+        else:
+            self.file = open(tmp_path, "w", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow([""] + fg.FIELD_VALUE_ALIGNMENT_TABLE_FIELDS)
+
+    def write_row(self, value_row: [str, str, str, int, int]):
+        if self.file is None:
+            self.open()
+        row = self.combination + value_row
+        self.writer.writerow([self.num_rows] + row)
+        self.num_rows += 1
+        r = f"r__{row[2]}"
+        t = f"t__{row[5]}"
+        if (
+                (r in self.context.TRACE_FIELDS_ANY)
+                or (t in self.context.TRACE_FIELDS_ANY)
+                or (r in self.context.TRACE_FIELDS_ALL and t in self.context.TRACE_FIELDS_ALL)
+        ):
+            logger.info(
+                f"FALDISCO__DEBUG: RESULTS: {row[2]}={row[6]}, {row[5]}={row[7]}, {row[8]}, alignment={row[9]}, misalignment={row[10]}"
+            )
+
+    def start_combination(
+            self,
+            ref_table_namespace: str,
+            ref_table_name: str,
+            orig_ref_field_name: str,
+            target_table_namespace: str,
+            target_table_name: str,
+            orig_target_field_name: str,
+            alignment_type: str,
+    ):
+        self.combination = [
+            ref_table_namespace,
+            ref_table_name,
+            orig_ref_field_name,
+            target_table_namespace,
+            target_table_name,
+            orig_target_field_name,
+        ]
+        self.alignment_type = alignment_type
+        self.combination_rows = []
+        self.num_combination_values = 0
+        self.other_count = 0
+        self.other_misalignment_count = 0
+
+    def add_value(self, ref_value: str, target_value: str, alignment_count: int, misalignment_count: int):
+        value_row = [ref_value, target_value, self.alignment_type, alignment_count, misalignment_count]
+        if self.max_rows_per_combination <= 0:
+            self.write_row(value_row)
+            return
+        entry = (alignment_count, -self.num_combination_values, value_row)
+        self.num_combination_values += 1
+        if len(self.combination_rows) < self.max_rows_per_combination:
+            heapq.heappush(self.combination_rows, entry)
+            return
+        if entry > self.combination_rows[0]:
+            entry = heapq.heapreplace(self.combination_rows, entry)
+        # the value with the smallest count goes to the other row
+        self.other_count += entry[2][3]
+        self.other_misalignment_count += entry[2][4]
+
+    def end_combination(self):
+        # the kept values in the order they were added, then the other row
+        for _count, _order, value_row in sorted(self.combination_rows, key=lambda e: -e[1]):
+            self.write_row(value_row)
+        if self.num_combination_values > len(self.combination_rows):
+            self.write_row(
+                [
+                    fg.FALDISCO_OTHER,
+                    fg.FALDISCO_OTHER,
+                    self.alignment_type,
+                    self.other_count,
+                    self.other_misalignment_count,
+                ]
+            )
+        self.combination_rows = []
+
+    def close(self) -> int:
+        # number of value alignments written
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.replace(self.path + ".tmp", self.path)
+        return self.num_rows
+
+    def abort(self):
+        # a failed run leaves no value alignments file behind
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.path + ".tmp")
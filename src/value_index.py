@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import faldisco_globals as fg
+from field_profiles import Field_Profiles_Store
+
+logger = logging.getLogger(__name__)
+
+ROW_HASH_MULTIPLIER = np.uint64(0xD6E8FEB86659FD93)
+
+
+# hashed index of (row, value) -> fields over a set of fields. Values are compared by their canonical value text,
+# so one probe with a column of values finds how many rows of every indexed field hold the same value in the
+# same row. Keys are 64 bit hashes - a collision can add a false match with probability ~ rows * fields / 2**64
+class Value_Index:
+    field_names: [str]
+    keys: np.ndarray  # sorted (row, value) hashes
+    fields: np.ndarray  # index of the field of every key
+
+    def __init__(self, df: DataFrame, field_names: [str], include_nulls: bool = True):
+        self.field_names = list(field_names)
+        keys = []
+        fields = []
+        for i, f in enumerate(self.field_names):
+            texts = Field_Profiles_Store.value_texts(df[f])
+            valid = (
+                np.ones(len(texts), dtype=bool)
+                if include_nulls
+                else Value_Index.is_value(texts)
+            )
+            keys.append(Value_Index.make_keys(texts)[valid])
+            fields.append(np.full(int(valid.sum()), i, dtype=np.int64))
+        keys = np.concatenate(keys + [np.zeros(0, dtype=np.uint64)])
+        fields = np.concatenate(fields + [np.zeros(0, dtype=np.int64)])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.fields = fields[order]
+
+    @staticmethod
+    def is_value(texts: np.ndarray) -> np.ndarray:
+        # rows that hold a value - not NULL or empty
+        return (texts != fg.FALDISCO_NULL) & (texts != fg.FALDISCO_EMPTY)
+
+    @staticmethod
+    def make_keys(texts: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        # rows default to the positions of the texts
+        rows = (
+            np.arange(len(texts), dtype=np.uint64)
+            if rows is None
+            else rows.astype(np.uint64)
+        )
+        return Field_Profiles_Store.mix_hash(
+            pd.util.hash_array(texts.astype(object))
+            ^ Field_Profiles_Store.mix_hash(rows * ROW_HASH_MULTIPLIER)
+        )
+
+    def count_matches(
+            self, texts: np.ndarray, valid: np.ndarray = None, rows: np.ndarray = None
+    ) -> np.ndarray:
+        # number of rows where every indexed field holds the same value as texts, one count per field. rows are
+        # the indexed rows the texts are compared with, when they are not in the same positions
+        probes = Value_Index.make_keys(texts, rows)
+        if valid is not None:
+            probes = probes[valid]
+        starts = np.searchsorted(self.keys, probes, side="left")
+        num_matches = np.searchsorted(self.keys, probes, side="right") - starts
+        # a probe matches one key per field holding its value in its row
+        total = int(num_matches.sum())
+        first = np.cumsum(num_matches) - num_matches
+        positions = np.repeat(starts - first, num_matches) + np.arange(total)
+        return np.bincount(self.fields[positions], minlength=len(self.field_names))
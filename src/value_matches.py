@@ -8,32 +8,149 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
+import shutil
+import tempfile
 
-from pandas import DataFrame
+import numpy as np
+import pandas as pd
 
 import faldisco_globals as fg
-from field_profiles import Field_Profiles
+from faldisco_context import Faldisco_Context
+from alignment_kernel import Alignment_Kernel, Ref_Value_Groups
+from field_profiles import Field_Profiles_Store
+from value_alignment_writer import Value_Alignment_Writer
 
 logger = logging.getLogger(__name__)
-ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD = 0.8
-ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD = 0.3
 
+NO_VALUE_CODE = -1
 
+SPILL_DTYPE = np.dtype(
+    [
+        ("combination", np.int64),
+        ("ref_value", np.int64),
+        ("target_value", np.int64),
+        ("count", np.int64),
+    ]
+)
+
+
+# counts of (ref value, target value) pairs for every (ref field, target field) combination.
+# Values are dictionary encoded - every distinct value gets an integer code shared by all fields, so
+# ref and target values can be compared by code. Each combination keeps a count table: three arrays of
+# ref value codes, target value codes and counts, in order of first appearance.
+#
+# With heavy_hitters = k > 0 the counts are approximate: each ref value keeps at most k target value counters
+# (a Misra-Gries summary) plus its exact row total and an upper bound of its distinct target values, so a
+# combination needs at most (k + 1) * 3 int64s = 24 * (k + 1) bytes per distinct ref value no matter how many
+# distinct target values there are. The bound is per ref value - a combination of a ref field with n distinct
+# values still takes 24 * (k + 1) * n bytes. For a ref value with trows rows, every kept count is at most
+# trows / (k + 1) below the true count, and dropped target values had at most trows / (k + 1) rows. Alignment
+# scoring divides the kept counts by the exact row totals, so max_count, aligned rows and exact match rows are
+# underestimated by at most 1 / (k + 1) of the rows, and alignment and exact match strength are at most
+# 1 / (k + 1) below the exact value. Sparse scoring weighs kept counts against each other - rows of the mfvs,
+# mismatches - so it scores from the summaries alone, over the rows they kept, and never mixes the exact totals
+# with reduced counts. Row totals are exact; distinct target counts are exact for ref values with at most k
+# distinct target values.
+#
+# With memory_limit > 0 exact counts are spilled to disk whenever the count tables in memory take more than
+# memory_limit bytes. Count table rows are hash partitioned by ref value into spill_partitions files per spill, so
+# all rows of a (combination, ref value) group land in the same partition. Scoring and value alignment output
+# then go partition by partition and only hold one partition of counts in memory at a time. The value
+# dictionary stays in memory. Approximate counts are already bounded per ref value and are never spilled.
+#
+# A run against a shared sample starts from the dictionary of the sample: the sample dictionary is the read-only
+# base of the codes below num_base_values, and value_codes and values only hold the values the run adds.
 class Value_Matches:
-    value_matches = {}
+    context: Faldisco_Context
+    base_dictionary: "Value_Matches"  # None without a shared dictionary
+    num_base_values: int
+    value_codes: {}  # codes of the values added to the base dictionary
+    values: []
+    value_matches: {}
+    heavy_hitters: int
+    ref_value_totals: {}
+    memory_limit: int
+    memory_bytes: int
+    spill_partitions: int
+    spill_root: str  # folder the spill folder is created in, None for the system temp folder
+    spill_folder: str
+    spill_files: [[str]]
+    combination_ids: {}
+    last_ref_values: {}
 
-    def __init__(self, ref_field_names: [str], target_field_names: [str]):
+    def __init__(
+            self,
+            ref_field_names: [str],
+            target_field_names: [str],
+            context: Faldisco_Context = None,
+    ):
+        self.context = context if context is not None else Faldisco_Context()
+        self.base_dictionary = None
+        self.num_base_values = 0
+        self.value_codes = {}
+        self.values = []
+        self.value_matches = {}
+        self.heavy_hitters = self.context.VALUE_MATCHES_HEAVY_HITTERS
+        self.ref_value_totals = {}
+        self.memory_limit = self.context.VALUE_MATCHES_MEMORY_LIMIT
+        self.memory_bytes = 0
+        self.spill_partitions = max(self.context.VALUE_MATCHES_SPILL_PARTITIONS, 1)
+        self.spill_root = self.context.VALUE_MATCHES_SPILL_FOLDER
+        self.spill_folder = None
+        self.spill_files = [[] for _p in range(self.spill_partitions)]
+        self.combination_ids = {}
+        self.last_ref_values = {}
         # initialize the ref_field, target_field levels
         for r in ref_field_names:
             self.value_matches[r] = {}
-            for t in target_field_names:
-                self.value_matches[r][t] = {}
 
-    def get_ref_values(self, ref_field_name: str, target_field_name: str):
-        target_fields = self.get_target_fields(ref_field_name)
-        if target_field_name not in target_fields.keys():
-            target_fields[target_field_name] = {}
-        return target_fields[target_field_name]
+    def load_dictionary(self, other: "Value_Matches"):
+        # start from the value codes of another instance, so that its encoded values can be reused as is. The
+        # codes of other are shared, not copied - other must not encode values while this instance uses them
+        self.base_dictionary = other
+        self.num_base_values = other.num_values()
+        self.value_codes = {}
+        self.values = []
+
+    def num_values(self) -> int:
+        return self.num_base_values + len(self.values)
+
+    def get_value_code(self, value) -> int:
+        if self.base_dictionary is not None:
+            code = self.base_dictionary.get_value_code(value)
+            if code != NO_VALUE_CODE:
+                return code
+        return self.value_codes.get(value, NO_VALUE_CODE)
+
+    def decode_value(self, code: int):
+        if code < self.num_base_values:
+            return self.base_dictionary.decode_value(code)
+        return self.values[code - self.num_base_values]
+
+    def encode_value(self, value) -> int:
+        code = self.get_value_code(value)
+        if code == NO_VALUE_CODE:
+            code = self.num_values()
+            self.value_codes[value] = code
+            self.values.append(value)
+        return code
+
+    def encode_values(self, values: pd.Series, as_text: bool = False) -> np.ndarray:
+        # encode the distinct values of the column, then map the column to codes in one step. NULLs and empty
+        # strings get the codes of FALDISCO_NULL and FALDISCO_EMPTY; as_text encodes values by their text
+        codes, uniques = pd.factorize(values)
+        # factorize marks NULLs with -1, which picks the last entry
+        unique_codes = np.empty(len(uniques) + 1, dtype=np.int64)
+        for i, v in enumerate(uniques):
+            if as_text:
+                v = Field_Profiles_Store.value_text(v)
+            elif isinstance(v, str) and v == "":
+                v = fg.FALDISCO_EMPTY
+            unique_codes[i] = self.encode_value(v)
+        if (codes < 0).any():
+            unique_codes[-1] = self.encode_value(fg.FALDISCO_NULL)
+        return unique_codes[codes]
 
     def get_target_fields(self, ref_field_name: str):
         vm = self.value_matches
@@ -41,235 +158,523 @@ class Value_Matches:
             vm[ref_field_name] = {}
         return vm[ref_field_name]
 
-    def get_target_values(
-            self, ref_field_name: str, target_field_name: str, ref_value: str
-    ):
-        ref_values = self.get_ref_values(ref_field_name, target_field_name)
-        if ref_value not in ref_values.keys():
-            ref_values[ref_value] = {}
-        return ref_values[ref_value]
+    def get_count_table(
+            self, ref_field_name: str, target_field_name: str
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        target_fields = self.get_target_fields(ref_field_name)
+        if target_field_name not in target_fields.keys():
+            empty = np.zeros(0, dtype=np.int64)
+            target_fields[target_field_name] = (empty, empty, empty)
+        return target_fields[target_field_name]
 
-    def get_alignment(
+    def set_count_table(
             self,
             ref_field_name: str,
             target_field_name: str,
-            ref_value: str,
-            target_value: str,
+            table: (np.ndarray, np.ndarray, np.ndarray),
     ):
-        target_values = self.get_target_values(
-            ref_field_name, target_field_name, ref_value
+        target_fields = self.get_target_fields(ref_field_name)
+        if target_field_name in target_fields.keys():
+            self.memory_bytes -= sum(a.nbytes for a in target_fields[target_field_name])
+        self.memory_bytes += sum(a.nbytes for a in table)
+        target_fields[target_field_name] = table
+
+    def merge_count_tables(
+            self, *tables: (np.ndarray, np.ndarray, np.ndarray)
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        # add up the counts of the same (ref value, target value) pairs - earlier tables go first, so pairs
+        # keep their first appearance order
+        base = max(self.num_values(), 1)
+        ref_values = np.concatenate([r for r, _t, _c in tables])
+        target_values = np.concatenate([t for _r, t, _c in tables])
+        counts = np.concatenate([c for _r, _t, c in tables])
+        pairs, unique_pairs = pd.factorize(ref_values * base + target_values)
+        return (
+            unique_pairs // base,
+            unique_pairs % base,
+            np.bincount(pairs, weights=counts, minlength=len(unique_pairs)).astype(np.int64),
         )
-        if target_value not in target_values.keys():
-            target_values[target_value] = 0
-        return target_values[target_value]
 
-    # increment count for this combination of field names and values
-    def add_value(
-            self, ref_field_name, target_field_name, ref_field_value, target_field_value
+    # increment counts for this combination of field names and all rows of value codes
+    def add_values(
+            self,
+            ref_field_name: str,
+            target_field_name: str,
+            ref_value_codes: np.ndarray,
+            target_value_codes: np.ndarray,
+            counts: np.ndarray = None,
     ):
-        alignment = self.get_alignment(
-            ref_field_name, target_field_name, ref_field_value, target_field_value
-        )
-        target_values = self.get_target_values(
-            ref_field_name, target_field_name, ref_field_value
+        if len(ref_value_codes) == 0:
+            return
+        if counts is None:
+            counts = np.ones(len(ref_value_codes), dtype=np.int64)
+        if self.heavy_hitters > 0:
+            self.add_values_approximately(
+                ref_field_name, target_field_name, ref_value_codes, target_value_codes, counts
+            )
+            return
+        self.set_count_table(
+            ref_field_name,
+            target_field_name,
+            self.merge_count_tables(
+                self.get_count_table(ref_field_name, target_field_name),
+                (ref_value_codes, target_value_codes, counts),
+            ),
         )
-        target_values[target_field_value] = alignment + 1
+        if 0 < self.memory_limit < self.memory_bytes:
+            self.spill()
 
-    def calc_sparse_field_combination_alignment(
+    # count all rows of a ref column and a target column, VALUE_MATCHES_CHUNK_ROWS rows at a time
+    def add_column_values(
             self,
             ref_field_name: str,
             target_field_name: str,
-            profiles: {Field_Profiles},
-            check_for_exact_matches: bool,
+            ref_value_codes: np.ndarray,
+            target_value_codes: np.ndarray,
     ):
-        aligned_rows = 0
-        matching_rows = 0
-        total_rows = 0
-        total_values = 0
-        matching_values = 0
-        # first, find mfv for reference and target fields
-        ref_fp = profiles[ref_field_name]
-        ref_mfv = ref_fp.get_field_mfv()
-        target_fp = profiles[target_field_name]
-        target_mfv = target_fp.get_field_mfv()
-        is_unique = ref_fp.is_unique_field() or target_fp.is_unique_field()
-
-        ref_values = self.get_ref_values(ref_field_name, target_field_name)
-
-        if target_field_name in fg.TRACE_FIELDS_ANY or (
-                target_field_name in fg.TRACE_FIELDS_ALL
-                and ref_field_name in fg.TRACE_FIELDS_ALL
-        ):
-            logger.info(
-                f"FALDISCO__DEBUG: CALC_SPARSE_ALIGNMENT between {ref_field_name} and {target_field_name}: "
-                + f"ref_mfv={ref_mfv}, target_mfv={target_mfv}, is_unique={str(is_unique)}"
+        if len(ref_value_codes) == 0:
+            return
+        # the sparse non-mfv row alignment depends on the ref value that appears last - remember it, since
+        # spilled counts lose the order of ref values across partitions
+        self.last_ref_values[ref_field_name] = int(pd.unique(ref_value_codes)[-1])
+        for start in range(0, len(ref_value_codes), self.context.VALUE_MATCHES_CHUNK_ROWS):
+            end = start + self.context.VALUE_MATCHES_CHUNK_ROWS
+            self.add_values(
+                ref_field_name,
+                target_field_name,
+                ref_value_codes[start:end],
+                target_value_codes[start:end],
             )
-        for rval in ref_values.keys():
-            max_count = 0
-            target_values = self.get_target_values(
-                ref_field_name, target_field_name, rval
+
+    def get_partitions(self, ref_value_codes: np.ndarray) -> np.ndarray:
+        hashes = Field_Profiles_Store.mix_hash(ref_value_codes.astype(np.uint64))
+        return (hashes % np.uint64(self.spill_partitions)).astype(np.int64)
+
+    def get_combination_id(self, ref_field_name: str, target_field_name: str) -> int:
+        return self.combination_ids.setdefault(
+            (ref_field_name, target_field_name), len(self.combination_ids)
+        )
+
+    def is_spilled(self) -> bool:
+        return any(len(files) > 0 for files in self.spill_files)
+
+    # write all count tables in memory to one file per partition and empty the tables
+    def spill(self):
+        if self.spill_folder is None:
+            self.spill_folder = tempfile.mkdtemp(
+                prefix="faldisco_value_matches_", dir=self.spill_root
             )
-            tvals = len(target_values)
-            trows = 0
-            mismatches = 0
-            total_values += len(target_values)
-            for tval in target_values.keys():
-                this_count = self.get_alignment(
-                    ref_field_name, target_field_name, rval, tval
-                )
-                if rval == ref_mfv or tval == target_mfv:
-                    # skip the mfv to mfv matches - they are meaningless for sparse fields
-                    # mfv to non-mfv matches are counted as mismatches
-                    if rval != ref_mfv or tval != target_mfv:
-                        mismatches += this_count
-                        total_rows += this_count
-                        trows += this_count
-                else:
-                    if check_for_exact_matches and rval == tval:
-                        matching_rows += this_count
-                    if (not is_unique) and this_count > max_count:
-                        max_count = this_count
-                    total_rows += this_count
-                    trows += this_count
-                    tvals += 1
-                    if target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY or (
-                            target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                            and ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    ):
-                        logger.info(
-                            f"FALDISCO__DEBUG: CALC_ALIGNMENT {ref_field_name}={rval} {target_field_name}={tval} match={str(this_count)}, max_count={str(max_count)}, "
-                            + f"trows={(trows)}, total_rows={(total_rows)}"
+        combinations = [
+            (r, t)
+            for r, target_fields in self.value_matches.items()
+            for t, table in target_fields.items()
+            if len(table[2]) > 0
+        ]
+        tables = [self.get_count_table(r, t) for r, t in combinations]
+        sizes = [len(counts) for _r, _t, counts in tables]
+        rows = np.empty(sum(sizes), dtype=SPILL_DTYPE)
+        rows["combination"] = np.repeat(
+            np.array([self.get_combination_id(r, t) for r, t in combinations], dtype=np.int64),
+            sizes,
+        )
+        rows["ref_value"] = np.concatenate([r for r, _t, _c in tables])
+        rows["target_value"] = np.concatenate([t for _r, t, _c in tables])
+        rows["count"] = np.concatenate([c for _r, _t, c in tables])
+        # combination ids are handed out at their first spill, not in the order of the count tables
+        rows = rows[np.argsort(rows["combination"], kind="stable")]
+        logger.info(
+            f"FALDISCO__DEBUG: spilling {len(rows)} value matches ({self.memory_bytes} bytes) of "
+            + f"{len(combinations)} combinations to {self.spill_folder}"
+        )
+        partitions = self.get_partitions(rows["ref_value"])
+        for p in range(self.spill_partitions):
+            # the rows of a partition stay sorted by combination
+            path = os.path.join(
+                self.spill_folder, f"value_matches_{len(self.spill_files[p])}_{p}.npy"
+            )
+            np.save(path, rows[partitions == p])
+            self.spill_files[p].append(path)
+        empty = np.zeros(0, dtype=np.int64)
+        for r, t in combinations:
+            self.set_count_table(r, t, (empty, empty, empty))
+
+    # the count tables of the combinations restricted to one partition: spilled rows in spill order, then the
+    # rows still in memory, so pairs keep their first appearance order
+    def get_partition_tables(
+            self, partition: int, combinations: [(str, str)]
+    ) -> [(np.ndarray, np.ndarray, np.ndarray)]:
+        combination_ids = [self.combination_ids.get(c, NO_VALUE_CODE) for c in combinations]
+        tables = [[] for _c in combinations]
+        for path in self.spill_files[partition]:
+            rows = np.load(path, mmap_mode="r")
+            spilled_combinations = rows["combination"]
+            for i, c in enumerate(combination_ids):
+                start, end = np.searchsorted(spilled_combinations, [c, c + 1])
+                if end > start:
+                    combination_rows = rows[start:end]
+                    tables[i].append(
+                        (
+                            np.array(combination_rows["ref_value"]),
+                            np.array(combination_rows["target_value"]),
+                            np.array(combination_rows["count"]),
                         )
-            # if the number of target values corresponding to this ref value < 1/threshold, we have a match
-            if (not is_unique) and (
-                    tvals == 1
-                    or (
-                            max_count > trows * ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD
-                            and tvals / ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD
                     )
-            ):
-                matching_values += 1
-            # total_rows = total_rows + this_count
-            aligned_rows = aligned_rows + max_count
-            if target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY or (
-                    target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    and ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-            ):
-                logger.info(
-                    f"FALDISCO__DEBUG: CALC_SPARSE_ALIGNMENT {ref_field_name}={rval} {target_field_name}={tval} aligned_rows={str(aligned_rows)} total_rows={str(total_rows)} mismatches={str(mismatches)}"
-                )
-        if total_rows > 0 and total_values > 0:
-            return (
-                aligned_rows / total_rows,
-                matching_rows / total_rows,
-                matching_values / total_values,
-                (total_rows - mismatches) / total_rows,
+        for i, (r, t) in enumerate(combinations):
+            table = self.get_count_table(r, t)
+            in_partition = self.get_partitions(table[0]) == partition
+            tables[i].append(tuple(a[in_partition] for a in table))
+        return [self.merge_count_tables(*table) for table in tables]
+
+    def cleanup(self):
+        # remove the spill files of this run
+        if self.spill_folder is not None:
+            shutil.rmtree(self.spill_folder, ignore_errors=True)
+            self.spill_folder = None
+            self.spill_files = [[] for _p in range(self.spill_partitions)]
+
+    def iter_count_tables(self, combinations: [(str, str)]):
+        # the count tables of the combinations, or one partition of them at a time once counts were spilled
+        if not self.is_spilled():
+            yield [self.get_count_table(r, t) for r, t in combinations]
+            return
+        for p in range(self.spill_partitions):
+            yield self.get_partition_tables(p, combinations)
+
+    def merge(self, other: "Value_Matches"):
+        # add the counts of another instance - of other rows of the same fields, like another partition of the
+        # tables. Its value codes are translated to the codes of this instance. Approximate summaries are merged
+        # and reduced again, and their row totals and distinct target counts add up
+        if other.base_dictionary is not None and other.base_dictionary is self.base_dictionary:
+            # both start from the same dictionary, only the values other added need new codes
+            codes = np.concatenate(
+                [
+                    np.arange(other.num_base_values, dtype=np.int64),
+                    np.array([self.encode_value(v) for v in other.values], dtype=np.int64),
+                ]
             )
         else:
-            return (0, 0, 0, 0)
+            codes = np.array(
+                [self.encode_value(other.decode_value(c)) for c in range(other.num_values())], dtype=np.int64
+            )
+        combinations = [
+            (r, t) for r, target_fields in other.value_matches.items() for t in target_fields.keys()
+        ]
+        for tables in other.iter_count_tables(combinations):
+            for (r, t), (ref_values, target_values, counts) in zip(combinations, tables):
+                if self.heavy_hitters <= 0:
+                    self.add_values(r, t, codes[ref_values], codes[target_values], counts)
+                    continue
+                self.set_count_table(
+                    r,
+                    t,
+                    Value_Matches.misra_gries(
+                        self.merge_count_tables(
+                            self.get_count_table(r, t), (codes[ref_values], codes[target_values], counts)
+                        ),
+                        self.heavy_hitters,
+                    ),
+                )
+        if self.heavy_hitters > 0:
+            for r, t in combinations:
+                ref_values, trows, distinct = self.get_ref_value_totals(r, t)
+                other_ref_values, other_trows, other_distinct = other.get_ref_value_totals(r, t)
+                refs, unique_refs = pd.factorize(np.concatenate([ref_values, codes[other_ref_values]]))
+                self.ref_value_totals[r][t] = (
+                    unique_refs,
+                    np.bincount(
+                        refs, weights=np.concatenate([trows, other_trows]), minlength=len(unique_refs)
+                    ).astype(np.int64),
+                    np.bincount(
+                        refs, weights=np.concatenate([distinct, other_distinct]), minlength=len(unique_refs)
+                    ).astype(np.int64),
+                )
+        for r, code in other.last_ref_values.items():
+            if code != NO_VALUE_CODE:
+                self.last_ref_values[r] = int(codes[code])
 
-    def calc_field_combination_alignment(
+    def get_delta(self, combinations: [(str, str)], num_values: int) -> {}:
+        # what counting combinations added, for a checkpoint that saved the first num_values values before: the
+        # new values, the count tables of the combinations still in memory, their approximate totals and the
+        # bookkeeping of spilled counts
+        return {
+            "values": self.values[num_values:],
+            "tables": {(r, t): self.get_count_table(r, t) for r, t in combinations},
+            "ref_value_totals": {
+                (r, t): self.get_ref_value_totals(r, t) for r, t in combinations if self.heavy_hitters > 0
+            },
+            "spill_folder": self.spill_folder,
+            "spill_files": [list(files) for files in self.spill_files],
+            "combination_ids": dict(self.combination_ids),
+            "last_ref_values": dict(self.last_ref_values),
+        }
+
+    def add_delta(self, delta: {}):
+        # restore the counts saved by get_delta, in the order they were saved
+        for v in delta["values"]:
+            self.encode_value(v)
+        if sum(len(files) for files in delta["spill_files"]) > sum(len(files) for files in self.spill_files):
+            # every count table in memory was spilled since the previous delta
+            empty = np.zeros(0, dtype=np.int64)
+            for r, target_fields in self.value_matches.items():
+                for t in list(target_fields.keys()):
+                    self.set_count_table(r, t, (empty, empty, empty))
+        self.spill_folder = delta["spill_folder"]
+        self.spill_files = delta["spill_files"]
+        self.combination_ids = delta["combination_ids"]
+        self.last_ref_values = delta["last_ref_values"]
+        for (r, t), table in delta["tables"].items():
+            self.set_count_table(r, t, table)
+        for (r, t), totals in delta["ref_value_totals"].items():
+            self.ref_value_totals.setdefault(r, {})[t] = totals
+
+    def get_ref_value_totals(
+            self, ref_field_name: str, target_field_name: str
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        # ref value codes, total rows and (upper bound of) distinct target values of every ref value
+        target_fields = self.ref_value_totals.setdefault(ref_field_name, {})
+        if target_field_name not in target_fields.keys():
+            empty = np.zeros(0, dtype=np.int64)
+            target_fields[target_field_name] = (empty, empty, empty)
+        return target_fields[target_field_name]
+
+    def add_values_approximately(
             self,
             ref_field_name: str,
             target_field_name: str,
-            profiles: {Field_Profiles},
-            check_for_exact_matches: bool,
+            ref_value_codes: np.ndarray,
+            target_value_codes: np.ndarray,
+            counts: np.ndarray,
     ):
-        aligned_rows = 0
-        matching_rows = 0
-        total_rows = 0
-        non_unique_rows = 0
-        total_values = 0
-        matching_values = 0
-        target_fp = profiles[target_field_name]
-        # if we have more than 2 values, filter out MFV matches
-        target_mfv = ""
-        if target_fp.get_field_cardinality() > 2:
-            target_mfv = target_fp.get_field_mfv()
-
-        ref_values = self.get_ref_values(ref_field_name, target_field_name)
-        for rval in ref_values.keys():
-            max_count = 0
-            max_tval = None
-            target_values = self.get_target_values(
-                ref_field_name, target_field_name, rval
+        # count this chunk exactly, then fold it into the bounded summary
+        chunk = self.merge_count_tables((ref_value_codes, target_value_codes, counts))
+        summary = self.get_count_table(ref_field_name, target_field_name)
+        # a chunk pair that is not in the summary is a new target value for its ref value - unless it was seen
+        # before and dropped, which is why the distinct target count is an upper bound
+        base = max(self.num_values(), 1)
+        new_pairs = ~np.isin(chunk[0] * base + chunk[1], summary[0] * base + summary[1])
+        ref_values, trows, distinct = self.get_ref_value_totals(
+            ref_field_name, target_field_name
+        )
+        ref_values = np.concatenate([ref_values, chunk[0]])
+        refs, unique_refs = pd.factorize(ref_values)
+        self.ref_value_totals[ref_field_name][target_field_name] = (
+            unique_refs,
+            np.bincount(
+                refs, weights=np.concatenate([trows, chunk[2]]), minlength=len(unique_refs)
+            ).astype(np.int64),
+            np.bincount(
+                refs, weights=np.concatenate([distinct, new_pairs]), minlength=len(unique_refs)
+            ).astype(np.int64),
+        )
+        self.set_count_table(
+            ref_field_name,
+            target_field_name,
+            Value_Matches.misra_gries(
+                self.merge_count_tables(summary, chunk), self.heavy_hitters
+            ),
+        )
+
+    @staticmethod
+    def misra_gries(
+            table: (np.ndarray, np.ndarray, np.ndarray), k: int
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        # mergeable Misra-Gries summary per ref value: subtract the (k+1)-th largest count of the ref value from
+        # its counters and keep at most k positive ones. The top counter is always kept, so every ref value
+        # stays in the table
+        ref_values, target_values, counts = table
+        order = np.lexsort((-counts, ref_values))
+        sorted_refs = ref_values[order]
+        is_start = np.r_[True, sorted_refs[1:] != sorted_refs[:-1]] if len(order) > 0 else np.zeros(0, dtype=bool)
+        groups = np.cumsum(is_start) - 1
+        starts = np.flatnonzero(is_start)
+        rank = np.arange(len(order)) - starts[groups]
+        sorted_counts = counts[order]
+        kth = np.zeros(len(starts), dtype=np.int64)
+        kth[groups[rank == k]] = sorted_counts[rank == k]
+        reduced = np.maximum(sorted_counts - kth[groups], 0)
+        keep = (rank == 0) | ((rank < k) & (reduced > 0))
+        reduced_counts = np.empty_like(counts)
+        reduced_counts[order] = reduced
+        # back to first appearance order
+        kept = np.sort(order[keep])
+        return ref_values[kept], target_values[kept], reduced_counts[kept]
+
+    @staticmethod
+    def make_ref_value_groups(tables: [(np.ndarray, np.ndarray, np.ndarray)]) -> Ref_Value_Groups:
+        # concatenate the count tables of all combinations, tagged with the combination's index
+        sizes = [len(counts) for _r, _t, counts in tables]
+        return Ref_Value_Groups(
+            np.repeat(np.arange(len(tables), dtype=np.int64), sizes),
+            np.concatenate([r for r, _t, _c in tables] + [np.zeros(0, dtype=np.int64)]),
+            np.concatenate([t for _r, t, _c in tables] + [np.zeros(0, dtype=np.int64)]),
+            np.concatenate([c for _r, _t, c in tables] + [np.zeros(0, dtype=np.int64)]),
+        )
+
+    def get_ref_value_groups(self, combinations: [(str, str)], exact_totals: bool = True) -> Ref_Value_Groups:
+        groups = Value_Matches.make_ref_value_groups(
+            [self.get_count_table(r, t) for r, t in combinations]
+        )
+        if self.heavy_hitters > 0 and exact_totals:
+            # the summaries only keep heavy hitters - take row totals and distinct target counts from the totals
+            totals = [self.get_ref_value_totals(r, t) for r, t in combinations]
+            sizes = [len(trows) for _r, trows, _d in totals]
+            keys = pd.Index(
+                np.repeat(np.arange(len(totals), dtype=np.int64), sizes) * (1 << 31)
+                + np.concatenate([r for r, _t, _d in totals] + [np.zeros(0, dtype=np.int64)])
             )
-            tvals = len(target_values)
-            trows = 0
-            total_values += len(target_values)
-            for tval in target_values.keys():
-                this_count = self.get_alignment(
-                    ref_field_name, target_field_name, rval, tval
-                )
-                if this_count > max_count:
-                    max_count = this_count
-                    max_tval = tval
-                if check_for_exact_matches:
-                    trace = "matches"
-                    if rval == tval:
-                        matching_rows += this_count
-                    else:
-                        trace = "mismatches"
+            rows = keys.get_indexer(
+                groups.group_combinations * (1 << 31) + groups.group_ref_values
+            )
+            groups.trows = np.concatenate(
+                [t for _r, t, _d in totals] + [np.zeros(0, dtype=np.int64)]
+            )[rows]
+            groups.num_target_values = np.concatenate(
+                [d for _r, _t, d in totals] + [np.zeros(0, dtype=np.int64)]
+            )[rows]
+        return groups
 
-                    if (
-                            ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                            or target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                            or (
-                            ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                            and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    )
-                    ):
-                        logger.info(
-                            f"FALDISCO__DEBUG: CALC_ALIGNMENT: found {this_count} exact {trace} between {ref_field_name}={rval} and {target_field_name}={tval}. this count={this_count}, matching_rows = {matching_rows}"
-                        )
-                trows += this_count
-                total_rows += this_count
-                tvals += 1
-                if (
-                        ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                        or target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                        or (
-                        ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                        and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                )
-                ):
-                    logger.info(
-                        f"FALDISCO__DEBUG: CALC_ALIGNMENT found alignment between {ref_field_name}={rval} {target_field_name}={max_tval} for {max_count} aligned rows"
-                    )
-            # if the number of target values corresponding to this ref value < 1/threshold,
-            # the target value is not a sigle row and target value is not target field mfv,
-            # we have a match
+    def iter_ref_value_groups(self, combinations: [(str, str)], exact_totals: bool = True):
+        # the groups of all combinations at once, or one partition at a time once counts were spilled.
+        # exact_totals takes the row totals and distinct target counts of approximate counts from the exact
+        # totals instead of the summaries
+        if not self.is_spilled():
+            yield self.get_ref_value_groups(combinations, exact_totals)
+            return
+        for p in range(self.spill_partitions):
+            yield Value_Matches.make_ref_value_groups(
+                self.get_partition_tables(p, combinations)
+            )
+
+    def get_last_ref_values(
+            self, combinations: [(str, str)], groups: Ref_Value_Groups
+    ) -> np.ndarray:
+        if not self.is_spilled():
+            return Alignment_Kernel.last_ref_values(groups, len(combinations))
+        return np.array(
+            [self.last_ref_values.get(r, NO_VALUE_CODE) for r, _t in combinations],
+            dtype=np.int64,
+        )
+
+    def get_mfv_codes(
+            self, field_names: [str], other_field_names: [str], profiles: Field_Profiles_Store
+    ) -> np.ndarray:
+        # codes of the mfvs of the fields, as they are encoded in the combinations with the other fields
+        return np.array(
+            [
+                self.get_value_code(profiles.get_combination_mfv(f, o))
+                for f, o in zip(field_names, other_field_names)
+            ],
+            dtype=np.int64,
+        )
+
+    def trace_ref_value_groups(
+            self, groups: Ref_Value_Groups, combinations: [(str, str)], msg: str
+    ):
+        for i, (r, t) in enumerate(combinations):
             if (
-                    tvals == 1
-                    or max_tval == target_mfv
+                    r in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
+                    or t in self.context.TRACE_RECORDS_FOR_FIELDS_ANY
                     or (
-                    max_count > trows * ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD
-                    and tvals / ALIGNMENT_VALUE_ROW_MATCH_THRESHOLD
+                    r in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                    and t in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
             )
             ):
-                matching_values += 1
-            # if we do not have a unique value, adjust aligned row count
-            if trows > 1:
-                non_unique_rows += trows
-                aligned_rows += max_count
-                if (
-                        ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                        or target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY
-                        or (
-                        ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                        and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                )
-                ):
+                for g in np.flatnonzero(groups.group_combinations == i):
                     logger.info(
-                        f"FALDISCO__DEBUG: CALC_ALIGNMENT {ref_field_name}={rval} {target_field_name}={tval} aligned_rows={aligned_rows} non_unique_rows={non_unique_rows}, total_rows={total_rows}"
+                        f"FALDISCO__DEBUG: {msg} {r}={self.decode_value(groups.group_ref_values[g])} "
+                        + f"{t}={self.decode_value(groups.max_target_values[g])} max_count={groups.max_counts[g]}, "
+                        + f"trows={groups.trows[g]}, tvals={groups.num_target_values[g]}"
                     )
-        return (
-            aligned_rows / non_unique_rows,
-            matching_rows / total_rows,
-            matching_values / total_values,
+
+    # score all combinations in one batched call - returns arrays of alignment, exact match strength,
+    # value match strength and non-mfv row alignment, one entry per combination
+    def calc_sparse_field_combination_alignments(
+            self,
+            combinations: [(str, str)],
+            profiles: Field_Profiles_Store,
+            check_for_exact_matches: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        ref_field_names = [r for r, _t in combinations]
+        target_field_names = [t for _r, t in combinations]
+        is_unique = profiles.is_unique[profiles.get_field_ids(ref_field_names)] | (
+            profiles.is_unique[profiles.get_field_ids(target_field_names)]
+        )
+        ref_mfvs = self.get_mfv_codes(ref_field_names, target_field_names, profiles)
+        target_mfvs = self.get_mfv_codes(target_field_names, ref_field_names, profiles)
+        sums = None
+        for groups in self.iter_ref_value_groups(combinations, False):
+            self.trace_ref_value_groups(groups, combinations, "CALC_SPARSE_ALIGNMENT")
+            partition_sums = Alignment_Kernel.sparse_alignment_sums(
+                groups,
+                len(combinations),
+                ref_mfvs,
+                target_mfvs,
+                is_unique,
+                np.asarray(check_for_exact_matches, dtype=bool),
+                self.get_last_ref_values(combinations, groups),
+            )
+            sums = partition_sums if sums is None else tuple(
+                a + b for a, b in zip(sums, partition_sums)
+            )
+        return Alignment_Kernel.sparse_alignment_ratios(sums)
+
+    def calc_sparse_field_combination_alignment(
+            self,
+            ref_field_name: str,
+            target_field_name: str,
+            profiles: Field_Profiles_Store,
+            check_for_exact_matches: bool,
+    ):
+        scores = self.calc_sparse_field_combination_alignments(
+            [(ref_field_name, target_field_name)], profiles, [check_for_exact_matches]
+        )
+        return tuple(float(s[0]) for s in scores)
+
+    # score all combinations in one batched call - returns arrays of alignment, exact match strength and
+    # value match strength, one entry per combination
+    def calc_field_combination_alignments(
+            self,
+            combinations: [(str, str)],
+            profiles: Field_Profiles_Store,
+            check_for_exact_matches: np.ndarray,
+    ) -> (np.ndarray, np.ndarray, np.ndarray):
+        # if we have more than 2 values, filter out MFV matches
+        target_mfvs = np.array(
+            [
+                self.get_value_code(profiles.get_combination_mfv(t, r))
+                if profiles.get_field_cardinality(t) > 2
+                else self.get_value_code("")
+                for r, t in combinations
+            ],
+            dtype=np.int64,
+        )
+        sums = None
+        for groups in self.iter_ref_value_groups(combinations):
+            self.trace_ref_value_groups(groups, combinations, "CALC_ALIGNMENT")
+            partition_sums = Alignment_Kernel.alignment_sums(
+                groups,
+                len(combinations),
+                target_mfvs,
+                np.asarray(check_for_exact_matches, dtype=bool),
+            )
+            sums = partition_sums if sums is None else tuple(
+                a + b for a, b in zip(sums, partition_sums)
+            )
+        return Alignment_Kernel.alignment_ratios(sums)
+
+    def calc_field_combination_alignment(
+            self,
+            ref_field_name: str,
+            target_field_name: str,
+            profiles: Field_Profiles_Store,
+            check_for_exact_matches: bool,
+    ):
+        scores = self.calc_field_combination_alignments(
+            [(ref_field_name, target_field_name)], profiles, [check_for_exact_matches]
         )
+        return tuple(float(s[0]) for s in scores)
 
-    def add_alignment_values_to_df(
+    def write_alignment_values(
             self,
             ref_table_namespace: str,
             ref_table_name: str,
@@ -278,119 +683,80 @@ class Value_Matches:
             target_table_name: str,
             target_field_name: str,
             alignment_type: str,
-            df: DataFrame,
-            row_num: int,
-    ) -> int:
-        orig_ref_field_name = fg.make_orig_field_name(ref_field_name)
-        orig_target_field_name = fg.make_orig_field_name(target_field_name)
-        ref_values = self.get_ref_values(ref_field_name, target_field_name)
-        for rval in ref_values.keys():
-            max_count = 0
-            max_tval = None
-            target_values = self.get_target_values(
-                ref_field_name, target_field_name, rval
-            )
-            trows = 0
-            tvals = 0
-            for tval in target_values.keys():
-                this_count = self.get_alignment(
-                    ref_field_name, target_field_name, rval, tval
-                )
-                if this_count > max_count:
-                    max_count = this_count
-                    max_tval = tval
-                trows += this_count
-                tvals += 1
-
-            if (
-                    (ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY)
-                    or (target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY)
-                    or (
-                    ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                    and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-            )
-            ):
-                logger.info(
-                    f"FALDISCO__DEBUG: adding value alignment[{row_num}]: {ref_field_name}={rval}, {target_field_name}={max_tval}, {alignment_type}, alignment={max_count}, misalignment={trows - max_count}"
-                )
-            # add rval and max_tval to results
-            df.loc[row_num] = [
-                ref_table_namespace,
-                ref_table_name,
-                orig_ref_field_name,
-                target_table_namespace,
-                target_table_name,
-                orig_target_field_name,
-                str(rval),
-                str(max_tval),
-                alignment_type,
-                max_count,
-                trows - max_count,
-            ]
-            row_num += 1
-        return row_num
-
-
-def add_sparse_alignment_values_to_df(
-        self,
-        ref_table_namespace: str,
-        ref_table_name: str,
-        ref_field_name: str,
-        target_table_namespace: str,
-        target_table_name: str,
-        target_field_name: str,
-        ref_mfv: str,
-        target_mfv: str,
-        alignment_type: str,
-        df: DataFrame,
-        row_num: int,
-) -> int:
-    orig_ref_field_name = fg.make_orig_field_name(ref_field_name)
-    orig_target_field_name = fg.make_orig_field_name(target_field_name)
-    ref_values = self.get_ref_values(ref_field_name, target_field_name)
-    for rval in ref_values.keys():
-        if rval != ref_mfv:
-            max_count = 0
-            max_tval = None
-            target_values = self.get_target_values(
-                ref_field_name, target_field_name, rval
-            )
-            trows = 0
-            tvals = 0
-            for tval in target_values.keys():
-                this_count = self.get_alignment(
-                    ref_field_name, target_field_name, rval, tval
-                )
-                if this_count > max_count:
-                    max_count = this_count
-                    max_tval = tval
-                trows += this_count
-                tvals += 1
-            if max_tval != target_mfv:
-                # add rval and max_tval to results
+            writer: Value_Alignment_Writer,
+    ):
+        writer.start_combination(
+            ref_table_namespace,
+            ref_table_name,
+            fg.make_orig_field_name(ref_field_name),
+            target_table_namespace,
+            target_table_name,
+            fg.make_orig_field_name(target_field_name),
+            alignment_type,
+        )
+        # stream one partition of groups at a time
+        for groups in self.iter_ref_value_groups([(ref_field_name, target_field_name)]):
+            for g in range(groups.num_groups()):
+                rval = self.decode_value(groups.group_ref_values[g])
+                max_tval = self.decode_value(groups.max_target_values[g])
+                max_count = int(groups.max_counts[g])
+                trows = int(groups.trows[g])
                 if (
-                        (ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY)
-                        or (target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ANY)
+                        (ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY)
+                        or (target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY)
                         or (
-                        ref_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
-                        and target_field_name in fg.TRACE_RECORDS_FOR_FIELDS_ALL
+                        ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                        and target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
                 )
                 ):
                     logger.info(
-                        f"FALDISCO__DEBUG: adding sparse value alignment[{row_num}]: {ref_field_name}={rval}, {target_field_name}={max_tval}, {alignment_type}, alignment={max_count}, misalignment={trows - max_count}"
+                        f"FALDISCO__DEBUG: adding value alignment[{writer.num_rows}]: {ref_field_name}={rval}, {target_field_name}={max_tval}, {alignment_type}, alignment={max_count}, misalignment={trows - max_count}"
                     )
-                df.loc[row_num] = [
-                    ref_table_namespace,
-                    ref_table_name,
-                    orig_ref_field_name,
-                    target_table_namespace,
-                    target_table_name,
-                    orig_target_field_name,
-                    str(rval),
-                    str(max_tval),
-                    alignment_type,
-                    max_count,
-                    trows - max_count,
-                ]
-                row_num += 1
-    return row_num
+                # add rval and max_tval to results
+                writer.add_value(str(rval), str(max_tval), max_count, trows - max_count)
+        writer.end_combination()
+
+    def write_sparse_alignment_values(
+            self,
+            ref_table_namespace: str,
+            ref_table_name: str,
+            ref_field_name: str,
+            target_table_namespace: str,
+            target_table_name: str,
+            target_field_name: str,
+            ref_mfv: str,
+            target_mfv: str,
+            alignment_type: str,
+            writer: Value_Alignment_Writer,
+    ):
+        writer.start_combination(
+            ref_table_namespace,
+            ref_table_name,
+            fg.make_orig_field_name(ref_field_name),
+            target_table_namespace,
+            target_table_name,
+            fg.make_orig_field_name(target_field_name),
+            alignment_type,
+        )
+        # stream one partition of groups at a time
+        for groups in self.iter_ref_value_groups([(ref_field_name, target_field_name)], False):
+            for g in range(groups.num_groups()):
+                rval = self.decode_value(groups.group_ref_values[g])
+                max_tval = self.decode_value(groups.max_target_values[g])
+                if rval != ref_mfv and max_tval != target_mfv:
+                    max_count = int(groups.max_counts[g])
+                    trows = int(groups.trows[g])
+                    # add rval and max_tval to results
+                    if (
+                            (ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY)
+                            or (target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ANY)
+                            or (
+                            ref_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                            and target_field_name in self.context.TRACE_RECORDS_FOR_FIELDS_ALL
+                    )
+                    ):
+                        logger.info(
+                            f"FALDISCO__DEBUG: adding sparse value alignment[{writer.num_rows}]: {ref_field_name}={rval}, {target_field_name}={max_tval}, {alignment_type}, alignment={max_count}, misalignment={trows - max_count}"
+                        )
+                    writer.add_value(str(rval), str(max_tval), max_count, trows - max_count)
+        writer.end_combination()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import base64
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from faldisco_context import Faldisco_Context
+from field_profiles import (
+    VALUE_KIND_DATETIME,
+    VALUE_KIND_NUMBER,
+    VALUE_KIND_TEXT,
+)
+
+logger = logging.getLogger(__name__)
+
+# scaled numbers are rounded to this many decimals so that float noise does not hide matches
+SCALE_DECIMALS = 9
+
+
+# library of deterministic functions f, used to find target = f(ref) matches beyond the identity. Every transform
+# maps a column of ref values to a column of transformed values, NULL where it does not apply. Text transforms
+# work on the canonical value text, number and datetime transforms on the native values
+class Value_Transforms:
+    def __init__(self):
+        return
+
+    @staticmethod
+    def map_distinct(texts: pd.Series, f) -> pd.Series:
+        # apply a python function once per distinct value
+        codes, uniques = pd.factorize(texts)
+        mapped = np.array([f(v) for v in uniques] + [None], dtype=object)
+        return pd.Series(mapped[codes], index=texts.index)
+
+    @staticmethod
+    def digest(algorithm: str):
+        return lambda v: hashlib.new(algorithm, v.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def to_base64(v: str) -> str:
+        return base64.b64encode(v.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def digits(texts: pd.Series) -> pd.Series:
+        digits = texts.str.replace(r"\D", "", regex=True)
+        return digits.where(digits != "", None)
+
+    @staticmethod
+    def prefix(length: int):
+        return lambda texts: texts.str.slice(0, length).where(texts.str.len() > length, None)
+
+    @staticmethod
+    def suffix(length: int):
+        return lambda texts: texts.str.slice(-length).where(texts.str.len() > length, None)
+
+    @staticmethod
+    def epoch_to_datetime(unit: str):
+        return lambda numbers: pd.Series(
+            pd.to_datetime(numbers, unit=unit, errors="coerce"), index=numbers.index
+        )
+
+    @staticmethod
+    def datetime_to_epoch(unit: str):
+        def to_epoch(datetimes: pd.Series) -> pd.Series:
+            if datetimes.dt.tz is not None:
+                datetimes = datetimes.dt.tz_convert("UTC").dt.tz_localize(None)
+            # NaT becomes NaN
+            return (datetimes - pd.Timestamp(0)) // pd.Timedelta(1, unit=unit)
+
+        return to_epoch
+
+    @staticmethod
+    def scale(factor: float):
+        return lambda numbers: (numbers * factor).round(SCALE_DECIMALS)
+
+    @staticmethod
+    def get_text_transforms(value_kind: str, context: Faldisco_Context) -> [(str, object)]:
+        transforms = []
+        if value_kind == VALUE_KIND_TEXT:
+            transforms += [
+                ("lower", lambda texts: texts.str.lower()),
+                ("upper", lambda texts: texts.str.upper()),
+                ("trim", lambda texts: texts.str.strip()),
+                ("lower trim", lambda texts: texts.str.strip().str.lower()),
+                ("digits", Value_Transforms.digits),
+            ]
+        for algorithm in context.FIELD_TRANSFORM_HASHES:
+            transforms.append(
+                (
+                    algorithm,
+                    lambda texts, a=algorithm: Value_Transforms.map_distinct(
+                        texts, Value_Transforms.digest(a)
+                    ),
+                )
+            )
+        transforms.append(
+            (
+                "base64",
+                lambda texts: Value_Transforms.map_distinct(texts, Value_Transforms.to_base64),
+            )
+        )
+        for length in context.FIELD_TRANSFORM_AFFIX_LENGTHS:
+            transforms.append((f"prefix {length}", Value_Transforms.prefix(length)))
+            transforms.append((f"suffix {length}", Value_Transforms.suffix(length)))
+        return transforms
+
+    @staticmethod
+    def get_native_transforms(value_kind: str, context: Faldisco_Context) -> [(str, object)]:
+        transforms = []
+        if value_kind == VALUE_KIND_NUMBER:
+            transforms += [
+                ("epoch seconds to datetime", Value_Transforms.epoch_to_datetime("s")),
+                ("epoch milliseconds to datetime", Value_Transforms.epoch_to_datetime("ms")),
+            ]
+            for factor in context.FIELD_TRANSFORM_SCALES:
+                transforms.append((f"times {factor}", Value_Transforms.scale(factor)))
+                transforms.append((f"divided by {factor}", Value_Transforms.scale(1 / factor)))
+        elif value_kind == VALUE_KIND_DATETIME:
+            transforms += [
+                ("datetime to epoch seconds", Value_Transforms.datetime_to_epoch("s")),
+                ("datetime to epoch milliseconds", Value_Transforms.datetime_to_epoch("ms")),
+            ]
+        return transforms
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import random
+import sqlite3
+
+# tables of the regression tests. They import nothing of src, so the expected results can be regenerated with
+# the baseline sources
+
+
+def make_regression_tables(connection: sqlite3.Connection):
+    # a reference and a target table with a field of every kind of alignment: exact matches of every value kind,
+    # including the same values as a number and as text, an alignment, sparse fields, a constant and noise
+    rnd = random.Random(7)
+    connection.execute(
+        "create table users (id integer, age integer, city varchar(20), zip varchar(10), email varchar(40), "
+        + "country varchar(10), vip integer, score real, signup varchar(20))"
+    )
+    connection.execute(
+        "create table events (id integer, age_txt varchar(10), state varchar(20), zip_code varchar(10), "
+        + "contact varchar(40), flag varchar(5), amount real, noise integer, signup_date varchar(20))"
+    )
+    for i in range(600):
+        age = 18 + rnd.randrange(60)
+        city = rnd.randrange(30)
+        zip_code = f"{10000 + rnd.randrange(400)}"
+        vip = 1 if rnd.random() < 0.03 else 0
+        score = round(rnd.random() * 100, 2)
+        signup = f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}"
+        email = f"user{i}@example.com" if rnd.random() < 0.9 else None
+        connection.execute(
+            "insert into users values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (i, age, f"city{city}", zip_code, email, "US", vip, score, signup),
+        )
+        # a few target rows disagree with their reference row
+        if rnd.random() < 0.05:
+            age = 18 + rnd.randrange(60)
+            zip_code = f"{10000 + rnd.randrange(400)}"
+        connection.execute(
+            "insert into events values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                i,
+                str(age),
+                f"state{city % 9}",
+                zip_code,
+                email,
+                "Y" if vip else "N",
+                round(score * 3, 2),
+                rnd.randrange(1000),
+                signup,
+            ),
+        )
+    connection.commit()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import sqlite3
+
+import pandas as pd
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+from field_alignment import Field_Alignment
+
+# output folder of the runs, relative to the working directory of the test
+OUTPUT_FOLDER = "out/"
+
+
+# runs write their outputs to OUTPUT_FOLDER of the test's folder; monkeypatch restores the working directory and
+# faldisco_globals after the test
+def use_output_folder(monkeypatch, folder: str):
+    monkeypatch.chdir(folder)
+    monkeypatch.setattr(fg, "FALDISCO_OUTPUT_FOLDER", OUTPUT_FOLDER)
+    os.makedirs(f"{OUTPUT_FOLDER}{OUTPUT_FOLDER}", exist_ok=True)
+
+
+# runs a reference table against a target table of a SQLite database: the sample is fetched with the query of
+# the run, or in slices, like FaldiscoUtils.find_alignment does, and the run writes its value alignments to
+# the output folder of use_output_folder
+def run_alignment(
+        connection: sqlite3.Connection,
+        ref_table_name: str,
+        ref_field_names: [str],
+        target_table_name: str,
+        target_field_names: [str],
+        join_keys: [str],
+        **settings,
+) -> Field_Alignment:
+    fa = Field_Alignment(
+        "main",
+        ref_table_name,
+        "main",
+        target_table_name,
+        join_keys,
+        ref_field_names,
+        target_field_names,
+        context=Faldisco_Context(**settings),
+    )
+    if fa.is_sliced():
+        slices = []
+        for query in fa.gen_slice_sqls():
+            fa.add_slice(slices, pd.read_sql(query, connection, dtype_backend="numpy_nullable"))
+        fa.set_slices(slices)
+    else:
+        fa.df = pd.read_sql(fa.gen_sql(), connection, dtype_backend="numpy_nullable")
+    fa.find_field_alignment()
+    return fa
+
+
+def get_alignments(fa: Field_Alignment) -> {(str, str, str): float}:
+    # alignment strength by (reference field, target field, alignment type)
+    return {
+        (row.reference_field_name, row.target_field_name, row.alignment_type): row.alignment_strength
+        for row in fa.results_df.itertuples()
+    }
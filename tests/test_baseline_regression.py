@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from fixture_tables import make_regression_tables
+from sqlite_fixture import get_alignments, run_alignment, use_output_folder
+
+# field alignments of the baseline sources on the regression tables, without transforms - the baseline had none.
+# The sparse fields of the tables are left out, the baseline fails writing sparse alignments
+BASELINE_FIELD_ALIGNMENTS = os.path.join(os.path.dirname(__file__), "data", "baseline_field_alignments.csv")
+REF_FIELD_NAMES = ["age", "city", "zip", "email", "country", "score", "signup"]
+TARGET_FIELD_NAMES = ["age_txt", "state", "zip_code", "contact", "amount", "noise", "signup_date"]
+
+
+def get_baseline_alignments() -> {(str, str, str): float}:
+    df = pd.read_csv(BASELINE_FIELD_ALIGNMENTS)
+    return {
+        (row.reference_field_name, row.target_field_name, row.alignment_type): row.alignment_strength
+        for row in df.itertuples()
+    }
+
+
+# the ways of counting must not change the results: small chunks, spilled counts, no sketch pruning and
+# approximate counts with more counters than target values; nor must fetching the sample in slices
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {},
+        {"VALUE_MATCHES_CHUNK_ROWS": 64},
+        {"VALUE_MATCHES_MEMORY_LIMIT": 4096, "VALUE_MATCHES_SPILL_PARTITIONS": 4},
+        {"FALDISCO_SKETCH_PRUNING": False},
+        {"VALUE_MATCHES_HEAVY_HITTERS": 1000},
+        {"FALDISCO_SLICE_COLUMNS": 3},
+    ],
+)
+def test_field_alignments_match_baseline(tmp_path, monkeypatch, settings):
+    use_output_folder(monkeypatch, tmp_path)
+    connection = sqlite3.connect(":memory:")
+    make_regression_tables(connection)
+    fa = run_alignment(
+        connection,
+        "users",
+        REF_FIELD_NAMES,
+        "events",
+        TARGET_FIELD_NAMES,
+        ["id"],
+        FALDISCO_TRANSFORMS=False,
+        VALUE_MATCHES_SPILL_FOLDER=str(tmp_path),
+        **settings,
+    )
+    assert get_alignments(fa) == pytest.approx(get_baseline_alignments())
+
+
+# two values per field fit in the counters of any summary, so approximate counts score sparse fields exactly
+@pytest.mark.parametrize("settings", [{}, {"VALUE_MATCHES_HEAVY_HITTERS": 2}])
+def test_sparse_alignment(tmp_path, monkeypatch, settings):
+    use_output_folder(monkeypatch, tmp_path)
+    connection = sqlite3.connect(":memory:")
+    make_regression_tables(connection)
+    fa = run_alignment(
+        connection,
+        "users",
+        ["vip", "city"],
+        "events",
+        ["flag", "state"],
+        ["id"],
+        FALDISCO_TRANSFORMS=False,
+        **settings,
+    )
+    assert get_alignments(fa)[("vip", "flag", "sparse alignment")] == 1.0
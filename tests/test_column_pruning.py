@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table, create_engine
+
+from column_pruning import Column_Pruning
+from faldisco_context import Faldisco_Context
+
+# catalog statistics by column: (fraction of NULLs, number of distinct values, fraction of the most frequent value)
+COLUMN_STATS = {
+    "constant": (0.0, 1, 1.0),
+    "mostly_one_value": (0.0, 5, 0.995),
+    "all_null": (0.9995, 0, None),
+    "one_value": (None, 1, None),
+    "varied": (0.1, 500, 0.01),
+}
+
+
+def test_parse_mysql_singleton_histogram():
+    # [value, cumulative frequency] per distinct value
+    histogram = {"histogram-type": "singleton", "null-values": 0.1, "buckets": [["a", 0.5], ["b", 0.9]]}
+    null_fraction, distinct, mfv_fraction = Column_Pruning.parse_mysql_histogram(histogram)
+    assert (null_fraction, distinct) == (0.1, 2)
+    assert abs(mfv_fraction - 0.5) < 1e-9
+
+
+def test_parse_mysql_equi_height_histogram():
+    # [lower, upper, cumulative frequency, number of distinct values] per bucket
+    histogram = {
+        "histogram-type": "equi-height",
+        "null-values": 0.0,
+        "buckets": [[1, 10, 0.5, 10], [11, 20, 1.0, 8]],
+    }
+    assert Column_Pruning.parse_mysql_histogram(histogram) == (0.0, 18, None)
+    assert Column_Pruning.parse_mysql_histogram({"histogram-type": "equi-height", "buckets": []}) == (None, None, None)
+
+
+def make_table() -> Table:
+    return Table(
+        "events",
+        MetaData(),
+        Column("id", Integer),
+        Column("ds", String(10)),
+        Column("payload", LargeBinary),
+        Column("constant", String(10)),
+        Column("mostly_one_value", String(10)),
+        Column("all_null", String(10)),
+        Column("one_value", Integer, nullable=False),
+        Column("varied", String(10)),
+    )
+
+
+def prune_columns(monkeypatch, context: Faldisco_Context = None) -> [str]:
+    monkeypatch.setattr(
+        Column_Pruning, "get_column_stats", staticmethod(lambda engine, schema_name, table_name: COLUMN_STATS)
+    )
+    return Column_Pruning.prune_columns(create_engine("sqlite://"), "main", make_table(), ["id"], context)
+
+
+def test_prune_columns(monkeypatch):
+    # only columns with more than FALDISCO_CATALOG_CONSTANT_THRESHOLD of one value or NULLs are dropped
+    assert prune_columns(monkeypatch) == ["id", "mostly_one_value", "varied"]
+
+
+def test_prune_columns_with_the_settings_of_the_run(monkeypatch):
+    assert prune_columns(monkeypatch, Faldisco_Context(FALDISCO_CATALOG_CONSTANT_THRESHOLD=0.99)) == ["id", "varied"]
+    assert prune_columns(monkeypatch, Faldisco_Context(FALDISCO_CATALOG_PRUNING=False)) == [
+        "id",
+        "constant",
+        "mostly_one_value",
+        "all_null",
+        "one_value",
+        "varied",
+    ]
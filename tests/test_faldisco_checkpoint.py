@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from faldisco_checkpoint import CHECKPOINT_STAGE_SAMPLE, Faldisco_Checkpoint
+from faldisco_context import Faldisco_Context
+from field_alignment import Field_Alignment
+from fixture_tables import make_regression_tables
+from sqlite_fixture import OUTPUT_FOLDER, get_alignments, run_alignment, use_output_folder
+from value_matches import Value_Matches
+
+REF_FIELD_NAMES = ["age", "city", "zip", "email", "vip", "signup"]
+TARGET_FIELD_NAMES = ["age_txt", "state", "zip_code", "contact", "flag", "signup_date"]
+
+
+class Crash(Exception):
+    pass
+
+
+def make_alignment(context: Faldisco_Context) -> Field_Alignment:
+    return Field_Alignment(
+        "main", "users", "main", "events", ["id"], REF_FIELD_NAMES, TARGET_FIELD_NAMES, context=context
+    )
+
+
+# a run that crashes while counting resumes from the deltas saved after every combination - also when counts
+# were spilled between two deltas - and finds what an uninterrupted run finds
+@pytest.mark.parametrize("crash_at", [3, 6, 9])
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {},
+        {"VALUE_MATCHES_MEMORY_LIMIT": 8192, "VALUE_MATCHES_SPILL_PARTITIONS": 2},
+        {"VALUE_MATCHES_HEAVY_HITTERS": 4},
+    ],
+)
+def test_resume_from_deltas(tmp_path, monkeypatch, crash_at, settings):
+    use_output_folder(monkeypatch, tmp_path)
+    connection = sqlite3.connect(":memory:")
+    make_regression_tables(connection)
+    settings = dict(settings, FALDISCO_TRANSFORMS=False, FALDISCO_CHECKPOINT_COMBINATIONS=1)
+    expected = get_alignments(
+        run_alignment(connection, "users", REF_FIELD_NAMES, "events", TARGET_FIELD_NAMES, ["id"], **settings)
+    )
+    value_alignments_path = f"{OUTPUT_FOLDER}{OUTPUT_FOLDER}users_to_events_value_alignments"
+    expected_value_alignments = pd.read_csv(value_alignments_path)
+
+    checkpoint = Faldisco_Checkpoint("run", str(tmp_path / "checkpoints"))
+    fa = make_alignment(Faldisco_Context(**settings))
+    fa.df = pd.read_sql(fa.gen_sql(), connection, dtype_backend="numpy_nullable")
+    fa.save_checkpoint(checkpoint, CHECKPOINT_STAGE_SAMPLE)
+    add_column_values = Value_Matches.add_column_values
+    calls = []
+
+    def crashing_add_column_values(self, *args):
+        calls.append(1)
+        if len(calls) == crash_at:
+            raise Crash()
+        return add_column_values(self, *args)
+
+    monkeypatch.setattr(Value_Matches, "add_column_values", crashing_add_column_values)
+    with pytest.raises(Crash):
+        fa.find_field_alignment(checkpoint, CHECKPOINT_STAGE_SAMPLE)
+    assert checkpoint.get_num_deltas() > 0
+    monkeypatch.setattr(Value_Matches, "add_column_values", add_column_values)
+
+    resumed = make_alignment(Faldisco_Context(**settings))
+    stage = resumed.restore_checkpoint(checkpoint)
+    assert resumed.num_processed_combinations > 0
+    resumed.find_field_alignment(checkpoint, stage)
+    assert get_alignments(resumed) == pytest.approx(expected)
+    pd.testing.assert_frame_equal(pd.read_csv(value_alignments_path), expected_value_alignments)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+from faldisco_results import Faldisco_Results
+from field_profiles import Field_Profiles, Field_Profiles_Store
+from value_alignment_writer import Value_Alignment_Writer
+from value_matches import Value_Matches
+
+
+# results of one target field: matches are (ref field, selectivity, alignment type, strength), added in order
+def dedup(path: str, matches: [(str, float, str, float)], **settings) -> [(str, str, float)]:
+    context = Faldisco_Context(**settings)
+    field_names = [r for r, _selectivity, _alignment_type, _strength in matches] + ["t__x"]
+    store = Field_Profiles_Store(field_names, ["db"] * len(field_names), ["t"] * len(field_names))
+    for r, selectivity, _alignment_type, _strength in matches:
+        store.set_profile(r, Field_Profiles(100, int(100 * selectivity), selectivity, 1, 1, 1, "a", "b", "a"))
+    store.set_profile("t__x", Field_Profiles(100, 100, 1.0, 1, 1, 1, "a", "b", "a"))
+    ref_field_names = field_names[:-1]
+    results = Faldisco_Results(
+        store,
+        "db",
+        "r",
+        "db",
+        "t",
+        Value_Matches(ref_field_names, ["t__x"], context),
+        Value_Matches(ref_field_names, ["t__x"], context),
+        Value_Alignment_Writer(path, context),
+        context,
+    )
+    for r, _selectivity, alignment_type, strength in matches:
+        results.add_match(r, "t__x", alignment_type, strength)
+    df = results.dedup_results()
+    return list(zip(df.reference_field_name, df.alignment_type, df.alignment_strength))
+
+
+def test_top_k_per_alignment_type(tmp_path):
+    matches = [(f"r__{i}", 0.5, fg.ALIGNMENT_TYPE_EXACT_MATCH, 0.5) for i in range(3)] + [
+        (f"r__a{i}", 0.5, fg.ALIGNMENT_TYPE_ALIGNMENT, 0.9) for i in range(3)
+    ]
+    results = dedup(str(tmp_path / "values.csv"), matches, FALDISCO_RESULTS_TOP_K_PER_TYPE={fg.ALIGNMENT_TYPE_EXACT_MATCH: 2})
+    assert [r for r, alignment_type, _strength in results if alignment_type == fg.ALIGNMENT_TYPE_EXACT_MATCH] == [
+        "0",
+        "1",
+    ]
+    assert [r for r, alignment_type, _strength in results if alignment_type == fg.ALIGNMENT_TYPE_ALIGNMENT] == [
+        "a0",
+        "a1",
+        "a2",
+    ]
+
+
+def test_other_alignments_raised_the_max_ratio(tmp_path):
+    # ratios 1.8, 4.75 and 4.0 - with a threshold of 1, the 4.0 alignment is only another alignment when it came
+    # before the stronger 4.75 one
+    a = ("r__a", 0.5, fg.ALIGNMENT_TYPE_ALIGNMENT, 0.9)
+    b = ("r__b", 0.2, fg.ALIGNMENT_TYPE_ALIGNMENT, 0.95)
+    c = ("r__c", 0.2, fg.ALIGNMENT_TYPE_ALIGNMENT, 0.8)
+    assert [r for r, _t, _s in dedup(str(tmp_path / "values.csv"), [a, b, c], ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD=1.0)] == ["b"]
+    assert [r for r, _t, _s in dedup(str(tmp_path / "values.csv"), [a, c, b], ALIGNMENT_SELECTIVITY_RATIO_THRESHOLD=1.0)] == ["b", "c"]
+    assert [r for r, _t, _s in dedup(str(tmp_path / "values.csv"), [a, c, b])] == ["b"]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+import time
+
+import pandas as pd
+
+import faldisco_globals as fg
+from faldisco_service import Faldisco_Job, Faldisco_Service
+from table_sample import Table_Sample
+
+
+def cache_sample(service: Faldisco_Service, name: str, num_rows: int, loaded: float = None) -> tuple:
+    sample = Table_Sample("main", name, ["id"], ["a"])
+    sample.df = pd.DataFrame({"r_j__id": range(num_rows), "r__a": range(num_rows)})
+    key = ("db", "main", name)
+    service.samples[key] = (
+        time.time() if loaded is None else loaded, Faldisco_Service.get_sample_memory(sample), sample
+    )
+    service.sample_locks[key] = threading.Lock()
+    return key
+
+
+def make_job(job_id: str, memory: int, sample_key: tuple) -> Faldisco_Job:
+    job = Faldisco_Job(job_id, {})
+    job.estimated_memory = memory
+    job.sample_key = sample_key
+    return job
+
+
+def test_cached_samples_count_against_the_memory_limit():
+    bytes_per_sample = 10 * fg.FALDISCO_SERVICE_BYTES_PER_VALUE
+    service = Faldisco_Service("db", max_jobs=4, memory_limit=4 * bytes_per_sample)
+    old = cache_sample(service, "old", 10)
+    used = cache_sample(service, "used", 10)
+    recent = cache_sample(service, "recent", 10)
+    service.running["1"] = make_job("1", bytes_per_sample, used)
+    service.queue.append(make_job("2", 2 * bytes_per_sample, ("db", "main", "other")))
+    assert service.next_job() is service.queue[0]
+    # the least recently used sample made room; the sample of the running job is not counted or evicted
+    assert list(service.samples.keys()) == [used, recent]
+    assert old not in service.sample_locks
+
+
+def test_expired_samples_and_their_locks_are_evicted(monkeypatch):
+    monkeypatch.setattr(fg, "FALDISCO_SERVICE_SAMPLE_TTL", 60)
+    service = Faldisco_Service("db")
+    expired = cache_sample(service, "expired", 10, time.time() - 120)
+    fresh = cache_sample(service, "fresh", 10)
+    service.evict_expired_samples()
+    assert list(service.samples.keys()) == [fresh]
+    assert expired not in service.sample_locks
+    service.refresh()
+    assert len(service.samples) == 0 and len(service.sample_locks) == 0
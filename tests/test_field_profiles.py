@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from field_profiles import Field_Profiles, Field_Profiles_Store, VALUE_KIND_TEXT
+
+
+def make_profile(min_val: str, max_val: str, from_db: bool) -> Field_Profiles:
+    return Field_Profiles(
+        100, 100, 1.0, 1, len(min_val), len(max_val), min_val, max_val, min_val, VALUE_KIND_TEXT, from_db
+    )
+
+
+def test_database_ranges_do_not_prune_exact_matches():
+    # a case-insensitive collation orders "b" before "C", Python orders "C" first - the ranges of the database
+    # profile do not overlap the target's in Python's ordering, but the values can still match
+    store = Field_Profiles_Store(["r__a", "t__a", "t__b"], ["db"] * 3, ["r", "t", "t"])
+    store.set_profile("t__a", make_profile("C", "C", False))
+    store.set_profile("t__b", make_profile("C", "C", False))
+    store.set_profile("r__a", make_profile("a", "b", False))
+    assert not store.exact_match_candidates(["r__a"], ["t__a"]).any()
+    store.set_profile("r__a", make_profile("a", "b", True))
+    assert store.exact_match_candidates(["r__a"], ["t__a", "t__b"]).all()
+    assert store.get_profile("r__a").is_from_db()
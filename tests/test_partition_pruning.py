@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sqlite3
+
+import pandas as pd
+import pytest
+from sqlalchemy import MetaData, create_engine
+
+from faldisco_context import Faldisco_Context
+from field_alignment import Field_Alignment
+from partition_pruning import Partition_Pruning
+
+PARTITIONS = ["2024-01-01", "2024-01-02", "2024-01-03"]
+NUM_KEYS = 50
+
+
+def make_partitioned_tables(path: str):
+    # the same keys in every partition - without the partition predicates every key joins 3 x 3 rows and is left
+    # out by the key count limits. Values name the partition of their row
+    connection = sqlite3.connect(path)
+    connection.execute("create table users (id integer, ds varchar(10), city varchar(20), age integer)")
+    connection.execute("create table events (id integer, ds varchar(10), state varchar(20), age_txt varchar(10))")
+    for ds in PARTITIONS:
+        for i in range(NUM_KEYS):
+            connection.execute("insert into users values (?, ?, ?, ?)", (i, ds, f"{ds} city{i % 5}", 20 + i))
+            connection.execute(
+                "insert into events values (?, ?, ?, ?)", (i, ds, f"{ds} state{i % 5}", str(20 + i))
+            )
+    connection.commit()
+    return connection
+
+
+def test_parse_partition():
+    assert Partition_Pruning.parse_partition("ds=2024-01-01, hr=12") == {"ds": "2024-01-01", "hr": "12"}
+    assert Partition_Pruning.parse_partition("ds") == {"ds": None}
+
+
+def test_literal_and_where():
+    assert Partition_Pruning.literal(12) == "12"
+    assert Partition_Pruning.literal("it's") == "'it''s'"
+    assert Partition_Pruning.literal(True) == "'True'"
+    where = Partition_Pruning.gen_where("r", {"ds": "2024-01-01", "hr": 12})
+    assert where == " where r.ds = '2024-01-01' and r.hr = 12"
+    assert Partition_Pruning.gen_where("r", {}) == ""
+
+
+# an explicit partition on one side and the latest partition on the other, both ways round
+@pytest.mark.parametrize(
+    "ref_spec,target_spec,ref_ds,target_ds",
+    [
+        ("ds=2024-01-02", "ds", "2024-01-02", "2024-01-03"),
+        ("ds", "ds=2024-01-01", "2024-01-03", "2024-01-01"),
+    ],
+)
+@pytest.mark.parametrize("slice_columns", [0, 1])
+def test_only_the_partition_is_fetched(tmp_path, ref_spec, target_spec, ref_ds, target_ds, slice_columns):
+    path = str(tmp_path / "partitions.db")
+    connection = make_partitioned_tables(path)
+    engine = create_engine(f"sqlite:///{path}")
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+    ref_partition = Partition_Pruning.get_partition(engine, "main", metadata.tables["users"], ref_spec)
+    target_partition = Partition_Pruning.get_partition(engine, "main", metadata.tables["events"], target_spec)
+    assert (ref_partition, target_partition) == ({"ds": ref_ds}, {"ds": target_ds})
+    fa = Field_Alignment(
+        "main",
+        "users",
+        "main",
+        "events",
+        ["id"],
+        ["city", "age"],
+        ["state", "age_txt"],
+        context=Faldisco_Context(FALDISCO_SLICE_COLUMNS=slice_columns),
+        ref_partition=ref_partition,
+        target_partition=target_partition,
+    )
+    if fa.is_sliced():
+        slices = []
+        for query in fa.gen_slice_sqls():
+            fa.add_slice(slices, pd.read_sql(query, connection))
+        fa.set_slices(slices)
+    else:
+        fa.df = pd.read_sql(fa.gen_sql(), connection)
+    assert len(fa.df) == NUM_KEYS
+    assert fa.df["r__city"].str.startswith(ref_ds).all()
+    assert fa.df["t__state"].str.startswith(target_ds).all()
+    assert sorted(fa.df["r_j__id"]) == list(range(NUM_KEYS))
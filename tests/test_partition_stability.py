@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import faldisco_globals as fg
+from faldisco_orchestrator import Faldisco_Orchestrator
+from faldisco_utils import FaldiscoUtils
+from sqlite_fixture import OUTPUT_FOLDER, get_alignments, run_alignment, use_output_folder
+
+# the last partition has no rows
+PARTITIONS = ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+NUM_KEYS = 60
+REF_FIELD_NAMES = ["city", "email", "zip"]
+TARGET_FIELD_NAMES = ["state", "contact", "zip_code"]
+
+
+def make_partitioned_tables(path: str):
+    # every partition has keys of its own. city and state align in every partition, email and contact are equal
+    # in 80% of the rows of the third partition and zip and zip_code are equal in the first two partitions only
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "create table users (id integer, ds varchar(10), city varchar(20), email varchar(40), zip varchar(10))"
+    )
+    connection.execute(
+        "create table events (id integer, ds varchar(10), state varchar(20), contact varchar(40), zip_code varchar(10))"
+    )
+    for p, ds in enumerate(PARTITIONS[:3]):
+        for i in range(NUM_KEYS):
+            key = p * 1000 + i
+            email = f"user{key}@example.com"
+            zip_code = str(10000 + key)
+            connection.execute(
+                "insert into users values (?, ?, ?, ?, ?)", (key, ds, f"city{i % 6}", email, zip_code)
+            )
+            connection.execute(
+                "insert into events values (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    ds,
+                    f"state{i % 6 % 3}",
+                    email if p < 2 or i < NUM_KEYS * 0.8 else f"other{key}@example.com",
+                    zip_code if p < 2 else str(90000 + key),
+                ),
+            )
+    connection.commit()
+    return connection
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_partitions_match_one_run_over_all_partitions(tmp_path, monkeypatch, workers):
+    use_output_folder(monkeypatch, tmp_path)
+    path = str(tmp_path / "partitions.db")
+    connection = make_partitioned_tables(path)
+    # pandas reads SQLAlchemy connections only from SQLAlchemy 2 - the samples are read with sqlite3
+    monkeypatch.setattr(
+        Faldisco_Orchestrator,
+        "read_sample",
+        staticmethod(
+            lambda engine, query, context=None: pd.read_sql(
+                query, sqlite3.connect(path), dtype_backend="numpy_nullable"
+            )
+        ),
+    )
+    FaldiscoUtils.find_partition_alignments(
+        db_url=f"sqlite:///{path}",
+        ref_schema_name="main",
+        ref_table_name="users",
+        ref_table_fields=REF_FIELD_NAMES,
+        ref_join_keys=["id"],
+        target_schema_name="main",
+        target_table_name="events",
+        target_table_fields=TARGET_FIELD_NAMES,
+        partitions=[(ds, {"ds": ds}, {"ds": ds}) for ds in PARTITIONS],
+        workers=workers,
+    )
+    results_df = pd.read_csv(f"{OUTPUT_FOLDER}{OUTPUT_FOLDER}users_to_events_field_alignments", index_col=0)
+
+    # the partitions hold every row of the tables, so one run over the tables finds the same alignments
+    expected = get_alignments(
+        run_alignment(connection, "users", REF_FIELD_NAMES, "events", TARGET_FIELD_NAMES, ["id"])
+    )
+    alignments = {
+        (row.reference_field_name, row.target_field_name, row.alignment_type): row.alignment_strength
+        for row in results_df.itertuples()
+    }
+    assert alignments.keys() == expected.keys()
+    for k, strength in expected.items():
+        assert alignments[k] == pytest.approx(strength)
+
+    # the partition without rows is left out of the partition strengths
+    stability = {
+        (row.reference_field_name, row.target_field_name, row.alignment_type): (
+            row.min_partition_strength,
+            row.max_partition_strength,
+            row.num_aligned_partitions,
+        )
+        for row in results_df.itertuples()
+    }
+    assert stability[("city", "state", fg.ALIGNMENT_TYPE_ALIGNMENT)] == (1.0, 1.0, 3)
+    assert stability[("email", "contact", fg.ALIGNMENT_TYPE_EXACT_MATCH)] == pytest.approx((0.8, 1.0, 3))
+    assert stability[("zip", "zip_code", fg.ALIGNMENT_TYPE_EXACT_MATCH)] == (0.0, 1.0, 2)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sqlite3
+
+import pandas as pd
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+from field_alignment import Field_Alignment
+from fixture_tables import make_regression_tables
+from sqlite_fixture import get_alignments, run_alignment, use_output_folder
+from table_sample import Table_Sample
+
+REF_FIELD_NAMES = ["age", "city", "zip", "vip"]
+TARGET_FIELD_NAMES = ["age_txt", "state", "zip_code", "flag"]
+
+
+def test_shared_sample_run_matches_single_run(tmp_path, monkeypatch):
+    # the target table only joins every third reference row, so the joined rows are not the whole shared
+    # sample - the run must still profile and score like a run of one reference and one target table
+    use_output_folder(monkeypatch, tmp_path)
+    connection = sqlite3.connect(":memory:")
+    make_regression_tables(connection)
+    connection.execute("create table some_events as select * from events where id % 3 = 0")
+    fa = run_alignment(
+        connection, "users", REF_FIELD_NAMES, "some_events", TARGET_FIELD_NAMES, ["id"], FALDISCO_TRANSFORMS=False
+    )
+
+    sample = Table_Sample(
+        "main", "users", ["id"], REF_FIELD_NAMES, context=Faldisco_Context(FALDISCO_TRANSFORMS=False)
+    )
+    sample.set_df(pd.read_sql(sample.gen_sql(), connection, dtype_backend="numpy_nullable"))
+    shared_fa = Field_Alignment(
+        "main", "users", "main", "some_events", ["id"], REF_FIELD_NAMES, TARGET_FIELD_NAMES, sample
+    )
+    shared_fa.join_sample(pd.read_sql(shared_fa.gen_sample_sql(), connection, dtype_backend="numpy_nullable"))
+    shared_fa.find_field_alignment()
+
+    assert len(shared_fa.df) < len(sample.df)
+    assert get_alignments(shared_fa) == get_alignments(fa)
+    pd.testing.assert_frame_equal(
+        shared_fa.profiles_to_df(fg.FIELD_PROFILES_TABLE_FIELDS), fa.profiles_to_df(fg.FIELD_PROFILES_TABLE_FIELDS)
+    )
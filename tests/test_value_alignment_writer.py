@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+import pandas as pd
+import pytest
+
+import faldisco_globals as fg
+from faldisco_context import Faldisco_Context
+from value_alignment_writer import Value_Alignment_Writer
+
+# (ref value, target value, alignment count, misalignment count) of one combination, in the order they are added
+VALUES = [
+    ("a", "x", 3, 1),
+    ("b", "y", 9, 0),
+    ("c", "z", 1, 2),
+    ("d", "x", 9, 1),
+    ("e", "w", 5, 0),
+    ("f", "v", 3, 4),
+]
+
+
+def write(path: str, **settings) -> Value_Alignment_Writer:
+    writer = Value_Alignment_Writer(path, Faldisco_Context(**settings))
+    writer.start_combination("db", "users", "city", "db", "events", "state", fg.ALIGNMENT_TYPE_ALIGNMENT)
+    for value in VALUES:
+        writer.add_value(*value)
+    writer.end_combination()
+    return writer
+
+
+def read_values(path: str) -> [(str, str, int, int)]:
+    df = pd.read_csv(path, index_col=0)
+    assert list(df.columns) == fg.FIELD_VALUE_ALIGNMENT_TABLE_FIELDS
+    assert list(df.index) == list(range(len(df)))
+    return [tuple(row[6:8]) + tuple(int(c) for c in row[9:11]) for row in df.itertuples(index=False)]
+
+
+def test_every_value_is_written_without_a_cap(tmp_path):
+    path = str(tmp_path / "values")
+    assert write(path, FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION=0).close() == len(VALUES)
+    assert read_values(path) == VALUES
+
+
+def test_capped_combination_keeps_the_largest_counts_and_an_other_row(tmp_path):
+    # the 3 largest alignment counts in the order they were added, then the totals of the rest
+    path = str(tmp_path / "values")
+    assert write(path, FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION=3).close() == 4
+    assert read_values(path) == [
+        ("b", "y", 9, 0),
+        ("d", "x", 9, 1),
+        ("e", "w", 5, 0),
+        (fg.FALDISCO_OTHER, fg.FALDISCO_OTHER, 3 + 1 + 3, 1 + 2 + 4),
+    ]
+
+
+def test_no_other_row_when_every_value_is_kept(tmp_path):
+    path = str(tmp_path / "values")
+    assert write(path, FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION=len(VALUES)).close() == len(VALUES)
+    assert read_values(path) == VALUES
+
+
+@pytest.mark.parametrize("compression,suffix", [("gzip", ".gz"), ("bz2", ".bz2"), ("xz", ".xz")])
+def test_compressed_file(tmp_path, compression, suffix):
+    path = str(tmp_path / "values")
+    write(
+        path, FALDISCO_VALUE_ALIGNMENTS_PER_COMBINATION=0, FALDISCO_VALUE_ALIGNMENTS_COMPRESSION=compression
+    ).close()
+    assert os.listdir(tmp_path) == [f"values{suffix}"]
+    assert read_values(path + suffix) == VALUES
+
+
+def test_abort_leaves_no_file(tmp_path):
+    write(str(tmp_path / "values")).abort()
+    assert os.listdir(tmp_path) == []
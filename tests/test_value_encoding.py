@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sqlite3
+
+import faldisco_globals as fg
+from sqlite_fixture import get_alignments, run_alignment, use_output_folder
+
+
+def make_cross_kind_tables() -> sqlite3.Connection:
+    # the same ages as an INTEGER column of the reference and as a VARCHAR column of the target
+    connection = sqlite3.connect(":memory:")
+    connection.execute("create table ref (id integer, age integer, city varchar(20))")
+    connection.execute("create table tgt (id integer, age_txt varchar(20), state varchar(20))")
+    for i in range(400):
+        age = 18 + (i * 7) % 60
+        connection.execute("insert into ref values (?, ?, ?)", (i, age, f"city{i % 40}"))
+        connection.execute("insert into tgt values (?, ?, ?)", (i, str(age), f"state{i % 40 % 7}"))
+    return connection
+
+
+def test_cross_kind_exact_match(tmp_path, monkeypatch):
+    use_output_folder(monkeypatch, tmp_path)
+    fa = run_alignment(
+        make_cross_kind_tables(), "ref", ["age", "city"], "tgt", ["age_txt", "state"], ["id"],
+        FALDISCO_TRANSFORMS=False,
+    )
+    assert fa.field_profiles.is_text_combination("r__age", "t__age_txt")
+    alignments = get_alignments(fa)
+    assert alignments[("age", "age_txt", fg.ALIGNMENT_TYPE_EXACT_MATCH)] == 1.0
+    assert alignments[("city", "state", fg.ALIGNMENT_TYPE_ALIGNMENT)] == 1.0
+
+
+def test_same_kind_numbers_stay_native(tmp_path, monkeypatch):
+    use_output_folder(monkeypatch, tmp_path)
+    connection = make_cross_kind_tables()
+    connection.execute("create table tgt2 (id integer, age2 integer)")
+    connection.execute("insert into tgt2 select id, cast(age_txt as integer) from tgt")
+    fa = run_alignment(
+        connection, "ref", ["age"], "tgt2", ["age2"], ["id"], FALDISCO_TRANSFORMS=False
+    )
+    assert not fa.field_profiles.is_text_combination("r__age", "t__age2")
+    assert get_alignments(fa)[("age", "age2", fg.ALIGNMENT_TYPE_EXACT_MATCH)] == 1.0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pandas as pd
+
+from faldisco_context import Faldisco_Context
+from value_matches import Value_Matches
+
+
+def test_shared_dictionary_is_not_copied_or_changed():
+    shared = Value_Matches([], [])
+    shared_codes = shared.encode_values(pd.Series(["a", "b", "c"]))
+    vm = Value_Matches(["r__x"], ["t__y"])
+    vm.load_dictionary(shared)
+    codes = vm.encode_values(pd.Series(["b", "d", None]))
+    assert shared.num_values() == 3
+    assert len(vm.values) == 2
+    assert codes[0] == shared_codes[1]
+    assert [vm.decode_value(c) for c in codes] == ["b", "d", "FALDISCO_NULL"]
+
+
+def test_merge_runs_of_a_shared_dictionary():
+    shared = Value_Matches([], [])
+    shared.encode_values(pd.Series(["a", "b"]))
+    runs = []
+    for targets in (["x", "a"], ["y", "x"]):
+        vm = Value_Matches(["r__x"], ["t__y"])
+        vm.load_dictionary(shared)
+        ref_codes = vm.encode_values(pd.Series(["a", "b"]))
+        vm.add_values("r__x", "t__y", ref_codes, vm.encode_values(pd.Series(targets)))
+        runs.append(vm)
+    runs[0].merge(runs[1])
+    ref_values, target_values, counts = runs[0].get_count_table("r__x", "t__y")
+    merged = {
+        (runs[0].decode_value(r), runs[0].decode_value(t)): c
+        for r, t, c in zip(ref_values, target_values, counts)
+    }
+    assert merged == {("a", "x"): 1, ("b", "a"): 1, ("a", "y"): 1, ("b", "x"): 1}
+
+
+def test_spill_combinations_counted_out_of_order(tmp_path):
+    # (r__b, t__y) gets its combination id at the first spill, before (r__a, t__y) does
+    vm = Value_Matches(["r__a", "r__b"], ["t__y"], Faldisco_Context(VALUE_MATCHES_SPILL_PARTITIONS=2))
+    vm.spill_root = str(tmp_path)
+    codes = vm.encode_values(pd.Series(["a", "b", "c", "d"]))
+    vm.add_values("r__b", "t__y", codes[:2], codes[2:])
+    vm.spill()
+    vm.add_values("r__a", "t__y", codes[:2], codes[:2])
+    vm.add_values("r__b", "t__y", codes[:2], codes[2:])
+    vm.spill()
+    combinations = [("r__a", "t__y"), ("r__b", "t__y")]
+    counts = {c: {} for c in combinations}
+    for p in range(2):
+        for c, (ref_values, target_values, value_counts) in zip(
+                combinations, vm.get_partition_tables(p, combinations)
+        ):
+            for r, t, n in zip(ref_values, target_values, value_counts):
+                counts[c][(vm.decode_value(r), vm.decode_value(t))] = int(n)
+    vm.cleanup()
+    assert counts == {
+        ("r__a", "t__y"): {("a", "a"): 1, ("b", "b"): 1},
+        ("r__b", "t__y"): {("a", "c"): 2, ("b", "d"): 2},
+    }
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# pyre-strict
+
+
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import sqlite3
+
+import pytest
+
+import faldisco_globals as fg
+from sqlite_fixture import get_alignments, run_alignment, use_output_folder
+
+REF_FIELD_NAMES = ["email", "phone", "cents"]
+TARGET_FIELD_NAMES = ["email_md5", "email_norm", "phone_digits", "amount"]
+TRANSFORM_MATCHES = {
+    ("email", "email_md5"): "md5",
+    ("email", "email_norm"): "lower trim",
+    ("phone", "phone_digits"): "digits",
+    ("cents", "amount"): "divided by 100",
+}
+
+
+def make_transform_tables() -> sqlite3.Connection:
+    # every target field is a function of a unique ref field; their value ranges do not overlap, so none of them
+    # is an exact match candidate. city and state are an unrelated pair that aligns as is
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        "create table ref (id integer, email varchar(40), phone varchar(20), cents integer, city varchar(20))"
+    )
+    connection.execute(
+        "create table tgt (id integer, email_md5 varchar(40), email_norm varchar(40), phone_digits varchar(20),"
+        " amount real, state varchar(20))"
+    )
+    for i in range(300):
+        email = f" User{i}@Example.com "
+        phone = f"(555) {100 + i}-{1000 + i * 7}"
+        cents = 1000 + i * 37
+        connection.execute("insert into ref values (?, ?, ?, ?, ?)", (i, email, phone, cents, f"city{i % 20}"))
+        connection.execute(
+            "insert into tgt values (?, ?, ?, ?, ?, ?)",
+            (
+                i,
+                hashlib.md5(email.encode("utf-8")).hexdigest(),
+                email.strip().lower(),
+                f"555{100 + i}{1000 + i * 7}",
+                cents / 100,
+                f"state{i % 20 % 5}",
+            ),
+        )
+    return connection
+
+
+# the transforms are found whether or not any other combination of the tables matches
+@pytest.mark.parametrize("with_other_match", [False, True])
+def test_transform_matches(tmp_path, monkeypatch, with_other_match):
+    use_output_folder(monkeypatch, tmp_path)
+    fa = run_alignment(
+        make_transform_tables(),
+        "ref",
+        REF_FIELD_NAMES + (["city"] if with_other_match else []),
+        "tgt",
+        TARGET_FIELD_NAMES + (["state"] if with_other_match else []),
+        ["id"],
+    )
+    alignments = get_alignments(fa)
+    for (r, t), name in TRANSFORM_MATCHES.items():
+        assert alignments[(r, t, fg.make_transform_alignment_type(name))] == 1.0
+    assert (("city", "state", fg.ALIGNMENT_TYPE_ALIGNMENT) in alignments) == with_other_match